@@ -0,0 +1,77 @@
+"""
+Compare HTML parser backends on saved chapter pages.
+
+Usage:
+    python benchmarks/bench_parsers.py [--repeat 50] [page.html ...]
+
+With no page arguments, every file in benchmarks/fixtures/ is used.
+Each backend parses the page and extracts title, content and next link,
+exactly as scraper.py does; the extracted content is cross-checked
+against the bs4 backend so a fast-but-wrong backend shows up.
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from echopage.parsing import BACKENDS, available_backends  # noqa: E402
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+SELECTORS = ("h1", "div.chapter-content", "a.next")
+
+
+def _extract(backend, html):
+    doc = backend.parse(html)
+    return backend.title(doc), backend.content(doc), backend.next_href(doc)
+
+
+def _normalize(text):
+    return " ".join((text or "").split())
+
+
+def bench_page(path, names, repeat):
+    html = path.read_text(encoding="utf-8")
+    reference = _extract(BACKENDS["bs4"](*SELECTORS), html)
+    rows = []
+    for name in names:
+        backend = BACKENDS[name](*SELECTORS)
+        title, content, next_href = _extract(backend, html)
+        matches = (title == reference[0]
+                   and _normalize(content) == _normalize(reference[1])
+                   and next_href == reference[2])
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            _extract(backend, html)
+            samples.append(time.perf_counter() - start)
+        rows.append((name, statistics.median(samples), min(samples), matches))
+    return len(html), rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("pages", nargs="*", type=Path)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    pages = args.pages or sorted(FIXTURES.glob("*.html"))
+    names = available_backends()
+    if "bs4" not in names:
+        sys.exit("bs4 backend is required as the reference")
+
+    for page in pages:
+        size, rows = bench_page(page, names, args.repeat)
+        baseline = dict((r[0], r[1]) for r in rows)["bs4"]
+        print(f"\n{page.name} ({size / 1024:.0f} KiB, {args.repeat} runs)")
+        print(f"  {'backend':<12}{'median ms':>11}{'min ms':>9}{'speedup':>9}  output")
+        for name, median, best, matches in rows:
+            print(f"  {name:<12}{median * 1e3:>11.2f}{best * 1e3:>9.2f}"
+                  f"{baseline / median:>8.1f}x  {'ok' if matches else 'DIFFERS'}")
+
+
+if __name__ == "__main__":
+    main()
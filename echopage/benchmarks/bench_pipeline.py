@@ -0,0 +1,299 @@
+"""
+End-to-end throughput benchmark: scrape -> TTS -> compile -> upload, offline.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--chapters 50] [--words 2000]
+        [--tts-latency 0.05] [--concurrency 8] [--mode pipeline|stages]
+        [--real-ffmpeg] [--no-upload] [--json results.json]
+
+A synthetic novel is served from a local HTTP server, edge_tts.Communicate
+is replaced by a deterministic fake (see fakes.py) and, unless
+--real-ffmpeg is given, so are the ffmpeg encode/mux steps. Upload goes to
+the local fake Drive backend. Everything runs in a scratch directory.
+
+--mode pipeline times run_pipeline as it is used in production, with the
+stages overlapping; per-stage figures are then busy time summed over
+chapters. --mode stages runs scrape, TTS and compile one after another
+for clean per-stage wall times. Reports chapters/sec, peak RSS and
+p50/p95 per-chapter latency (fetch start to finished AAC segment).
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from drive_fake import install_fake_drive  # noqa: E402
+from fakes import FakeCommunicate, NovelServer, install_fake_ffmpeg  # noqa: E402
+
+TITLE = "Bench Novel"
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None, None
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2**20
+    return own, children
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class _TimedPool:
+    """Executor proxy that reports when each submitted task finishes.
+
+    Timing happens in this process, around submit and the future's
+    completion, so it works for the spawned process pool as well as the
+    thread pool the fakes use.
+    """
+
+    def __init__(self, pool, on_done):
+        self._pool = pool
+        self._on_done = on_done
+
+    def submit(self, fn, *args, **kwargs):
+        start = time.perf_counter()
+        future = self._pool.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda f: self._on_done(fn, args, start, time.perf_counter()))
+        return future
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    def __enter__(self):
+        self._pool.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._pool.__exit__(*exc)
+
+
+class Probe:
+    """Wraps echopage functions to timestamp each chapter through the stages."""
+
+    def __init__(self):
+        self.busy = defaultdict(float)
+        self.fetch_start = {}      # url -> first fetch start
+        self.url_of = {}           # mp3 path -> url
+        self.latency = {}          # url -> fetch start to finished AAC segment
+
+    @property
+    def latencies(self):
+        return list(self.latency.values())
+
+    def install(self, scraper, tts, audio):
+        fetch_html = scraper.fetch_html
+        synthesize_chapter = tts.synthesize_chapter
+        encode_pool = audio.encode_pool
+
+        def timed_fetch(url):
+            start = time.perf_counter()
+            self.fetch_start.setdefault(url, start)
+            try:
+                return fetch_html(url)
+            finally:
+                self.busy["scrape"] += time.perf_counter() - start
+
+        async def timed_synthesize(chap, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                path = await synthesize_chapter(chap, *args, **kwargs)
+            finally:
+                self.busy["tts"] += time.perf_counter() - start
+            if path:
+                self.url_of[str(path)] = chap.get("url")
+            return path
+
+        def encoded(fn, args, start, end):
+            if fn is scraper.parse_page:
+                # The encode pool also parses prefetched pages
+                return
+            # Submit-to-done, so this includes time queued for a free worker
+            self.busy["encode"] += end - start
+            url = self.url_of.get(str(args[0])) if args else None
+            if url in self.fetch_start and url not in self.latency:
+                self.latency[url] = end - self.fetch_start[url]
+
+        scraper.fetch_html = timed_fetch
+        tts.synthesize_chapter = timed_synthesize
+        audio.encode_pool = lambda workers=None, backend=None: _TimedPool(
+            encode_pool(workers, backend), encoded)
+
+
+def _configure_env(workdir: Path, args):
+    os.environ.update({
+        "TTS_ENGINE": "edge",
+        "TTS_CONCURRENCY": str(args.concurrency),
+        "TTS_REQUESTS_PER_SEC": str(args.rps),
+        "TTS_CACHE": "0",
+        "HTTP_CACHE": "0",
+        "SCRAPE_RATE": str(args.scrape_rate),
+        "SCRAPE_PREFETCH": args.prefetch,
+        "TOC_SELECTOR": "ul.chapter-list a",
+        "DRIVE_FOLDER_CACHE": str(workdir / "cache" / "drive_folders.json"),
+        "DRIVE_UPLOAD_STATE": str(workdir / "cache" / "drive_uploads.json"),
+    })
+    if args.encode_workers:
+        os.environ["ENCODE_WORKERS"] = str(args.encode_workers)
+    if args.backend:
+        os.environ["EXEC_BACKEND"] = args.backend
+    if args.workers:
+        os.environ["EXEC_WORKERS"] = str(args.workers)
+
+
+def run(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="echopage-bench-"))
+    cwd = os.getcwd()
+    os.chdir(workdir)  # output/, logs/ and cache/ are relative to the cwd
+    try:
+        _configure_env(workdir, args)
+        import logging
+
+        from echopage import audio, metrics, pipeline, scraper, tts, tts_engines
+        from echopage.drive_upload import upload_outputs
+        logging.getLogger("echopage").setLevel(logging.WARNING)
+
+        FakeCommunicate.latency = args.tts_latency
+        tts_engines.Communicate = FakeCommunicate
+        if not args.real_ffmpeg:
+            install_fake_ffmpeg()
+        install_fake_drive(workdir / "drive")
+        probe = Probe()
+        probe.install(scraper, tts, audio)
+
+        stages = {}
+        metrics.start_run()
+        with NovelServer(args.chapters, args.words, args.server_latency) as server:
+            scraper.TOC_URL = server.toc_url
+            start = time.perf_counter()
+            if args.mode == "pipeline":
+                compile_audio = pipeline.compile_audio
+
+                def timed_compile(*a, **kw):
+                    began = time.perf_counter()
+                    try:
+                        return compile_audio(*a, **kw)
+                    finally:
+                        stages["compile"] = time.perf_counter() - began
+
+                pipeline.compile_audio = timed_compile
+                pipeline.run_pipeline(server.start_url, args.chapters, TITLE)
+                compile_seconds = stages.pop("compile")
+                stages["scrape+tts+encode"] = time.perf_counter() - start - compile_seconds
+                stages["compile"] = compile_seconds
+            else:
+                t = time.perf_counter()
+                chapters = scraper.scrape_chapters(server.start_url, args.chapters, TITLE)
+                stages["scrape"] = time.perf_counter() - t
+                t = time.perf_counter()
+                files = tts.generate_audio(chapters, TITLE)
+                stages["tts"] = time.perf_counter() - t
+                t = time.perf_counter()
+                audio.compile_audio(files, TITLE, titles=[c["title"] for c in chapters])
+                stages["compile"] = time.perf_counter() - t
+            produced = time.perf_counter() - start
+
+            if args.upload:
+                t = time.perf_counter()
+                upload_outputs(TITLE)
+                stages["upload"] = time.perf_counter() - t
+            total = time.perf_counter() - start
+
+        own_rss, child_rss = _peak_rss_mb()
+        return {
+            "mode": args.mode,
+            "chapters": args.chapters,
+            "words_per_chapter": args.words,
+            "fake_ffmpeg": not args.real_ffmpeg,
+            "http_requests": server.requests,
+            "total_seconds": total,
+            "chapters_per_sec": args.chapters / produced if produced else 0.0,
+            "stages_seconds": stages,
+            "busy_seconds": dict(probe.busy),
+            "latency_p50": _percentile(probe.latencies, 50),
+            "latency_p95": _percentile(probe.latencies, 95),
+            "peak_rss_mb": own_rss,
+            "peak_child_rss_mb": child_rss,
+            "metrics": metrics.snapshot(),
+        }
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Scratch directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _report(result):
+    print(f"\n{result['chapters']} chapters x {result['words_per_chapter']} words, "
+          f"mode={result['mode']}, "
+          f"{'fake' if result['fake_ffmpeg'] else 'real'} ffmpeg")
+    print(f"  {'stage':<20}{'seconds':>10}")
+    for stage, seconds in result["stages_seconds"].items():
+        print(f"  {stage:<20}{seconds:>10.2f}")
+    if result["mode"] == "pipeline":
+        for stage, seconds in result["busy_seconds"].items():
+            print(f"  {stage + ' (busy)':<20}{seconds:>10.2f}")
+    print(f"  {'total':<20}{result['total_seconds']:>10.2f}")
+    print(f"\n  chapters/sec         {result['chapters_per_sec']:.2f}")
+    if result["mode"] == "pipeline":
+        print(f"  chapter latency p50  {result['latency_p50'] * 1e3:.0f} ms")
+        print(f"  chapter latency p95  {result['latency_p95'] * 1e3:.0f} ms")
+    if result["peak_rss_mb"] is not None:
+        print(f"  peak RSS             {result['peak_rss_mb']:.0f} MiB "
+              f"(children {result['peak_child_rss_mb']:.0f} MiB)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chapters", type=int, default=50)
+    parser.add_argument("--words", type=int, default=2000, help="words per chapter")
+    parser.add_argument("--mode", choices=("pipeline", "stages"), default="pipeline")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent TTS requests")
+    parser.add_argument("--rps", type=float, default=0, help="TTS requests/sec (0 = unlimited)")
+    parser.add_argument("--tts-latency", type=float, default=0.05,
+                        help="seconds the fake TTS takes per request")
+    parser.add_argument("--server-latency", type=float, default=0.0,
+                        help="seconds the local server waits before each page")
+    parser.add_argument("--scrape-rate", type=float, default=0,
+                        help="page requests/sec (0 = unlimited; production default 1)")
+    parser.add_argument("--prefetch", choices=("off", "toc", "pattern"), default="off",
+                        help="speculative chapter prefetch mode")
+    parser.add_argument("--encode-workers", type=int, default=None)
+    parser.add_argument("--backend", choices=("serial", "threads", "processes"), default=None,
+                        help="execution backend for parsing (encoding too with --real-ffmpeg)")
+    parser.add_argument("--workers", type=int, default=None, help="execution backend workers")
+    parser.add_argument("--real-ffmpeg", action="store_true",
+                        help="encode and mux with ffmpeg instead of the fakes")
+    parser.add_argument("--no-upload", dest="upload", action="store_false")
+    parser.add_argument("--json", type=Path, help="also write the results here")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    _report(result)
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+# benchmarks/drive_fake.py
+"""
+Local stand-in for the subset of the Drive v3 API that drive_upload uses.
+
+install_fake_drive() points echopage.drive_upload at it. Files live under
+a local root directory with a JSON index, so benchmarks and tests can
+exercise folder lookup, MD5-based skipping and chunked/resumable uploads
+without network access or credentials. Pass interrupt_after=N to make a service drop the
+connection after N chunks, once, to exercise resume paths. Resuming a
+session URI the fake never issued fails with 404, as an expired Drive
+session does.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import uuid
+from pathlib import Path
+
+_lock = threading.Lock()
+
+_CLAUSES = [
+    (re.compile(r"^mimeType='(?P<v>(?:[^'\\]|\\.)*)'$"), lambda f, v: f.get("mimeType") == v),
+    (re.compile(r"^name='(?P<v>(?:[^'\\]|\\.)*)'$"), lambda f, v: f["name"] == v),
+    (re.compile(r"^'(?P<v>[^']*)' in parents$"), lambda f, v: v in f.get("parents", [])),
+    (re.compile(r"^trashed=false$"), lambda f, v: True),
+]
+
+
+def _unquote(value: str) -> str:
+    return re.sub(r"\\(.)", r"\1", value)
+
+
+def _matcher(query: str):
+    tests = []
+    for clause in (query or "").split(" and "):
+        clause = clause.strip()
+        if not clause:
+            continue
+        for pattern, test in _CLAUSES:
+            m = pattern.match(clause)
+            if m:
+                value = _unquote(m.group("v")) if "v" in pattern.groupindex else None
+                tests.append((test, value))
+                break
+        else:
+            raise ValueError(f"Unsupported query clause: {clause}")
+    return lambda f: all(test(f, value) for test, value in tests)
+
+
+class FakeMediaUpload:
+    """Mirror of googleapiclient.http.MediaFileUpload's reading interface."""
+
+    def __init__(self, filename, mimetype=None, chunksize=100 * 1024 * 1024, resumable=False):
+        self._filename = filename
+        self._chunksize = chunksize
+        self._resumable = resumable
+        self._size = os.path.getsize(filename)
+
+    def chunksize(self):
+        return self._chunksize
+
+    def size(self):
+        return self._size
+
+    def resumable(self):
+        return self._resumable
+
+    def getbytes(self, begin, length):
+        with open(self._filename, "rb") as f:
+            f.seek(begin)
+            return f.read(length)
+
+
+class FakeHttpError(Exception):
+    """An HTTP error response, shaped like googleapiclient's HttpError."""
+
+    def __init__(self, status, reason):
+        super().__init__(f"<HttpError {status}: {reason}>")
+        self.resp = type("Response", (), {"status": status, "reason": reason})()
+
+
+class _Status:
+    def __init__(self, done, total):
+        self.resumable_progress = done
+        self.total_size = total
+
+    def progress(self):
+        return self.resumable_progress / self.total_size if self.total_size else 1.0
+
+
+class _Call:
+    def __init__(self, fn):
+        self._fn = fn
+
+    def execute(self, num_retries=0):
+        return self._fn()
+
+
+class _UploadCall:
+    """A create/update request carrying media, usable like googleapiclient's HttpRequest."""
+
+    def __init__(self, service, finish, media):
+        self._service = service
+        self._finish = finish
+        self.resumable = media
+        self.resumable_uri = None
+        self.resumable_progress = 0
+        self._in_error_state = False
+
+    def execute(self, num_retries=0):
+        data = self.resumable.getbytes(0, self.resumable.size())
+        return self._finish(data)
+
+    def next_chunk(self, num_retries=0):
+        service = self._service
+        if self.resumable_uri is None:
+            self.resumable_uri = f"fake://upload/{uuid.uuid4().hex}"
+            part = service._session_path(self.resumable_uri)
+            part.parent.mkdir(parents=True, exist_ok=True)
+            part.touch()
+        part = service._session_path(self.resumable_uri)
+        if self._in_error_state:
+            # Ask the "server" how much it has, as the real client does
+            if not part.exists():
+                raise FakeHttpError(404, "Not Found")
+            self.resumable_progress = part.stat().st_size
+            self._in_error_state = False
+
+        if service._interrupt_after is not None:
+            if service._interrupt_after <= 0:
+                service._interrupt_after = None
+                self._in_error_state = True
+                raise ConnectionError("fake connection reset")
+            service._interrupt_after -= 1
+
+        total = self.resumable.size()
+        chunk = self.resumable.getbytes(self.resumable_progress, self.resumable.chunksize())
+        part.parent.mkdir(parents=True, exist_ok=True)
+        with open(part, "ab") as f:
+            f.truncate(self.resumable_progress)
+            f.write(chunk)
+        self.resumable_progress += len(chunk)
+        if self.resumable_progress < total:
+            return _Status(self.resumable_progress, total), None
+        data = part.read_bytes()
+        part.unlink()
+        return None, self._finish(data)
+
+
+class _About:
+    def __init__(self, service):
+        self._service = service
+
+    def get(self, fields=None, **_):
+        # One account per fake root
+        root = str(self._service.root.resolve())
+        account = "fake-" + hashlib.md5(root.encode("utf-8")).hexdigest()[:12]
+        return _Call(lambda: {"user": {"permissionId": account}})
+
+
+class _Files:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, q=None, spaces=None, fields=None, pageSize=100, pageToken=None, **_):
+        def run():
+            match = _matcher(q)
+            files = [f for f in self._service._index().values() if match(f)]
+            files.sort(key=lambda f: f["name"])
+            start = int(pageToken or 0)
+            page = files[start:start + pageSize]
+            result = {"files": [dict(f) for f in page]}
+            if start + pageSize < len(files):
+                result["nextPageToken"] = str(start + pageSize)
+            return result
+        return _Call(run)
+
+    def create(self, body=None, media_body=None, fields=None, **_):
+        body = dict(body or {})
+        if media_body is None:
+            return _Call(lambda: self._service._put(body, None))
+        return _UploadCall(self._service, lambda data: self._service._put(body, data), media_body)
+
+    def get(self, fileId=None, fields=None, **_):
+        def run():
+            entry = self._service._index().get(fileId)
+            if entry is None:
+                raise FakeHttpError(404, "File not found")
+            return dict(entry)
+        return _Call(run)
+
+    def delete(self, fileId=None, **_):
+        return _Call(lambda: self._service._delete(fileId))
+
+    def update(self, fileId=None, body=None, media_body=None, fields=None, **_):
+        changes = dict(body or {}, id=fileId)
+        if media_body is None:
+            return _Call(lambda: self._service._put(changes, None))
+        return _UploadCall(self._service, lambda data: self._service._put(changes, data), media_body)
+
+
+class FakeDriveService:
+    """Drive v3 `service` look-alike backed by a directory."""
+
+    def __init__(self, root, interrupt_after: int = None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._interrupt_after = interrupt_after
+
+    def files(self):
+        return _Files(self)
+
+    def about(self):
+        return _About(self)
+
+    def _index_path(self):
+        return self.root / "index.json"
+
+    def _index(self):
+        try:
+            return json.loads(self._index_path().read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _session_path(self, uri):
+        return self.root / "sessions" / uri.rsplit("/", 1)[-1]
+
+    def _delete(self, file_id):
+        with _lock:
+            index = self._index()
+            index.pop(file_id, None)
+            self._write_index(index)
+
+    def _write_index(self, index):
+        tmp = self._index_path().with_suffix(".tmp")
+        tmp.write_text(json.dumps(index), encoding="utf-8")
+        os.replace(tmp, self._index_path())
+
+    def _put(self, meta, data):
+        with _lock:
+            index = self._index()
+            file_id = meta.get("id") or uuid.uuid4().hex[:16]
+            entry = index.get(file_id, {"id": file_id, "parents": []})
+            entry.update({k: v for k, v in meta.items() if k != "id"})
+            if data is not None:
+                blob = self.root / "blobs" / file_id
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                blob.write_bytes(data)
+                entry["md5Checksum"] = hashlib.md5(data).hexdigest()
+                entry["size"] = str(len(data))
+            index[file_id] = entry
+            self._write_index(index)
+        return {"id": file_id}
+
+
+def install_fake_drive(root, interrupt_after: int = None):
+    """
+    Make echopage.drive_upload talk to a FakeDriveService under root, with
+    no credentials. interrupt_after applies to every service it builds.
+    """
+    from echopage import drive_upload
+    drive_upload.get_credentials = lambda: None
+    drive_upload.build_service = lambda creds=None: FakeDriveService(root, interrupt_after)
+    drive_upload._media_upload = lambda path, resumable: FakeMediaUpload(
+        str(path), chunksize=drive_upload.DRIVE_CHUNK_SIZE, resumable=resumable)
@@ -0,0 +1,169 @@
+"""
+Offline stand-ins used by the pipeline benchmark.
+
+- NovelServer: serves a synthetic N-chapter novel over local HTTP.
+- FakeCommunicate: deterministic drop-in for edge_tts.Communicate that
+  emits silent MP3 frames whose duration tracks the text length.
+- install_fake_ffmpeg: swaps the ffmpeg-backed parts of echopage.audio for
+  byte-level equivalents, so the compile stage runs without ffmpeg.
+"""
+import asyncio
+import http.server
+import random
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# MPEG-2 Layer III, 48 kbps, 24 kHz, mono: the format edge-tts produces.
+# A header followed by zeroed side info / main data decodes as silence.
+MP3_FRAME = bytes([0xFF, 0xF3, 0x64, 0xC0]) + bytes(140)
+FRAME_SECONDS = 576 / 24000
+SPOKEN_CHARS_PER_SEC = 15
+
+_WORDS = ("the a of and to in he she it was said cultivator sect elder jade sword "
+          "qi dao heaven mountain disciple ancient formation pill realm silence wind "
+          "moon spirit beast palace clan treasure lightning").split()
+
+
+def chapter_html(number: int, total: int, words: int, seed: int = 0) -> str:
+    rng = random.Random(seed * 1_000_003 + number)
+    paragraphs = []
+    remaining = words
+    while remaining > 0:
+        n = min(remaining, rng.randint(40, 120))
+        text = " ".join(rng.choice(_WORDS) for _ in range(n))
+        paragraphs.append(f"<p>{text[0].upper()}{text[1:]}.</p>")
+        remaining -= n
+    next_link = (f'<a class="next" href="/novel/chapter-{number + 1}">Next</a>'
+                 if number < total else "")
+    return (f"<html><head><title>Chapter {number}</title></head><body>"
+            f"<h1>Chapter {number}</h1><div class=\"chapter-content\">"
+            f"{''.join(paragraphs)}</div>{next_link}</body></html>")
+
+
+def toc_html(total: int) -> str:
+    links = "".join(f'<li><a href="/novel/chapter-{n}">Chapter {n}</a></li>'
+                    for n in range(1, total + 1))
+    return f'<html><body><h1>Contents</h1><ul class="chapter-list">{links}</ul></body></html>'
+
+
+class NovelServer:
+    """Threaded local HTTP server for /novel/chapter-<n> pages and a /novel/ TOC."""
+
+    def __init__(self, chapters: int, words: int = 2000, latency: float = 0.0):
+        self.chapters = chapters
+        self.words = words
+        self.latency = latency
+        self.requests = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests += 1
+                m = re.match(r"^/novel/chapter-(\d+)$", self.path)
+                number = int(m.group(1)) if m else 0
+                if self.path == "/novel/":
+                    body = toc_html(server.chapters).encode("utf-8")
+                elif 1 <= number <= server.chapters:
+                    body = chapter_html(number, server.chapters, server.words).encode("utf-8")
+                else:
+                    self.send_error(404)
+                    return
+                if server.latency:
+                    threading.Event().wait(server.latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def start_url(self) -> str:
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/novel/chapter-1"
+
+    @property
+    def toc_url(self) -> str:
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}/novel/"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def silent_mp3(seconds: float) -> bytes:
+    return MP3_FRAME * max(1, round(seconds / FRAME_SECONDS))
+
+
+class FakeCommunicate:
+    """edge_tts.Communicate look-alike: fixed latency, deterministic audio."""
+
+    latency = 0.05            # seconds per request
+    chars_per_second = 0.0    # extra synthesis time per character (0 = none)
+
+    def __init__(self, text, voice=None, rate=None, volume=None, **_):
+        self.text = text
+
+    async def _wait(self):
+        delay = self.latency + (len(self.text) / self.chars_per_second
+                                if self.chars_per_second else 0.0)
+        await asyncio.sleep(delay)
+
+    async def stream(self):
+        await self._wait()
+        audio = silent_mp3(len(self.text) / SPOKEN_CHARS_PER_SEC)
+        step = len(MP3_FRAME) * 64
+        for i in range(0, len(audio), step):
+            yield {"type": "audio", "data": audio[i:i + step]}
+
+    async def save(self, audio_fname, metadata_fname=None):
+        with open(audio_fname, "wb") as f:
+            async for chunk in self.stream():
+                f.write(chunk["data"])
+
+
+def _fake_encode_chapter(mp3_path, profiles=None):
+    from echopage import audio
+    segments = [audio.segment_path_for(mp3_path, profile)
+                for profile in audio.output_profiles(profiles)
+                if profile in audio.SEGMENT_SUFFIXES]
+    for segment in segments:
+        shutil.copyfile(mp3_path, segment)
+    return str(segments[0]) if segments else None
+
+
+def _fake_duration(path):
+    return Path(path).stat().st_size / len(MP3_FRAME) * FRAME_SECONDS
+
+
+def _fake_mux(segments, m4b_path, metadata, cover_source=None, muxer="ipod"):
+    staged = Path(m4b_path).with_suffix(".staged")
+    with open(staged, "wb") as out:
+        for segment in segments:
+            with open(segment, "rb") as src:
+                shutil.copyfileobj(src, out)
+    staged.replace(m4b_path)
+
+
+def install_fake_ffmpeg():
+    """Replace echopage.audio's ffmpeg calls with byte-level fakes."""
+    from echopage import audio
+    audio.encode_chapter = _fake_encode_chapter
+    audio.media_duration = _fake_duration
+    audio._mux = _fake_mux
+    # Fakes are patched in-process, so encode on threads rather than spawned processes
+    audio.encode_pool = lambda workers=None, backend=None: ThreadPoolExecutor(
+        max_workers=max(1, workers or audio.ENCODE_WORKERS))
@@ -4,4 +4,10 @@ __version__ = "0.1.0"
 
 # Re‑export the main entrypoint so users can do:
 #   from echopage import run
-from .cli import run
+# It is resolved on first access, so importing a submodule (or the package
+# from a worker process) doesn't load the CLI and everything behind it.
+def __getattr__(name):
+    if name == "run":
+        from .cli import run
+        return run
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,56 +1,671 @@
 import os
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Executor
 from pathlib import Path
-import ffmpeg
-from zipfile import ZipFile
+from zipfile import ZIP_STORED, BadZipFile, ZipFile
 
+from echopage import config, executor, metrics
 from echopage.logger import setup_logger
+from echopage.utils import timed
 
+config.load()
 logger = setup_logger()
 
-def compile_audio(audio_files: list, novel_title: str) -> str:
+# Per-chapter AAC encode settings. Every segment must share codec, sample
+# rate and channel layout so the final M4B can be stream-copied together.
+AAC_BITRATE = os.getenv("AAC_BITRATE", "64k")
+AUDIO_SAMPLE_RATE = int(os.getenv("AUDIO_SAMPLE_RATE", 24000))
+AUDIO_CHANNELS = int(os.getenv("AUDIO_CHANNELS", 1))
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", executor.EXEC_WORKERS))
+
+# Low-bitrate Opus settings for the "opus" book
+OPUS_BITRATE = os.getenv("OPUS_BITRATE", "24k")
+
+# Book-level tags written into the M4B
+BOOK_AUTHOR = os.getenv("BOOK_AUTHOR", "")
+COVER_IMAGE = os.getenv("COVER_IMAGE")  # else output/<title>/cover.{jpg,png} if present
+
+# Formats every book is produced in, in order of preference: "m4b" (AAC
+# audiobook with chapters), "opus" (low-bitrate Ogg Opus with chapters,
+# for mobile) and "zip" (the chapter MP3s as they are)
+PROFILES = ("m4b", "opus", "zip")
+OUTPUT_PROFILES = os.getenv("OUTPUT_PROFILES", "m4b")
+
+# Per-chapter segment each audiobook format is stream-copied together from,
+# and the ffmpeg muxer of the finished book
+SEGMENT_SUFFIXES = {"m4b": ".m4a", "opus": ".opus"}
+BOOK_MUXERS = {"m4b": "ipod", "opus": "opus"}
+
+def output_profiles(profiles=None) -> tuple:
+    """
+    Validate a list of output formats.
+
+    Args:
+        profiles: Formats as a list or a comma-separated string such as
+            "m4b,zip" (defaults to OUTPUT_PROFILES).
+
+    Raises:
+        ValueError: for an unknown format or an empty list.
+    """
+    if profiles is None:
+        profiles = OUTPUT_PROFILES
+    if isinstance(profiles, str):
+        profiles = profiles.split(",")
+    result = []
+    for profile in profiles:
+        profile = profile.strip().lower()
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown output format '{profile}' (use {', '.join(PROFILES)})")
+        if profile not in result:
+            result.append(profile)
+    if not result:
+        raise ValueError("No output format given")
+    return tuple(result)
+
+def output_path_for(novel_title: str, profile: str) -> Path:
+    """Where a book's output in one format goes: output/<title>/<title>.<profile>."""
+    safe_novel = novel_title.replace(" ", "_")
+    return Path("output") / safe_novel / f"{safe_novel}.{profile}"
+
+def segment_path_for(mp3_path, profile: str) -> Path:
+    """The segment of one audiobook format that sits next to a chapter MP3."""
+    return Path(mp3_path).with_suffix(SEGMENT_SUFFIXES[profile])
+
+def is_segment(path) -> bool:
+    """Whether path is a chapter's intermediate segment, i.e. one with its MP3 beside it."""
+    path = Path(path)
+    return path.suffix in SEGMENT_SUFFIXES.values() and path.with_suffix(".mp3").exists()
+
+def encoded_path_for(mp3_path) -> Path:
+    """The AAC segment that sits next to a chapter MP3."""
+    return segment_path_for(mp3_path, "m4b")
+
+def _stale_segments(mp3_path, profiles) -> list:
+    """The formats among profiles whose segment is missing or older than the MP3."""
+    mtime = Path(mp3_path).stat().st_mtime
+    stale = []
+    for profile in profiles:
+        if profile in SEGMENT_SUFFIXES:
+            segment = segment_path_for(mp3_path, profile)
+            if not segment.exists() or segment.stat().st_mtime < mtime:
+                stale.append(profile)
+    return stale
+
+def _needs_encode(mp3_path, profiles=("m4b",)) -> bool:
+    return bool(_stale_segments(mp3_path, profiles))
+
+def _encode_args(profile: str) -> dict:
+    if profile == "opus":
+        # libopus picks its own internal rate; voip tuning favours speech
+        return {"format": "opus", "acodec": "libopus", "audio_bitrate": OPUS_BITRATE,
+                "ac": AUDIO_CHANNELS, "application": "voip"}
+    return {"format": "ipod", "acodec": "aac", "audio_bitrate": AAC_BITRATE,
+            "ar": AUDIO_SAMPLE_RATE, "ac": AUDIO_CHANNELS}
+
+def encode_chapter(mp3_path: str, profiles=None) -> str:
+    """
+    Encode one chapter MP3 to the segment of every audiobook format in
+    profiles, skipping segments that are already up to date. Safe to run
+    in a worker process.
+
+    All missing segments come from a single ffmpeg run with one output per
+    format, so the MP3 is decoded once however many formats are produced.
+
+    Args:
+        mp3_path: Chapter MP3.
+        profiles: Output formats (defaults to OUTPUT_PROFILES); "zip"
+            needs no segment.
+
+    Returns:
+        Path to the segment of the first audiobook format, or None if
+        profiles has none.
+    """
+    profiles = [p for p in output_profiles(profiles) if p in SEGMENT_SUFFIXES]
+    stale = _stale_segments(mp3_path, profiles)
+    if stale:
+        import ffmpeg
+
+        source = ffmpeg.input(str(mp3_path))
+        staged = {}
+        for profile in stale:
+            segment = segment_path_for(mp3_path, profile)
+            # The muxer is given explicitly, so the suffix can mark it temporary
+            staged[profile] = segment.with_name(segment.name + ".tmp")
+        with metrics.timer("encode"):
+            ffmpeg.merge_outputs(*(
+                source.output(str(staged[profile]), **_encode_args(profile)) for profile in stale
+            )).run(overwrite_output=True, quiet=True)
+        for profile in stale:
+            os.replace(staged[profile], segment_path_for(mp3_path, profile))
+    return str(segment_path_for(mp3_path, profiles[0])) if profiles else None
+
+def encode_pool(workers: int = None, backend: str = None) -> Executor:
+    """
+    Pool for encode_chapter on the execution backend (defaults to
+    EXEC_BACKEND, normally a spawned process pool), ENCODE_WORKERS wide.
+    """
+    return executor.make_pool(backend, workers or ENCODE_WORKERS)
+
+def encode_chapters(audio_files: list, workers: int = None, profiles=("m4b",)) -> list:
+    """
+    Encode any chapters lacking a current segment for one of profiles.
+
+    Returns:
+        Segments of the first format in profiles, in chapter order.
+    """
+    todo = [f for f in audio_files if _needs_encode(f, profiles)]
+    if todo:
+        logger.info(f"Encoding {len(todo)} chapters to {', '.join(profiles)} segments.")
+        if len(todo) == 1:
+            encode_chapter(todo[0], profiles)
+        else:
+            with encode_pool(min(len(todo), workers or ENCODE_WORKERS)) as pool:
+                for future in [executor.submit(pool, encode_chapter, f, profiles) for f in todo]:
+                    future.result()
+    return [str(segment_path_for(f, profiles[0])) for f in audio_files]
+
+def _write_concat_list(paths: list, list_path: Path) -> None:
+    """Write an ffmpeg concat-demuxer list file for the given media paths."""
+    with open(list_path, "w", encoding="utf-8") as f:
+        for p in paths:
+            escaped = str(Path(p).resolve()).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+def media_duration(path) -> float:
+    """
+    Duration in seconds of an MP4/M4A/M4B file, read from its mvhd box.
+
+    Walking the box headers costs a few seeks per file, so measuring
+    thousands of chapter segments stays fast; anything that isn't a
+    parseable MP4 falls back to ffprobe.
+    """
+    try:
+        with open(path, "rb") as f:
+            pos, end = 0, os.fstat(f.fileno()).st_size
+            while pos + 8 <= end:
+                f.seek(pos)
+                size, kind = struct.unpack(">I4s", f.read(8))
+                header = 8
+                if size == 1:
+                    size = struct.unpack(">Q", f.read(8))[0]
+                    header = 16
+                elif size == 0:
+                    size = end - pos
+                if size < header:
+                    break
+                if kind == b"moov":
+                    end = pos + size
+                    pos += header
+                    continue
+                if kind == b"mvhd":
+                    version = f.read(4)[0]
+                    if version == 1:
+                        f.seek(16, os.SEEK_CUR)
+                        timescale, duration = struct.unpack(">IQ", f.read(12))
+                    else:
+                        f.seek(8, os.SEEK_CUR)
+                        timescale, duration = struct.unpack(">II", f.read(8))
+                    if timescale:
+                        return duration / timescale
+                    break
+                pos += size
+    except (OSError, struct.error, IndexError):
+        pass
+    import ffmpeg
+    return float(ffmpeg.probe(str(path))["format"]["duration"])
+
+def _ffmeta_escape(value) -> str:
+    """Escape a value for an ffmetadata file."""
+    return re.sub(r"([=;#\\\n])", r"\\\1", str(value))
+
+def _chapter_block(title: str, start_ms: int, end_ms: int) -> str:
+    return (f"[CHAPTER]\nTIMEBASE=1/1000\nSTART={start_ms}\nEND={end_ms}\n"
+            f"title={_ffmeta_escape(title)}\n")
+
+def build_ffmetadata(segments: list, titles: list, novel_title: str,
+                     author: str = None, offset_ms: int = 0,
+                     header: bool = True) -> str:
+    """
+    Build an ffmetadata document with book tags and one chapter per segment.
+
+    Args:
+        segments: Chapter audio segments, in order; their measured durations
+            place the chapter boundaries.
+        titles: Chapter titles, aligned with segments.
+        novel_title: Book title (title/album tags).
+        author: Author tag (defaults to BOOK_AUTHOR).
+        offset_ms: Start time of the first chapter (for appends).
+        header: Include the ;FFMETADATA1 header and global tags.
+    """
+    author = BOOK_AUTHOR if author is None else author
+    lines = []
+    if header:
+        lines.append(";FFMETADATA1\n")
+        lines.append(f"title={_ffmeta_escape(novel_title)}\n")
+        lines.append(f"album={_ffmeta_escape(novel_title)}\n")
+        if author:
+            lines.append(f"artist={_ffmeta_escape(author)}\n")
+            lines.append(f"album_artist={_ffmeta_escape(author)}\n")
+        lines.append("genre=Audiobook\n")
+    start = offset_ms
+    for segment, title in zip(segments, titles):
+        end = start + round(media_duration(segment) * 1000)
+        lines.append(_chapter_block(title, start, end))
+        start = end
+    return "".join(lines)
+
+def _title_from_path(path) -> str:
+    """Fallback chapter title from a '001_Some_Title.mp3' style file name."""
+    return re.sub(r"^\d+_", "", Path(path).stem).replace("_", " ")
+
+def _find_cover(output_dir: Path, cover=None):
+    if cover:
+        return Path(cover)
+    if COVER_IMAGE:
+        return Path(COVER_IMAGE)
+    for name in ("cover.jpg", "cover.jpeg", "cover.png"):
+        if (output_dir / name).exists():
+            return output_dir / name
+    return None
+
+def _ogg_time(ms: int) -> str:
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+def _opus_chapter_tags(metadata: str) -> str:
+    """
+    Move an ffmetadata chapter table (TIMEBASE=1/1000) into CHAPTERxxx /
+    CHAPTERxxxNAME global tags, which become the book's Ogg comments as
+    they are.
+
+    The Ogg muxer's own chapter writer rounds the seconds independently of
+    the milliseconds, so a start past the half second would land a second
+    late; formatting the comments here keeps every start exact.
+    """
+    header, *blocks = re.split(r"^\[CHAPTER\]\n", metadata, flags=re.MULTILINE)
+    lines = [header if header.endswith("\n") else header + "\n"]
+    for i, block in enumerate(blocks):
+        start = int(re.search(r"^START=(\d+)$", block, re.MULTILINE)[1])
+        title = re.search(r"^title=(.*)$", block, re.MULTILINE)
+        lines.append(f"CHAPTER{i:03d}={_ogg_time(start)}\n")
+        if title:
+            lines.append(f"CHAPTER{i:03d}NAME={title[1]}\n")
+    return "".join(lines)
+
+def _opus_comments(path) -> list:
+    """The comments of an Ogg Opus file's OpusTags header, read page by page."""
+    packets, packet = [], b""
+    with open(path, "rb") as f:
+        while len(packets) < 2:
+            header = f.read(27)
+            if len(header) < 27 or header[:4] != b"OggS":
+                raise ValueError(f"{path} is not an Ogg file")
+            lacing = f.read(header[26])
+            data = f.read(sum(lacing))
+            pos = 0
+            for size in lacing:
+                packet += data[pos:pos + size]
+                pos += size
+                if size < 255:
+                    packets.append(packet)
+                    packet = b""
+    tags = packets[1]
+    if not tags.startswith(b"OpusTags"):
+        raise ValueError(f"{path} has no OpusTags header")
+    pos = 12 + struct.unpack_from("<I", tags, 8)[0]
+    comments = []
+    for _ in range(struct.unpack_from("<I", tags, pos)[0]):
+        size = struct.unpack_from("<I", tags, pos + 4)[0]
+        comments.append(tags[pos + 8:pos + 8 + size].decode("utf-8", "replace"))
+        pos += 4 + size
+    return comments
+
+def _opus_metadata(path) -> str:
+    """
+    An Ogg Opus book's tags and chapter table as ffmetadata, read from its
+    OpusTags comments. ffmpeg's demuxer would report the book tags on the
+    stream rather than globally, and the chapter starts shifted by the
+    stream's pre-skip, which appends would carry into the new table.
     """
-    Merge MP3 files into one .m4b; if that fails, zip the MP3s.
+    lines = [";FFMETADATA1\n"]
+    starts, names = {}, {}
+    for comment in _opus_comments(path):
+        key, _, value = comment.partition("=")
+        m = re.fullmatch(r"CHAPTER(\d+)(NAME)?", key.upper())
+        if not m:
+            if key.lower() != "encoder":
+                lines.append(f"{_ffmeta_escape(key.lower())}={_ffmeta_escape(value)}\n")
+        elif m[2]:
+            names[int(m[1])] = value
+        else:
+            t = re.fullmatch(r"(\d+):(\d+):(\d+(?:\.\d+)?)", value.strip())
+            if t:
+                starts[int(m[1])] = round((int(t[1]) * 3600 + int(t[2]) * 60
+                                           + float(t[3])) * 1000)
+    numbers = sorted(starts)
+    ends = [starts[n] for n in numbers[1:]] + [round(media_duration(path) * 1000)]
+    lines += [_chapter_block(names.get(n, ""), starts[n], end) for n, end in zip(numbers, ends)]
+    return "".join(lines)
+
+def _mux(segments: list, book_path: Path, metadata: str, cover_source=None,
+         muxer: str = "ipod") -> None:
+    """
+    Stream-copy segments into book_path in a single ffmpeg pass, writing
+    the chapter table, tags and cover art at the same time; book_path is
+    replaced atomically.
+
+    cover_source may be an image or an existing book whose attached
+    picture should be carried over. muxer is the output container ("ipod"
+    for M4B, "opus" for Ogg Opus, which carries no cover).
+    """
+    with tempfile.TemporaryDirectory(dir=book_path.parent) as tmp:
+        list_path = Path(tmp) / "concat.txt"
+        meta_path = Path(tmp) / "metadata.txt"
+        staged = Path(tmp) / book_path.name
+        _write_concat_list(segments, list_path)
+        if muxer == "opus":
+            metadata = _opus_chapter_tags(metadata)
+        meta_path.write_text(metadata, encoding="utf-8")
+
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", str(list_path),
+            "-i", str(meta_path),
+        ]
+        maps = ["-map", "0:a:0"]
+        if cover_source and muxer == "ipod":
+            command += ["-i", str(cover_source)]
+            maps += ["-map", "2:v:0?", "-disposition:v:0", "attached_pic"]
+        command += maps + [
+            "-map_metadata", "1",
+            # Opus chapters travel as the CHAPTERxxx tags written above
+            "-map_chapters", "-1" if muxer == "opus" else "1",
+            "-c", "copy",
+        ]
+        if muxer == "ipod":
+            command += ["-movflags", "+faststart"]
+        command += ["-f", muxer, str(staged)]
+        subprocess.run(command, check=True, capture_output=True)
+        os.replace(staged, book_path)
+
+def _zip_part(zip_path: Path) -> Path:
+    return zip_path.with_name(zip_path.name + ".part")
+
+def _sort_entries(archive: ZipFile) -> None:
+    """
+    List archive's entries by chapter number when it is closed. Chapters are
+    stored in the order they finish; only the central directory, which is
+    what unzip tools and players list, is reordered, so no data is copied.
+    """
+    def chapter_number(info):
+        m = re.match(r"\d+", info.filename)
+        return (int(m[0]) if m else float("inf"), info.filename)
+    archive.filelist.sort(key=chapter_number)
+
+class ChapterZip:
+    """
+    The chapter-MP3 ZIP, written while the pipeline is still producing
+    chapters.
+
+    Each MP3 is added to `<title>.zip.part` as soon as it is synthesized,
+    stored uncompressed (ZIP_STORED), since MP3 frames don't deflate any
+    further and storing is a plain copy. finish_zip adds whatever the
+    stream missed and renames the archive into place.
+    """
+
+    def __init__(self, zip_path):
+        self.part = _zip_part(Path(zip_path))
+        self.part.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._zip = ZipFile(self.part, "w", ZIP_STORED)
+        self._names = set()
+
+    def add(self, mp3_path) -> None:
+        """Append a chapter MP3 (once; later adds of the same name are ignored)."""
+        name = Path(mp3_path).name
+        with self._lock:
+            if name not in self._names:
+                self._zip.write(mp3_path, name)
+                self._names.add(name)
+
+    def close(self) -> None:
+        with self._lock:
+            _sort_entries(self._zip)
+            self._zip.close()
+
+def _copy_entries(source: ZipFile, dest: ZipFile, names: set) -> None:
+    """Copy source's entries that dest doesn't have yet, without loading them in memory."""
+    for info in source.infolist():
+        if info.filename not in names:
+            with source.open(info) as src, dest.open(info.filename, "w") as out:
+                shutil.copyfileobj(src, out)
+            names.add(info.filename)
+
+@timed(name="zip")
+def finish_zip(audio_files: list, zip_path, append: bool = False) -> str:
+    """
+    Complete the chapter-MP3 ZIP and move it into place.
+
+    Starts from what a ChapterZip streamed during the run, if anything, and
+    stores every chapter in audio_files that it doesn't hold yet. With
+    append=True the chapters of an existing ZIP are kept in front (for
+    update runs); otherwise the archive holds just audio_files.
+
+    Returns:
+        Path to the .zip file.
+    """
+    zip_path = Path(zip_path)
+    part = _zip_part(zip_path)
+    streamed = None
+    if part.exists():
+        try:
+            ZipFile(part).close()
+            streamed = part
+        except BadZipFile:
+            # Left over from a run that died mid-write
+            logger.warning(f"Ignoring incomplete {part}")
+
+    staged = zip_path.with_name(f".{zip_path.name}.tmp")
+    if append and zip_path.exists():
+        shutil.copyfile(zip_path, staged)
+    elif streamed:
+        # Finish the streamed archive in place rather than copying it
+        staged, streamed = part, None
+    try:
+        with ZipFile(staged, "a" if staged.exists() else "w", ZIP_STORED) as out:
+            names = set(out.namelist())
+            if streamed:
+                with ZipFile(streamed) as source:
+                    _copy_entries(source, out, names)
+            for mp3 in audio_files:
+                name = Path(mp3).name
+                if name not in names:
+                    out.write(mp3, name)
+                    names.add(name)
+            _sort_entries(out)
+        os.replace(staged, zip_path)
+    finally:
+        staged.unlink(missing_ok=True)
+        part.unlink(missing_ok=True)
+    return str(zip_path)
+
+@timed(name="compile")
+def compile_audio(audio_files: list, novel_title: str, workers: int = None,
+                  titles: list = None, author: str = None, cover=None,
+                  profiles=None, append_zip: bool = False) -> str:
+    """
+    Build the book in every output format; if no audiobook format can be
+    built, zip the MP3s instead.
+
+    Each chapter is decoded once and encoded to the segment of every
+    audiobook format in one ffmpeg pass (in parallel, skipping chapters the
+    pipeline already encoded), and each book is joined from its segments
+    with the concat demuxer in stream-copy mode, so assembly never
+    re-encodes the book. Chapter markers (from the measured segment
+    durations), title/author tags and cover art are written in that same
+    pass. The ZIP stores the MP3s uncompressed, reusing any chapters the
+    pipeline already streamed into it.
     
     Args:
         audio_files: List of paths to chapter .mp3 files.
         novel_title: Used for naming the output file and folder.
+        workers: Encode processes (defaults to ENCODE_WORKERS).
+        titles: Chapter titles aligned with audio_files (defaults to
+            titles derived from the file names).
+        author: Author tag (defaults to BOOK_AUTHOR).
+        cover: Cover image (defaults to COVER_IMAGE or a cover.jpg/png in
+            the output folder).
+        profiles: Output formats, as for output_profiles (defaults to
+            OUTPUT_PROFILES).
+        append_zip: Keep the chapters of an existing ZIP, as finish_zip
+            does for updates.
     
     Returns:
-        Path to the generated .m4b or .zip file.
+        Path to the book in the first format produced.
     """
-    # Prepare output paths
-    safe_novel = novel_title.replace(" ", "_")
-    output_dir = Path("output") / safe_novel
+    profiles = output_profiles(profiles)
+    books = [p for p in profiles if p in SEGMENT_SUFFIXES]
+    output_dir = output_path_for(novel_title, "m4b").parent
     output_dir.mkdir(parents=True, exist_ok=True)
-    
-    m4b_path = output_dir / f"{safe_novel}.m4b"
-    zip_path = output_dir / f"{safe_novel}.zip"
-    
+    outputs = []
+
     try:
-        logger.info("Starting M4B compilation with ffmpeg.")
-        
-        # Create ffmpeg input streams
-        streams = [ffmpeg.input(f) for f in audio_files]
-        # Concatenate audio only (v=0, a=1)
-        joined = ffmpeg.concat(*streams, v=0, a=1)
-        
-        # Output in ipod format, which produces .m4b
-        joined = joined.output(str(m4b_path), format="ipod", acodec="aac")
-        joined.run(overwrite_output=True)
-        
-        logger.info(f"Successfully created M4B: {m4b_path}")
-        return str(m4b_path)
+        if books:
+            logger.info(f"Starting {', '.join(books)} compilation with ffmpeg.")
+            encode_chapters(audio_files, workers, books)
+            titles = titles or [_title_from_path(f) for f in audio_files]
+            metadata = build_ffmetadata([segment_path_for(f, books[0]) for f in audio_files],
+                                        titles, novel_title, author)
+            for profile in books:
+                book_path = output_path_for(novel_title, profile)
+                _mux([segment_path_for(f, profile) for f in audio_files], book_path,
+                     metadata, _find_cover(output_dir, cover), BOOK_MUXERS[profile])
+                logger.info(f"Successfully created {profile.upper()}: {book_path}")
+                outputs.append(str(book_path))
     
     except Exception as e:
-        logger.error(f"M4B compilation failed: {e}")
-        logger.info("Falling back to ZIP of individual MP3s.")
-        
-        # Create ZIP of MP3s
-        with ZipFile(zip_path, "w") as zipf:
-            for mp3 in audio_files:
-                zipf.write(mp3, Path(mp3).name)
+        logger.error(f"Audiobook compilation failed: {e}")
+        if not outputs and "zip" not in profiles:
+            logger.info("Falling back to ZIP of individual MP3s.")
+            profiles += ("zip",)
+
+    if "zip" in profiles:
+        zip_path = finish_zip(audio_files, output_path_for(novel_title, "zip"), append_zip)
         logger.info(f"Created ZIP archive: {zip_path}")
-        return str(zip_path)
+        outputs.append(zip_path)
+    return outputs[0]
+
+def _existing_metadata(m4b_path: Path) -> str:
+    """Export a book's tags and chapter table as ffmetadata (header only, no decode)."""
+    if Path(m4b_path).suffix == ".opus":
+        return _opus_metadata(m4b_path)
+    result = subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-i", str(m4b_path), "-f", "ffmetadata", "-"],
+        check=True, capture_output=True,
+    )
+    return result.stdout.decode("utf-8")
+
+def _append_book(profile: str, segments: list, titles: list, novel_title: str) -> str:
+    """Stream-copy new chapter segments onto the end of an existing book."""
+    book_path = output_path_for(novel_title, profile)
+    metadata = _existing_metadata(book_path)
+    if not metadata.endswith("\n"):
+        metadata += "\n"
+    metadata += build_ffmetadata(segments, titles, novel_title,
+                                 offset_ms=round(media_duration(book_path) * 1000),
+                                 header=False)
+
+    logger.info(f"Appending {len(segments)} chapters to {book_path} (stream copy).")
+    _mux([book_path] + segments, book_path, metadata, cover_source=book_path,
+         muxer=BOOK_MUXERS[profile])
+    logger.info(f"Updated {profile.upper()}: {book_path}")
+    return str(book_path)
+
+def _book_author(book_path: Path):
+    """The artist tag of an existing book, or None."""
+    match = re.search(r"^artist=(.*)$", _existing_metadata(book_path), re.MULTILINE)
+    return re.sub(r"\\(.)", r"\1", match[1]) if match else None
+
+def rebuild_audio(audio_files: list, novel_title: str, titles: list = None,
+                  profiles=None) -> str:
+    """
+    Compile every format again from all of a book's chapters, for updates
+    that can't append: an earlier chapter has been filled in, or there is
+    no book to append to yet.
+
+    The author tag and cover of an existing M4B and the chapters of an
+    existing ZIP are kept. Chapters that already have their segments are
+    not encoded again, so this is a stream copy of the whole book.
+
+    Args:
+        audio_files: Paths to every chapter .mp3 file of the book, in order.
+        novel_title, titles, profiles: As for compile_audio.
+
+    Returns:
+        Path to the book in the first format produced.
+    """
+    m4b = output_path_for(novel_title, "m4b")
+    author = cover = None
+    if m4b.exists():
+        author, cover = _book_author(m4b), m4b
+    return compile_audio(audio_files, novel_title, titles=titles, author=author,
+                         cover=cover, profiles=profiles, append_zip=True)
+
+@timed(name="append")
+def append_audio(audio_files: list, novel_title: str, titles: list = None,
+                 profiles=None, book: tuple = None) -> str:
+    """
+    Extend an existing book with new chapter MP3s, in every output format.
+
+    Only the new chapters are encoded; each existing book is copied
+    stream-for-stream through the concat demuxer, so old chapters are never
+    decoded or re-encoded. Its chapter table, tags and cover are kept and
+    the new chapters are added after them; the ZIP gets the new MP3s
+    stored after the old ones. Falls back to rebuild_audio when there is
+    no book in the first format yet (e.g. an earlier compile only managed
+    the ZIP, or the formats changed).
+
+    Args:
+        audio_files: Paths to the new chapter .mp3 files, in order.
+        novel_title: Used for naming the output file and folder.
+        titles: Titles of the new chapters, aligned with audio_files.
+        profiles: Output formats (defaults to OUTPUT_PROFILES).
+        book: (audio files, titles) of every chapter of the book, old and
+            new, for that fallback (defaults to just the new chapters).
+
+    Returns:
+        Path to the updated book in the first format.
+    """
+    profiles = output_profiles(profiles)
+    primary = output_path_for(novel_title, profiles[0])
+
+    if not audio_files:
+        return str(primary)
+    if not primary.exists():
+        logger.info(f"No existing book at {primary}; compiling from every chapter.")
+        book_files, book_titles = book or (audio_files, titles)
+        return rebuild_audio(book_files, novel_title, book_titles, profiles)
+
+    outputs = []
+    books = [p for p in profiles if p in SEGMENT_SUFFIXES]
+    if books:
+        encode_chapters(audio_files, profiles=books)
+        titles = titles or [_title_from_path(f) for f in audio_files]
+    for profile in profiles:
+        if profile == "zip":
+            outputs.append(finish_zip(audio_files, output_path_for(novel_title, "zip"),
+                                      append=True))
+        elif output_path_for(novel_title, profile).exists():
+            outputs.append(_append_book(profile, [segment_path_for(f, profile) for f in audio_files],
+                                        titles, novel_title))
+        else:
+            logger.warning(f"No existing {profile} book for '{novel_title}' to append to; "
+                           f"run compile to build it from every chapter.")
+    return outputs[0] if outputs else str(primary)
 
 # def combine_audio_to_m4b(mp3_files, output_path):
 #     """
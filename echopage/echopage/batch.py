@@ -0,0 +1,181 @@
+# echopage/batch.py
+"""
+Run many novels from one process on shared resources.
+
+Books progress concurrently on one event loop, but share:
+- one TTS concurrency cap and request-rate limiter, so the TTS endpoint
+  sees at most TTS_CONCURRENCY requests in flight in total;
+- one pool for AAC encodes and prefetched-page parsing (see executor.py);
+- the per-host request limits in ratelimit.py, so two books on the same
+  site don't add up their request rates.
+
+A failing book is logged and skipped; the others carry on.
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from echopage import audio, cache, config, pipeline, tts
+from echopage.drive_upload import upload_outputs
+from echopage.logger import setup_logger
+
+config.load()
+logger = setup_logger()
+
+# Books being scraped/synthesized at once, and compiles running at once
+BATCH_MAX_BOOKS = int(os.getenv("BATCH_MAX_BOOKS", 4))
+BATCH_COMPILE_CONCURRENCY = int(os.getenv("BATCH_COMPILE_CONCURRENCY", 2))
+
+MODES = ("run", "update")
+
+def load_jobs(path) -> list:
+    """
+    Read a batch manifest.
+
+    The file is JSON, either a list of novels or
+    {"defaults": {...}, "novels": [...]}. Every novel needs a "title"; mode
+    "run" (the default) also needs "url" and "count". Optional keys are
+    "mode" ("run" or "update"), "resume", "max_new", "author", "cover",
+    "prefetch", "toc_url" and "upload". Keys a novel leaves out are taken from "defaults".
+
+    Returns:
+        List of job dicts with every key filled in.
+
+    Raises:
+        ValueError: if the manifest is malformed.
+    """
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    defaults = {}
+    novels = data
+    if isinstance(data, dict):
+        defaults = data.get("defaults", {})
+        novels = data.get("novels")
+    if not isinstance(novels, list):
+        raise ValueError("Batch manifest must contain a list of novels")
+
+    jobs, titles = [], set()
+    for i, entry in enumerate(novels, 1):
+        job = {"mode": "run", "resume": False, "max_new": 1000, "upload": True,
+               "author": None, "cover": None, "prefetch": None, "toc_url": None,
+               **defaults, **entry}
+        title = job.get("title")
+        if not title:
+            raise ValueError(f"Novel #{i} has no title")
+        if title in titles:
+            # Both jobs would write the same output folder and manifest
+            raise ValueError(f"Novel '{title}' is listed twice")
+        if job["mode"] not in MODES:
+            raise ValueError(f"Novel '{title}': mode must be one of {', '.join(MODES)}")
+        if job["mode"] == "run" and not (job.get("url") and job.get("count")):
+            raise ValueError(f"Novel '{title}' needs a url and a count")
+        titles.add(title)
+        jobs.append(job)
+    return jobs
+
+async def _run_book(job: dict, shared: dict, settings: dict) -> str:
+    """Scrape and synthesize one book on the shared limits, then compile and upload it."""
+    title = job["title"]
+    async with shared["books"]:
+        logger.info(f"[batch] Starting '{title}' ({job['mode']})")
+        if job["mode"] == "update":
+            manifest, plan = await asyncio.to_thread(pipeline.plan_update, title)
+            count = plan[3] - 1 + int(job["max_new"]) if plan else 0
+        else:
+            count = int(job["count"])
+            manifest, plan = await asyncio.to_thread(
+                pipeline.plan_run, title, job["url"], count, bool(job["resume"]))
+
+        results = {}
+        if plan:
+            results = await pipeline.run_stages(
+                title, manifest, plan, count, settings["concurrency"],
+                shared["tts"], shared["limiter"], shared["pool"], shared["workers"],
+                settings["options"], settings["queue_size"],
+                dict(settings["scrape"], prefetch=job["prefetch"], toc_url=job["toc_url"]),
+                settings["profiles"])
+        audio_files, titles = pipeline.collect_audio(results, manifest)
+
+    # The book's slot is free again, so the next book starts scraping
+    # while this one is compiled and uploaded
+    async with shared["compile"]:
+        if job["mode"] == "update":
+            first_new = plan[3] if plan else manifest.last_number() + 1
+            output = await asyncio.to_thread(pipeline.finish_update, title, manifest, results,
+                                             first_new, settings["profiles"])
+        else:
+            if not audio_files:
+                raise RuntimeError("No chapter audio was produced.")
+            output = await asyncio.to_thread(
+                audio.compile_audio, audio_files, title, None, titles,
+                job["author"], job["cover"], settings["profiles"])
+
+    if job["upload"]:
+        async with shared["upload"]:
+            await asyncio.to_thread(upload_outputs, title)
+    logger.info(f"[batch] Finished '{title}': {output}")
+    return output
+
+async def _run_all(jobs: list, max_books: int, tts_concurrency: int, settings: dict) -> list:
+    # Every active book holds a thread for its scraper, plus compiles and
+    # uploads; size the default executor so they never queue behind each other
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(
+        max_workers=max_books + BATCH_COMPILE_CONCURRENCY + 2))
+
+    shared = {
+        "books": asyncio.Semaphore(max_books),
+        "compile": asyncio.Semaphore(max(1, BATCH_COMPILE_CONCURRENCY)),
+        "upload": asyncio.Semaphore(1),
+        "tts": asyncio.Semaphore(tts_concurrency),
+        "limiter": tts.tts_limiter(settings["requests_per_sec"]),
+        "workers": settings["scrape"]["workers"] or audio.ENCODE_WORKERS,
+    }
+    with audio.encode_pool(shared["workers"], settings["scrape"]["backend"]) as pool:
+        shared["pool"] = pool
+        return await asyncio.gather(*(_run_book(job, shared, settings) for job in jobs),
+                                    return_exceptions=True)
+
+def run_batch(jobs: list, max_books: int = None, tts_concurrency: int = None,
+              upload: bool = True, backend: str = None, workers: int = None) -> dict:
+    """
+    Process several novels concurrently on shared worker pools.
+
+    Args:
+        jobs: Job dicts as returned by load_jobs.
+        max_books: Books scraped/synthesized at once (defaults to
+            BATCH_MAX_BOOKS).
+        tts_concurrency: TTS requests in flight across all books (defaults
+            to TTS_CONCURRENCY).
+        upload: Set False to skip the Drive upload for every book.
+        backend, workers: Execution backend and pool size for parsing and
+            encoding, as for pipeline.run_pipeline.
+
+    Returns:
+        {title: output path, or None if that book failed}.
+    """
+    settings = pipeline.resolve_options(backend=backend, workers=workers)
+    max_books = max(1, max_books or BATCH_MAX_BOOKS)
+    tts_concurrency = max(1, tts_concurrency or settings["concurrency"])
+    # A book never needs more TTS workers than the global cap allows
+    settings["concurrency"] = min(settings["concurrency"], tts_concurrency)
+    if not upload:
+        jobs = [dict(job, upload=False) for job in jobs]
+
+    logger.info(f"Batch of {len(jobs)} novels: {max_books} at a time, "
+                f"{tts_concurrency} TTS requests in flight")
+    outcomes = asyncio.run(_run_all(jobs, max_books, tts_concurrency, settings))
+    if settings["options"]["use_cache"]:
+        cache.prune()
+
+    summary = {}
+    for job, outcome in zip(jobs, outcomes):
+        if isinstance(outcome, BaseException):
+            logger.error(f"[batch] '{job['title']}' failed: {outcome}")
+            summary[job["title"]] = None
+        else:
+            summary[job["title"]] = outcome
+    failed = sum(1 for output in summary.values() if output is None)
+    logger.info(f"Batch finished: {len(summary) - failed} succeeded, {failed} failed")
+    return summary
@@ -0,0 +1,100 @@
+# echopage/cache.py
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+from echopage import config
+from echopage.logger import setup_logger
+
+config.load()
+logger = setup_logger()
+
+# Content-addressed store of synthesized chapter MP3s
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE", "1").lower() in ("1", "true", "yes")
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", "cache/tts"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_MB", 2048)) * 1024 * 1024
+
+def cache_key(text: str, voice: str, rate: str, volume: str) -> str:
+    """Hash of everything that determines the synthesized audio."""
+    payload = json.dumps([voice, rate, volume, text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _entry_path(key: str, cache_dir: Path = None) -> Path:
+    cache_dir = Path(cache_dir or TTS_CACHE_DIR)
+    return cache_dir / key[:2] / f"{key}.mp3"
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    """Hardlink src to dst (copy across filesystems), replacing dst atomically."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f"{dst.name}.{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+def fetch(key: str, dest: Path, cache_dir: Path = None) -> bool:
+    """
+    Materialize a cached MP3 at dest.
+
+    Returns:
+        True on a cache hit, False if the key is not cached.
+    """
+    entry = _entry_path(key, cache_dir)
+    if not entry.exists():
+        return False
+    try:
+        # Touch for LRU ordering; mtime is reliable where atime often is not
+        os.utime(entry)
+        _link_or_copy(entry, Path(dest))
+    except OSError as e:
+        logger.warning(f"TTS cache read failed for {key[:12]}: {e}")
+        return False
+    return True
+
+def store(key: str, src: Path, cache_dir: Path = None) -> None:
+    """Add a freshly synthesized MP3 to the cache."""
+    try:
+        _link_or_copy(Path(src), _entry_path(key, cache_dir))
+    except OSError as e:
+        logger.warning(f"TTS cache write failed for {key[:12]}: {e}")
+
+def prune(max_bytes: int = None, cache_dir: Path = None) -> tuple:
+    """
+    Evict least recently used entries until the cache fits in max_bytes.
+
+    Args:
+        max_bytes: Size cap (defaults to TTS_CACHE_MAX_BYTES; 0 empties the cache).
+        cache_dir: Cache root (defaults to TTS_CACHE_DIR).
+
+    Returns:
+        (entries removed, bytes freed)
+    """
+    if max_bytes is None:
+        max_bytes = TTS_CACHE_MAX_BYTES
+    cache_dir = Path(cache_dir or TTS_CACHE_DIR)
+    if not cache_dir.exists():
+        return 0, 0
+
+    entries = []
+    total = 0
+    for path in cache_dir.glob("*/*.mp3"):
+        st = path.stat()
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+
+    removed = freed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+        freed += size
+
+    if removed:
+        logger.info(f"Pruned {removed} TTS cache entries ({freed / 1e6:.1f} MB)")
+    return removed, freed
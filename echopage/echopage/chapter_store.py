@@ -0,0 +1,205 @@
+# echopage/chapter_store.py
+"""
+Single-file chapter store.
+
+With CHAPTER_STORE=sqlite, scraped chapters go into
+output/<title>/chapters.sqlite instead of one .txt file each. Each row
+holds the raw page HTML and the cleaned text (both zlib-compressed),
+their SHA-256 hashes, the next-chapter link and the chapter's stage,
+keyed by chapter number. A 3000-chapter book is then one file on disk
+and one Drive upload, and any chapter is a primary-key lookup away.
+
+The manifest journal still drives resume/update; chapters it records
+carry a 'store' path instead of a 'filepath'. `export` writes the loose
+.txt (and optionally .html) files back out when they are needed.
+"""
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from echopage import config
+from echopage.logger import setup_logger
+from echopage.utils import chapter_filename
+
+config.load()
+logger = setup_logger()
+
+STORE_MODES = ("files", "sqlite")
+CHAPTER_STORE = os.getenv("CHAPTER_STORE", "files").lower()
+STORE_NAME = "chapters.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chapters (
+    number     INTEGER PRIMARY KEY,
+    url        TEXT,
+    title      TEXT NOT NULL,
+    next_url   TEXT,
+    html       BLOB,
+    text       BLOB NOT NULL,
+    html_hash  TEXT,
+    text_hash  TEXT NOT NULL,
+    status     TEXT NOT NULL,
+    mp3_path   TEXT,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def _pack(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8"))
+
+
+def _unpack(blob: bytes) -> str:
+    return zlib.decompress(blob).decode("utf-8")
+
+
+class ChapterStore:
+    """
+    Chapters of one title in a SQLite file.
+
+    One connection is shared by the scraper thread, the event loop and
+    upload threads, serialized by a lock; each write commits on its own,
+    so a killed run keeps every chapter stored before it died.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(_SCHEMA)
+
+    def put(self, number: int, title: str, text: str, html: str = None,
+            url: str = None, next_url: str = None, status: str = "scraped") -> str:
+        """
+        Store (or replace) a chapter's text and page.
+
+        Returns:
+            SHA-256 of the text.
+        """
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        html_hash = hashlib.sha256(html.encode("utf-8")).hexdigest() if html else None
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO chapters (number, url, title, next_url, html, text,"
+                " html_hash, text_hash, status, mp3_path, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, ?)",
+                (number, url, title, next_url, _pack(html) if html else None, _pack(text),
+                 html_hash, text_hash, status, time.time()))
+        return text_hash
+
+    def set_stage(self, number: int, status: str, mp3_path: str = None) -> None:
+        """Record a chapter's pipeline stage (and its MP3 once synthesized)."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE chapters SET status = ?, mp3_path = COALESCE(?, mp3_path),"
+                " updated_at = ? WHERE number = ?",
+                (status, str(mp3_path) if mp3_path else None, time.time(), number))
+
+    def text(self, number: int) -> str:
+        """
+        The stored text of a chapter.
+
+        Raises:
+            KeyError: if the chapter isn't stored.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT text FROM chapters WHERE number = ?",
+                                   (number,)).fetchone()
+        if row is None:
+            raise KeyError(f"Chapter {number} is not in {self.path}")
+        return _unpack(row[0])
+
+    def html(self, number: int) -> str:
+        """The raw page HTML of a chapter, or None if it wasn't kept."""
+        with self._lock:
+            row = self._db.execute("SELECT html FROM chapters WHERE number = ?",
+                                   (number,)).fetchone()
+        return _unpack(row[0]) if row and row[0] else None
+
+    def chapters(self) -> list:
+        """Every chapter's metadata (no text or HTML), in chapter order."""
+        with self._lock:
+            cursor = self._db.execute(
+                "SELECT number, url, title, next_url, html_hash, text_hash, status, mp3_path"
+                " FROM chapters ORDER BY number")
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def export(self, dest, html: bool = False) -> int:
+        """
+        Write every chapter out as a loose .txt file (and .html with html=True),
+        named as the files backend would name them.
+
+        Returns:
+            Number of chapters written.
+        """
+        dest = Path(dest)
+        dest.mkdir(parents=True, exist_ok=True)
+        chapters = self.chapters()
+        for chap in chapters:
+            number = chap["number"]
+            (dest / chapter_filename(chap["title"], number)).write_text(
+                self.text(number), encoding="utf-8")
+            page = self.html(number) if html else None
+            if page:
+                (dest / chapter_filename(chap["title"], number, ".html")).write_text(
+                    page, encoding="utf-8")
+        return len(chapters)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def store_path(novel_title: str) -> Path:
+    return Path("output") / novel_title.replace(" ", "_") / STORE_NAME
+
+
+_stores_lock = threading.Lock()
+_stores = {}
+
+def open_store(path) -> ChapterStore:
+    """The process-wide ChapterStore for a file, opened on first use."""
+    key = str(Path(path).resolve())
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = ChapterStore(path)
+        return store
+
+
+def close_store(path) -> None:
+    """
+    Close a file's store if it is open, e.g. before the file is uploaded;
+    open_store reopens it on next use.
+    """
+    with _stores_lock:
+        store = _stores.pop(str(Path(path).resolve()), None)
+    if store is not None:
+        store.close()
+
+
+def close_stores() -> None:
+    """Close every open store (at exit)."""
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
+
+
+atexit.register(close_stores)
+
+
+def load_text(chap: dict) -> str:
+    """Text of a chapter dict, from its .txt file or from the store."""
+    if chap.get("filepath"):
+        return Path(chap["filepath"]).read_text(encoding="utf-8")
+    return open_store(chap["store"]).text(chap["number"])
@@ -0,0 +1,169 @@
+# echopage/cleaner.py
+"""
+Clean chapter text before it is saved and synthesized.
+
+Scraped text still carries navigation boilerplate ("Next Chapter"),
+translator notes, site watermarks, divider lines and ragged whitespace,
+all of which cost TTS time. clean_text() runs three passes:
+
+1. strip: regexes removed wherever they match (case-insensitive, ^ and $
+   match at line boundaries). The built-in DEFAULT_STRIP rules apply to
+   every site; CLEANING_RULES points to a JSON file adding more, globally
+   and per site:
+
+       {"strip": ["^Support us on Patreon.*$"],
+        "sites": {"royalroad.com": ["^.*stolen from Royal Road.*$"]}}
+
+   A site also covers its subdomains. Rules are checked when loaded; one
+   that isn't a valid regex is logged and skipped.
+2. normalize: odd Unicode spaces, zero-width characters, runs of repeated
+   punctuation and spaces before punctuation.
+3. dedup (opt-in): with CLEAN_DEDUP_MIN_CHARS set, a paragraph (line) of at
+   least that many characters that already appeared earlier in the
+   chapter is dropped. Off by default, since stories repeat lines too.
+
+Rules are compiled once per site. Cleaning is off unless TEXT_CLEANING=1,
+so text stays exactly as scraped by default.
+"""
+import json
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from echopage import config, metrics
+from echopage.logger import setup_logger
+
+config.load()
+logger = setup_logger()
+
+TEXT_CLEANING = os.getenv("TEXT_CLEANING", "0").lower() in ("1", "true", "yes")
+CLEANING_RULES = os.getenv("CLEANING_RULES")  # path to a JSON rules file
+# Minimum length of a repeated line to drop; 0 turns dedup off
+CLEAN_DEDUP_MIN_CHARS = int(os.getenv("CLEAN_DEDUP_MIN_CHARS", 0))
+
+DEFAULT_STRIP = (
+    # Navigation links that end up in the content block
+    r"^\s*(?:<<?\s*)?(?:previous|prev|next)\s+chapter(?:\s*>>?)?\s*$",
+    r"^\s*table\s+of\s+contents\s*$",
+    # Translator/editor notes, on their own line or inline in brackets
+    r"^\s*(?:t/n|tn|tl|tl\s*note|ed\s*note|translator'?s?\s+notes?)\s*:.*$",
+    r"\[\s*(?:t/n|tn|tl|tl\s*note|ed)\s*:[^\]]*\]",
+    r"\(\s*(?:t/n|tn|tl)\s*:[^)]*\)",
+    # Divider lines: *****, -----, ~~~, ===, ###
+    r"^\s*[-*_=~#•·]{3,}\s*$",
+)
+
+_INVISIBLE = re.compile(r"[\u200b\u200c\u200d\u2060\ufeff\u00ad]")
+_SPACES = re.compile(r"[ \t\u00a0\u2000-\u200a\u202f\u205f\u3000]+")
+_NORMALIZE = (
+    (re.compile(r"\.{4,}"), "..."),
+    (re.compile(r"([!?])\1+"), r"\1"),
+    (re.compile(r"([~*_=#])\1{2,}"), ""),
+    (re.compile(r" +([,.;:!?])"), r"\1"),
+)
+
+
+def _valid_patterns(patterns, where: str) -> list:
+    """The patterns that compile; the others are logged and skipped."""
+    valid = []
+    for pattern in patterns:
+        try:
+            re.compile(pattern, re.IGNORECASE | re.MULTILINE)
+        except (re.error, TypeError) as e:
+            logger.warning(f"Skipping cleaning rule {pattern!r} for {where}: {e}")
+            continue
+        valid.append(pattern)
+    return valid
+
+
+def _load_rules(path) -> dict:
+    if not path:
+        return {"strip": [], "sites": {}}
+    try:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        logger.error(f"Ignoring cleaning rules in {path}: {e}")
+        return {"strip": [], "sites": {}}
+    return {
+        "strip": _valid_patterns(data.get("strip", []), "all sites"),
+        "sites": {site.lower(): _valid_patterns(patterns, site)
+                  for site, patterns in data.get("sites", {}).items()},
+    }
+
+
+_RULES = _load_rules(CLEANING_RULES)
+
+
+def site_patterns(host: str) -> list:
+    """Extra strip patterns for a host: every RULES site it is, or is a subdomain of."""
+    parts = host.lower().split(":")[0].split(".")
+    patterns = []
+    for i in range(len(parts)):
+        patterns += _RULES["sites"].get(".".join(parts[i:]), [])
+    return patterns
+
+
+@lru_cache(maxsize=None)
+def compiled_rules(host: str = "") -> re.Pattern:
+    """All strip patterns for a host as one compiled alternation."""
+    patterns = list(DEFAULT_STRIP) + _RULES["strip"] + site_patterns(host)
+    return re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE | re.MULTILINE)
+
+
+def _normalize_line(line: str) -> str:
+    line = _SPACES.sub(" ", _INVISIBLE.sub("", line))
+    for pattern, repl in _NORMALIZE:
+        line = pattern.sub(repl, line)
+    return line.strip()
+
+
+def clean_text(text: str, url: str = None) -> tuple:
+    """
+    Strip boilerplate from chapter text, normalize it and drop repeated paragraphs.
+
+    Args:
+        text: Chapter content as extracted, one paragraph per line.
+        url: Page the text came from, to pick site rules.
+
+    Returns:
+        (cleaned text, number of characters removed).
+    """
+    host = urlsplit(url).netloc if url else ""
+    stripped = compiled_rules(host).sub("", text)
+
+    paragraphs, seen = [], set()
+    for line in stripped.splitlines():
+        line = _normalize_line(line)
+        if not line:
+            continue
+        if CLEAN_DEDUP_MIN_CHARS and len(line) >= CLEAN_DEDUP_MIN_CHARS:
+            key = line.casefold()
+            if key in seen:
+                continue
+            seen.add(key)
+        paragraphs.append(line)
+
+    cleaned = "\n".join(paragraphs)
+    return cleaned, max(0, len(text) - len(cleaned))
+
+
+def clean_chapter(title: str, content: str, url: str = None) -> tuple:
+    """
+    Clean a scraped chapter's title and content if TEXT_CLEANING is on.
+
+    Returns:
+        (title, content, characters removed); the characters are also
+        added to the clean_chars_removed metric.
+    """
+    if not TEXT_CLEANING:
+        return title, content, 0
+    title = _normalize_line(title) or title
+    cleaned, removed = clean_text(content, url)
+    if not cleaned:
+        # Every line matched a rule: keep the original rather than lose the chapter
+        return title, content, 0
+    metrics.incr("clean_chars_in", len(content))
+    metrics.incr("clean_chars_removed", removed)
+    return title, cleaned, removed
@@ -1,28 +1,94 @@
+import sys
+
 import click
-from echopage.echopage.drive_upload import upload_outputs
+from echopage import metrics
 from echopage.logger import setup_logger
-from echopage.scraper import scrape_chapters
-from echopage.tts import generate_audio
-from echopage.audio import compile_audio
-from echopage.email_notifier import send_notification
 
+# Commands import the pipeline, TTS, ffmpeg and Drive modules themselves, so
+# a command only pays for the dependencies it actually uses
 
 logger = setup_logger()
 
-@click.command()
+def _export_metrics(title, command, status):
+    try:
+        path = metrics.export_run(title, command, status.lower())
+        if path:
+            logger.info(f"Run metrics written to {path}")
+    except OSError as e:
+        logger.warning(f"Could not write run metrics: {e}")
+
+def _run_stage(title, command, fn, *args, **kwargs):
+    """Run one stage-only command, logging failures and exporting its metrics."""
+    status = "SUCCESS"
+    metrics.start_run()
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        status = "FAILURE"
+        logger.exception(f"EchoPage {command} encountered an error.")
+        logger.error(f"EchoPage {command} failed: {e}")
+        sys.exit(1)
+    finally:
+        _export_metrics(title, command, status)
+
+class _DefaultGroup(click.Group):
+    """
+    Group that falls back to `run` when no command is named, so the
+    original `python -m echopage.cli --url ... --count ... --title ...`
+    invocation keeps working.
+    """
+
+    default_command = "run"
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands
+                        and args[0] not in ctx.help_option_names):
+            args = [self.default_command] + list(args)
+        return super().parse_args(ctx, args)
+
+@click.group(cls=_DefaultGroup)
+def cli():
+    """EchoPage: turn web novel chapters into audiobooks.
+
+    Without a command, the options are passed to `run`.
+    """
+
+@cli.command()
 @click.option('--url', prompt='Starting Chapter URL', help='The URL of the first chapter.')
 @click.option('--count', prompt='Number of Chapters', type=int)
 @click.option('--title', prompt='WebNovel Title', help='Used for folder and metadata.')
-def run(url, count, title):
+@click.option('--resume', is_flag=True, help='Skip finished chapters and continue from the manifest.')
+@click.option('--author', default=None, help='Author tag for the M4B (defaults to BOOK_AUTHOR).')
+@click.option('--cover', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Cover image embedded in the M4B.')
+@click.option('--prefetch', type=click.Choice(['off', 'toc', 'pattern']), default=None,
+              help='Fetch upcoming chapters concurrently (defaults to SCRAPE_PREFETCH).')
+@click.option('--toc-url', default=None, help='Table-of-contents page for --prefetch toc.')
+@click.option('--backend', type=click.Choice(['serial', 'threads', 'processes']), default=None,
+              help='Where parsing and encoding run (defaults to EXEC_BACKEND).')
+@click.option('--workers', type=int, default=None,
+              help='Parse/encode workers (defaults to EXEC_WORKERS).')
+@click.option('--engine', type=click.Choice(['edge', 'piper']), default=None,
+              help='TTS engine (defaults to TTS_ENGINE).')
+@click.option('--formats', default=None,
+              help='Output formats, comma-separated from m4b, opus, zip (defaults to OUTPUT_PROFILES).')
+def run(url, count, title, resume, author, cover, prefetch, toc_url, backend, workers, engine,
+        formats):
+    """Scrape, synthesize, compile and upload a novel."""
+    from echopage.drive_upload import upload_outputs
+    from echopage.pipeline import run_pipeline
+
     status = "SUCCESS"
     detail = ""
+    metrics.start_run()
     try:
         logger.info(f"Starting EchoPage: {title}, from {url}, for {count} chapters")
-        chapters = scrape_chapters(url, count, title)
-        audio_files = generate_audio(chapters, title)
-        compile_audio(audio_files, title)
+        output_path = run_pipeline(url, count, title, resume=resume,
+                                   author=author, cover=cover,
+                                   prefetch=prefetch, toc_url=toc_url,
+                                   backend=backend, workers=workers, engine=engine,
+                                   formats=formats)
         logger.info("EchoPage process completed successfully.")
-        output_path = compile_audio(audio_files, title)
         upload_outputs(title)
         logger.info("Uploaded all outputs and logs to Google Drive.")
     except Exception as e:
@@ -30,5 +96,257 @@ def run(url, count, title):
         detail = str(e)
         logger.exception("EchoPage encountered an error.")
         logger.error(f"EchoPage process failed: {e}")
-        
+        sys.exit(1)
+    finally:
+        _export_metrics(title, "run", status)
+
+
+@cli.command()
+@click.option('--title', prompt='WebNovel Title', help='Title of a previously produced book.')
+@click.option('--max-new', type=int, default=1000, show_default=True,
+              help='Upper bound on new chapters fetched.')
+@click.option('--backend', type=click.Choice(['serial', 'threads', 'processes']), default=None,
+              help='Where parsing and encoding run (defaults to EXEC_BACKEND).')
+@click.option('--workers', type=int, default=None,
+              help='Parse/encode workers (defaults to EXEC_WORKERS).')
+@click.option('--engine', type=click.Choice(['edge', 'piper']), default=None,
+              help='TTS engine (defaults to TTS_ENGINE).')
+@click.option('--formats', default=None,
+              help='Output formats, comma-separated from m4b, opus, zip (defaults to OUTPUT_PROFILES).')
+def update(title, max_new, backend, workers, engine, formats):
+    """Fetch only newly published chapters and append them to the book."""
+    from echopage.drive_upload import upload_outputs
+    from echopage.pipeline import update_pipeline
+
+    status = "SUCCESS"
+    metrics.start_run()
+    try:
+        logger.info(f"Updating EchoPage: {title}")
+        update_pipeline(title, max_new=max_new, backend=backend, workers=workers,
+                        engine=engine, formats=formats)
+        logger.info("EchoPage update completed successfully.")
+        upload_outputs(title)
+        logger.info("Uploaded all outputs and logs to Google Drive.")
+    except Exception as e:
+        status = "FAILURE"
+        logger.exception("EchoPage encountered an error.")
+        logger.error(f"EchoPage update failed: {e}")
+        sys.exit(1)
+    finally:
+        _export_metrics(title, "update", status)
+
+
+@cli.command()
+@click.option('--manifest', 'manifest_path', required=True,
+              type=click.Path(exists=True, dir_okay=False),
+              help='JSON list of novels (see batch.load_jobs).')
+@click.option('--max-books', type=int, default=None,
+              help='Books in progress at once (defaults to BATCH_MAX_BOOKS).')
+@click.option('--tts-concurrency', type=int, default=None,
+              help='TTS requests in flight across all books (defaults to TTS_CONCURRENCY).')
+@click.option('--no-upload', is_flag=True, help='Skip the Drive upload.')
+@click.option('--backend', type=click.Choice(['serial', 'threads', 'processes']), default=None,
+              help='Where parsing and encoding run (defaults to EXEC_BACKEND).')
+@click.option('--workers', type=int, default=None,
+              help='Parse/encode workers (defaults to EXEC_WORKERS).')
+def batch(manifest_path, max_books, tts_concurrency, no_upload, backend, workers):
+    """Process every novel in a manifest on shared worker pools."""
+    from echopage.batch import load_jobs, run_batch
+
+    status = "SUCCESS"
+    metrics.start_run()
+    try:
+        jobs = load_jobs(manifest_path)
+        summary = run_batch(jobs, max_books=max_books, tts_concurrency=tts_concurrency,
+                            upload=not no_upload, backend=backend, workers=workers)
+        for title, output in summary.items():
+            click.echo(f"{'ok    ' if output else 'FAILED'} {title}: {output or 'see log'}")
+        if not all(summary.values()):
+            status = "FAILURE"
+    except Exception as e:
+        status = "FAILURE"
+        logger.exception("EchoPage batch encountered an error.")
+        logger.error(f"EchoPage batch failed: {e}")
+    finally:
+        _export_metrics("batch", "batch", status)
+    if status == "FAILURE":
+        sys.exit(1)
+
+
+@cli.command()
+@click.option('--url', prompt='Starting Chapter URL', help='The URL of the first chapter.')
+@click.option('--count', prompt='Number of Chapters', type=int)
+@click.option('--title', prompt='WebNovel Title', help='Used for folder and metadata.')
+@click.option('--resume', is_flag=True, help='Continue from the manifest.')
+@click.option('--prefetch', type=click.Choice(['off', 'toc', 'pattern']), default=None,
+              help='Fetch upcoming chapters concurrently (defaults to SCRAPE_PREFETCH).')
+@click.option('--toc-url', default=None, help='Table-of-contents page for --prefetch toc.')
+@click.option('--backend', type=click.Choice(['serial', 'threads', 'processes']), default=None,
+              help='Where parsing runs (defaults to EXEC_BACKEND).')
+@click.option('--workers', type=int, default=None,
+              help='Parse workers (defaults to EXEC_WORKERS).')
+def scrape(url, count, title, resume, prefetch, toc_url, backend, workers):
+    """Only scrape chapter text; run `tts` and `compile` later."""
+    from echopage.pipeline import scrape_only
+
+    scraped = _run_stage(title, "scrape", scrape_only, url, count, title, resume=resume,
+                         prefetch=prefetch, toc_url=toc_url, backend=backend, workers=workers)
+    if scraped is not None:
+        click.echo(f"Scraped {scraped} chapters of {title}.")
+
+
+@cli.command()
+@click.option('--title', prompt='WebNovel Title', help='Title of a scraped book.')
+@click.option('--concurrency', type=int, default=None,
+              help='Chapters synthesized at once (defaults to TTS_CONCURRENCY).')
+@click.option('--engine', type=click.Choice(['edge', 'piper']), default=None,
+              help='TTS engine (defaults to TTS_ENGINE).')
+def tts(title, concurrency, engine):
+    """Only synthesize scraped chapters that have no audio yet."""
+    from echopage.pipeline import synthesize_only
+
+    done = _run_stage(title, "tts", synthesize_only, title, concurrency=concurrency,
+                      engine=engine)
+    if done is not None:
+        click.echo(f"Synthesized {done} chapters of {title}.")
+
+
+@cli.command()
+@click.option('--engine', type=click.Choice(['edge', 'piper']), default=None,
+              help='TTS engine (defaults to TTS_ENGINE).')
+def voices(engine):
+    """List the voices a TTS engine can speak with."""
+    import asyncio
+    from echopage import tts_engines
+
+    try:
+        names = asyncio.run(tts_engines.get_engine(engine).voices())
+    except Exception as e:
+        raise click.ClickException(str(e))
+    for name in names:
+        click.echo(name)
+
+
+@cli.command('compile')
+@click.option('--title', prompt='WebNovel Title', help='Title of a synthesized book.')
+@click.option('--author', default=None, help='Author tag for the M4B (defaults to BOOK_AUTHOR).')
+@click.option('--cover', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Cover image embedded in the M4B.')
+@click.option('--workers', type=int, default=None,
+              help='Encode workers (defaults to ENCODE_WORKERS).')
+@click.option('--formats', default=None,
+              help='Output formats, comma-separated from m4b, opus, zip (defaults to OUTPUT_PROFILES).')
+def compile_book(title, author, cover, workers, formats):
+    """Only compile the book from the chapter audio produced so far."""
+    from echopage.pipeline import compile_only
+
+    output = _run_stage(title, "compile", compile_only, title, author=author,
+                        cover=cover, workers=workers, formats=formats)
+    if output:
+        click.echo(f"Compiled {output}")
+
+
+@cli.command()
+@click.option('--title', prompt='WebNovel Title', help='Title of a produced book.')
+def upload(title):
+    """Only upload the book's output folder to Google Drive."""
+    from echopage.drive_upload import upload_outputs
+
+    _run_stage(title, "upload", upload_outputs, title)
+
+
+@cli.command()
+@click.option('--title', prompt='WebNovel Title', help='Title of a book scraped into the chapter store.')
+@click.option('--dest', type=click.Path(file_okay=False), default=None,
+              help='Directory for the files (defaults to output/<title>/).')
+@click.option('--html', is_flag=True, help='Also write each chapter\'s raw page HTML.')
+def export(title, dest, html):
+    """Write chapters from the SQLite chapter store out as loose files."""
+    from pathlib import Path
+    from echopage import chapter_store
+
+    path = chapter_store.store_path(title)
+    if not path.exists():
+        raise click.ClickException(f"No chapter store at {path}")
+    store = chapter_store.open_store(path)
+    written = store.export(Path(dest) if dest else path.parent, html=html)
+    click.echo(f"Exported {written} chapters of {title}.")
+
+
+@cli.command()
+@click.option('--url', prompt='Starting Chapter URL', help='The URL of the first chapter.')
+@click.option('--count', prompt='Number of Chapters', type=int)
+@click.option('--title', prompt='WebNovel Title', help='Used for folder and metadata.')
+@click.option('--resume', is_flag=True, help='Skip chapters the manifest already has.')
+@click.option('--author', default=None, help='Author tag for the M4B (defaults to BOOK_AUTHOR).')
+@click.option('--cover', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Cover image embedded in the M4B.')
+@click.option('--prefetch', type=click.Choice(['off', 'toc', 'pattern']), default=None,
+              help='Fetch upcoming chapters concurrently (defaults to SCRAPE_PREFETCH).')
+@click.option('--toc-url', default=None, help='Table-of-contents page for --prefetch toc.')
+@click.option('--engine', type=click.Choice(['edge', 'piper']), default=None,
+              help='TTS engine (defaults to each worker\'s TTS_ENGINE).')
+@click.option('--no-upload', is_flag=True, help='Skip the Drive upload after compiling.')
+@click.option('--formats', default=None,
+              help='Output formats, comma-separated from m4b, opus, zip (defaults to OUTPUT_PROFILES).')
+def enqueue(url, count, title, resume, author, cover, prefetch, toc_url, engine, formats,
+            no_upload):
+    """Queue a novel for workers on any node (see the worker command)."""
+    from echopage.worker import enqueue as enqueue_title
+
+    try:
+        enqueue_title(url, count, title, resume=resume, author=author, cover=cover,
+                      prefetch=prefetch, toc_url=toc_url, engine=engine,
+                      formats=formats, upload=not no_upload)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Queued {title}.")
+
+
+@cli.command()
+@click.option('--kind', 'kinds', multiple=True,
+              type=click.Choice(['scrape', 'tts', 'encode', 'compile']),
+              help='Only take tasks of this kind (repeatable; defaults to all).')
+@click.option('--concurrency', type=int, default=None,
+              help='Tasks run at once (defaults to WORKER_CONCURRENCY).')
+@click.option('--exit-when-idle', is_flag=True,
+              help='Stop once no task is pending or running anywhere.')
+def worker(kinds, concurrency, exit_when_idle):
+    """Run queued scrape, TTS, encode and compile tasks."""
+    from echopage.worker import run_worker
+
+    done = _run_stage("worker", "worker", run_worker, tuple(kinds) or None,
+                      concurrency=concurrency, exit_when_idle=exit_when_idle)
+    if done is not None:
+        click.echo(f"Completed {done} tasks.")
+
+
+@cli.command('queue-status')
+@click.option('--title', default=None, help='Only show this title.')
+def queue_status(title):
+    """Show queued tasks per title, kind and state."""
+    from echopage import work_queue
+
+    queue = work_queue.open_queue()
+    for book, kinds in queue.counts(title).items():
+        click.echo(book)
+        for kind in work_queue.KINDS:
+            if kind in kinds:
+                states = ", ".join(f"{n} {status}" for status, n in sorted(kinds[kind].items()))
+                click.echo(f"  {kind:<8} {states}")
+
+
+@cli.command('prune-cache')
+@click.option('--max-mb', type=int, default=None,
+              help='Size cap in MB (defaults to TTS_CACHE_MAX_MB; 0 clears the cache).')
+def prune_cache(max_mb):
+    """Evict least recently used entries from the TTS cache."""
+    from echopage import cache
+
+    max_bytes = None if max_mb is None else max_mb * 1024 * 1024
+    removed, freed = cache.prune(max_bytes)
+    click.echo(f"Removed {removed} cache entries, freed {freed / 1e6:.1f} MB.")
+
 
+if __name__ == "__main__":
+    cli()
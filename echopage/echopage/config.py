@@ -0,0 +1,22 @@
+# echopage/config.py
+"""
+Load .env into the environment once per process.
+
+Every module reads its settings with os.getenv at import time and calls
+config.load() first; only the first call touches the .env file.
+"""
+import threading
+
+from dotenv import load_dotenv
+
+_lock = threading.Lock()
+_loaded = False
+
+
+def load() -> None:
+    """Load .env (without overriding variables already set), once."""
+    global _loaded
+    with _lock:
+        if not _loaded:
+            load_dotenv()
+            _loaded = True
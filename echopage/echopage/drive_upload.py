@@ -1,29 +1,67 @@
 # echopage/drive_upload.py
+import hashlib
+import json
 import os
-import pickle
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-from dotenv import load_dotenv
+from echopage import chapter_store, config, metrics
 from echopage.logger import setup_logger
+from echopage.utils import timed
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-
-load_dotenv()
+config.load()
 logger = setup_logger()
 
 # Drive API settings
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 CREDS_PATH = Path(os.getenv("GOOGLE_CREDENTIALS_PATH", "credentials.json"))
-TOKEN_PATH = Path(os.getenv("GOOGLE_TOKEN_PATH", "token.pickle"))
+TOKEN_PATH = Path(os.getenv("GOOGLE_TOKEN_PATH", "token.json"))
 DRIVE_PARENT_FOLDER_ID = os.getenv("DRIVE_PARENT_FOLDER_ID")  # put your root folder ID here
 
-def authenticate() -> build:
-    """Authenticate and return a Drive v3 service object."""
+# Upload tuning
+DRIVE_UPLOAD_WORKERS = int(os.getenv("DRIVE_UPLOAD_WORKERS", 4))
+DRIVE_CHUNK_SIZE = int(os.getenv("DRIVE_CHUNK_MB", 8)) * 1024 * 1024  # multiple of 256 KiB
+DRIVE_RETRIES = int(os.getenv("DRIVE_RETRIES", 5))
+
+# Local state: folder IDs by account and name, and resumable sessions of interrupted uploads
+DRIVE_FOLDER_CACHE = Path(os.getenv("DRIVE_FOLDER_CACHE", "cache/drive_folders.json"))
+DRIVE_UPLOAD_STATE = Path(os.getenv("DRIVE_UPLOAD_STATE", "cache/drive_uploads.json"))
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+_state_lock = threading.Lock()
+
+def _load_json(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+def _save_json(path: Path, data: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.write_text(json.dumps(data, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+def _update_json(path: Path, key: str, value=None) -> None:
+    """Set (or, with value None, remove) one key in a small JSON state file."""
+    with _state_lock:
+        data = _load_json(path)
+        if value is None:
+            data.pop(key, None)
+        else:
+            data[key] = value
+        _save_json(path, data)
+
+def get_credentials():
+    """Load, refresh or obtain OAuth credentials for the Drive API."""
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
     if TOKEN_PATH.exists():
         creds = Credentials.from_authorized_user_file(str(TOKEN_PATH), SCOPES)
@@ -33,15 +71,75 @@ def authenticate() -> build:
         else:
             flow = InstalledAppFlow.from_client_secrets_file(str(CREDS_PATH), SCOPES)
             creds = flow.run_local_server(port=0)
-        # Save the credentials for next run
-        with open(TOKEN_PATH, 'wb') as token_file:
-            pickle.dump(creds, token_file)
-    return build('drive', 'v3', credentials=creds)
+        # Save the credentials for next run (JSON, as from_authorized_user_file expects)
+        TOKEN_PATH.write_text(creds.to_json(), encoding="utf-8")
+    return creds
+
+def build_service(creds=None):
+    """
+    Build a Drive v3 service with its own HTTP connection.
+
+    httplib2 connections are not thread-safe, so every upload thread builds
+    its own service from the shared credentials.
+    """
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build
+
+    http = AuthorizedHttp(creds, http=httplib2.Http(timeout=120))
+    return build('drive', 'v3', http=http, cache_discovery=False)
+
+def authenticate():
+    """Authenticate and return a Drive v3 service object."""
+    return build_service(get_credentials())
+
+def _media_upload(path: Path, resumable: bool):
+    from googleapiclient.http import MediaFileUpload
+    if resumable:
+        return MediaFileUpload(str(path), chunksize=DRIVE_CHUNK_SIZE, resumable=True)
+    return MediaFileUpload(str(path), resumable=False)
+
+def _quote(value: str) -> str:
+    """Escape a value for a Drive query string literal."""
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+def _http_status(error: Exception):
+    status = getattr(getattr(error, "resp", None), "status", None)
+    return int(status) if status is not None else None
+
+def drive_account(service) -> str:
+    """Stable ID of the Drive account the service is signed in to."""
+    about = service.about().get(fields="user(permissionId)").execute()
+    return about["user"]["permissionId"]
+
+def _folder_exists(service, folder_id: str) -> bool:
+    try:
+        found = service.files().get(fileId=folder_id, fields="id,trashed").execute()
+    except Exception as e:
+        if _http_status(e) == 404:
+            return False
+        raise
+    return not found.get("trashed")
 
 def create_folder(service, name: str, parent_id: str = None) -> str:
-    """Create a folder in Drive (if not exists) and return its ID."""
+    """
+    Create a folder in Drive (if not exists) and return its ID.
+
+    Folder IDs are cached per account in DRIVE_FOLDER_CACHE. A cached
+    folder that has since been deleted or trashed is dropped from the
+    cache and looked up again.
+    """
+    cache_key = f"{drive_account(service)}:{parent_id or 'root'}/{name}"
+    folder_id = _load_json(DRIVE_FOLDER_CACHE).get(cache_key)
+    if folder_id:
+        if _folder_exists(service, folder_id):
+            logger.debug(f"Using cached folder '{name}' ({folder_id})")
+            return folder_id
+        logger.info(f"Cached folder '{name}' ({folder_id}) no longer exists; looking it up again")
+        _update_json(DRIVE_FOLDER_CACHE, cache_key)
+
     # First, check if folder exists
-    query = f"mimeType='application/vnd.google-apps.folder' and name='{name}'"
+    query = f"mimeType='{FOLDER_MIME}' and name='{_quote(name)}' and trashed=false"
     if parent_id:
         query += f" and '{parent_id}' in parents"
     res = service.files().list(q=query, spaces='drive', fields='files(id,name)').execute()
@@ -49,50 +147,211 @@ def create_folder(service, name: str, parent_id: str = None) -> str:
     if files:
         folder_id = files[0]['id']
         logger.debug(f"Found existing folder '{name}' ({folder_id})")
-        return folder_id
+    else:
+        # Create new folder
+        metadata = {
+            'name': name,
+            'mimeType': FOLDER_MIME,
+        }
+        if parent_id:
+            metadata['parents'] = [parent_id]
+        folder = service.files().create(body=metadata, fields='id').execute()
+        folder_id = folder.get('id')
+        logger.info(f"Created folder '{name}' ({folder_id})")
 
-    # Create new folder
-    metadata = {
-        'name': name,
-        'mimeType': 'application/vnd.google-apps.folder',
-    }
-    if parent_id:
-        metadata['parents'] = [parent_id]
-    folder = service.files().create(body=metadata, fields='id').execute()
-    folder_id = folder.get('id')
-    logger.info(f"Created folder '{name}' ({folder_id})")
+    _update_json(DRIVE_FOLDER_CACHE, cache_key, folder_id)
     return folder_id
 
-def upload_file(service, file_path: Path, parent_id: str):
-    """Upload a single file to Drive under parent_id."""
-    file_metadata = {
-        'name': file_path.name,
-        'parents': [parent_id]
-    }
-    media = MediaFileUpload(str(file_path), resumable=True)
-    uploaded = service.files().create(
-        body=file_metadata,
-        media_body=media,
-        fields='id'
-    ).execute()
+def list_folder(service, folder_id: str) -> dict:
+    """Map file name -> {'id', 'md5Checksum'} for the files directly in a folder."""
+    found = {}
+    page_token = None
+    while True:
+        res = service.files().list(
+            q=f"'{folder_id}' in parents and trashed=false",
+            spaces='drive',
+            fields='nextPageToken, files(id,name,md5Checksum)',
+            pageSize=1000,
+            pageToken=page_token,
+        ).execute()
+        for f in res.get('files', []):
+            found[f['name']] = f
+        page_token = res.get('nextPageToken')
+        if not page_token:
+            return found
+
+def file_md5(path: Path) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _is_transient(error: Exception) -> bool:
+    status = _http_status(error)
+    if status is not None:
+        return status in (408, 429, 500, 502, 503, 504)
+    return isinstance(error, (OSError, TimeoutError))
+
+def _session_expired(error: Exception) -> bool:
+    """Whether Drive no longer knows the resumable session (it expires after a week)."""
+    return _http_status(error) in (404, 410)
+
+def _requery_offset(request, enabled: bool = True) -> None:
+    """
+    Make the request's next next_chunk() first ask Drive how much of the
+    upload it already holds (an empty PUT with Content-Range: bytes */<size>)
+    and continue from that offset.
+
+    googleapiclient does this by itself after a failed chunk but has no
+    public call for it, so this is the one place its private flag is set.
+    """
+    request._in_error_state = enabled
+
+def _run_resumable(request, file_path: Path, state_key: str):
+    """
+    Drive a chunked upload to completion.
+
+    The session URI is saved after the first chunk so a later run can pick
+    the same upload up where it stopped; transient failures re-query the
+    server for the committed offset and continue from there. A saved
+    session that Drive rejects (expired, or otherwise invalid) is dropped
+    and the upload starts over in a new one.
+    """
+    saved_uri = _load_json(DRIVE_UPLOAD_STATE).get(state_key)
+    resuming = bool(saved_uri)
+    if saved_uri:
+        logger.info(f"Resuming interrupted upload of {file_path.name}")
+        request.resumable_uri = saved_uri
+        _requery_offset(request)
+
+    failures = 0
+    restarted = False
+    response = None
+    while response is None:
+        try:
+            status, response = request.next_chunk(num_retries=DRIVE_RETRIES)
+        except Exception as e:
+            if not restarted and (_session_expired(e) or (resuming and not _is_transient(e))):
+                logger.warning(f"Upload session for {file_path.name} is no longer valid ({e}); "
+                               f"starting a new one")
+                _update_json(DRIVE_UPLOAD_STATE, state_key)
+                saved_uri = None
+                resuming = False
+                restarted = True
+                request.resumable_uri = None
+                request.resumable_progress = 0
+                _requery_offset(request, False)
+                continue
+            if not _is_transient(e) or failures >= DRIVE_RETRIES:
+                raise
+            failures += 1
+            metrics.incr("upload_retries")
+            _requery_offset(request)
+            delay = min(60, 2 ** failures) * (0.5 + random.random() / 2)
+            logger.warning(f"Upload of {file_path.name} interrupted ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        # Drive accepted a chunk, so this session is good
+        resuming = False
+        if request.resumable_uri and request.resumable_uri != saved_uri:
+            saved_uri = request.resumable_uri
+            _update_json(DRIVE_UPLOAD_STATE, state_key, saved_uri)
+        if status:
+            logger.debug(f"{file_path.name}: {int(status.progress() * 100)}%")
+    _update_json(DRIVE_UPLOAD_STATE, state_key)
+    return response
+
+@timed(name="upload_file")
+def upload_file(service, file_path: Path, parent_id: str, existing: dict = None) -> str:
+    """
+    Upload a single file to Drive under parent_id.
+
+    Skips the upload when `existing` (the Drive file of the same name in
+    that folder) already has the same MD5, and updates it in place instead
+    of creating a duplicate when the content differs. Files larger than one
+    chunk use a resumable upload.
+
+    Returns:
+        "skipped", "updated" or "uploaded".
+    """
+    md5 = file_md5(file_path)
+    if existing and existing.get('md5Checksum') == md5:
+        logger.debug(f"Unchanged on Drive, skipping {file_path.name}")
+        metrics.incr("upload_skipped")
+        return "skipped"
+
+    resumable = file_path.stat().st_size > DRIVE_CHUNK_SIZE
+    media = _media_upload(file_path, resumable)
+    if existing:
+        request = service.files().update(fileId=existing['id'], media_body=media, fields='id')
+    else:
+        file_metadata = {
+            'name': file_path.name,
+            'parents': [parent_id]
+        }
+        request = service.files().create(body=file_metadata, media_body=media, fields='id')
+
+    if resumable:
+        uploaded = _run_resumable(request, file_path, f"{file_path.resolve()}:{md5}")
+    else:
+        uploaded = request.execute(num_retries=DRIVE_RETRIES)
+    metrics.incr("upload_bytes", file_path.stat().st_size)
     logger.info(f"Uploaded {file_path.name} → {uploaded.get('id')}")
+    return "updated" if existing else "uploaded"
 
-def upload_outputs(novel_title: str) -> None:
+@timed(name="upload")
+def upload_outputs(novel_title: str, workers: int = None) -> None:
     """
-    Uploads all files in output/<NovelTitle>/ to Google Drive.
+    Uploads all files in output/<NovelTitle>/ to Google Drive, except
+    temporary files and per-chapter encode segments.
     Creates a folder under DRIVE_PARENT_FOLDER_ID named <NovelTitle>.
-    """
-    service = authenticate()
-    root_folder_id = DRIVE_PARENT_FOLDER_ID or None
-    novel_folder_id = create_folder(service, novel_title, root_folder_id)
 
+    Files are uploaded concurrently on a bounded thread pool (each thread
+    with its own service), and files already on Drive with the same name
+    and MD5 are skipped, so re-runs only send what changed.
+    """
     local_dir = Path("output") / novel_title.replace(" ", "_")
     if not local_dir.exists():
         logger.error(f"Output directory not found: {local_dir}")
         return
 
-    for file in sorted(local_dir.rglob('*')):
-        if file.is_file():
-            upload_file(service, file, novel_folder_id)
+    # The chapter store's file must be closed, and so complete, before it is copied
+    chapter_store.close_store(chapter_store.store_path(novel_title))
+
+    creds = get_credentials()
+    service = build_service(creds)
+    root_folder_id = DRIVE_PARENT_FOLDER_ID or None
+    novel_folder_id = create_folder(service, novel_title, root_folder_id)
+    remote = list_folder(service, novel_folder_id)
+
+    from echopage.audio import is_segment
+
+    # Temporary files and the per-chapter segments the books are built from
+    # stay local; the books and chapter MP3s hold the same audio
+    files = [f for f in sorted(local_dir.rglob('*'))
+             if f.is_file() and not f.name.endswith(('.tmp', '.part', '-journal'))
+             and not is_segment(f)]
+
+    local = threading.local()
+
+    def upload(path):
+        if not hasattr(local, "service"):
+            local.service = build_service(creds)
+        return upload_file(local.service, path, novel_folder_id, remote.get(path.name))
+
+    counts = {"uploaded": 0, "updated": 0, "skipped": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=max(1, workers or DRIVE_UPLOAD_WORKERS)) as pool:
+        futures = {pool.submit(upload, f): f for f in files}
+        for future in as_completed(futures):
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                logger.error(f"Failed to upload {futures[future].name}: {e}")
 
-    logger.info(f"All files from {local_dir} uploaded to Drive folder '{novel_title}'")
+    logger.info(f"Drive sync of {local_dir} to '{novel_title}': "
+                f"{counts['uploaded']} uploaded, {counts['updated']} updated, "
+                f"{counts['skipped']} unchanged, {counts['failed']} failed")
+    if counts["failed"]:
+        raise RuntimeError(f"{counts['failed']} files failed to upload")
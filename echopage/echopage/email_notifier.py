@@ -1,14 +1,12 @@
 # echopage/email_notifier.py
 import os
-import smtplib
-import ssl
 from email.message import EmailMessage
 from pathlib import Path
 
-from dotenv import load_dotenv
-from echopage.logger import setup_logger
+from echopage import config
+from echopage.logger import flush_logs, setup_logger
 
-load_dotenv()
+config.load()
 logger = setup_logger()
 
 # Load email settings from .env
@@ -19,13 +17,27 @@ EMAIL_PASS = os.getenv("EMAIL_PASS")
 EMAIL_TO   = os.getenv("EMAIL_TO")   # comma‑separated list OK
 LOG_PATH   = os.getenv("LOG_PATH", "logs/echopage.log")
 
-def _read_log_excerpt(n_lines: int = 50) -> str:
-    """Read the last n_lines from the log file."""
+def _read_log_excerpt(n_lines: int = 50, block_size: int = 8192) -> str:
+    """
+    Read the last n_lines from the log file.
+
+    The file is read backwards from the end in block_size chunks until
+    enough lines are in hand, so the cost depends on the excerpt, not on
+    how large the log has grown.
+    """
     try:
-        log_file = Path(LOG_PATH)
-        lines = log_file.read_text(encoding="utf-8").splitlines()
-        excerpt = "\n".join(lines[-n_lines:])
-        return excerpt
+        flush_logs()
+        with open(Path(LOG_PATH), "rb") as f:
+            pos = f.seek(0, os.SEEK_END)
+            data = b""
+            # One extra newline, since the last line usually ends with one
+            while pos > 0 and data.count(b"\n") <= n_lines:
+                step = min(block_size, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+        lines = data.decode("utf-8", errors="replace").splitlines()
+        return "\n".join(lines[-n_lines:])
     except Exception as e:
         logger.error(f"Could not read log file: {e}")
         return ""
@@ -54,6 +66,9 @@ Last log excerpt:
     msg["Subject"] = subject
     msg.set_content(body)
 
+    import smtplib
+    import ssl
+
     try:
         context = ssl.create_default_context()
         with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
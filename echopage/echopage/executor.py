@@ -0,0 +1,97 @@
+# echopage/executor.py
+"""
+Execution backends for CPU-bound work: page parsing and AAC encoding.
+
+EXEC_BACKEND picks how that work runs:
+- "serial": inline in the calling thread, one task at a time (easiest to
+  debug and profile);
+- "threads": a thread pool; no start-up cost, but the GIL serializes
+  Python-level parsing;
+- "processes" (default): a spawned process pool, so parsing and ffmpeg
+  encodes spread over EXEC_WORKERS cores.
+
+Tasks take and return plain data only (HTML strings, paths and small
+dicts, never parsed documents), so every backend gives the same results.
+Timers and counters recorded inside a worker process come back with each
+result from submit() and are merged into this process's metrics.
+"""
+import multiprocessing
+import os
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from echopage import config, metrics
+
+config.load()
+
+BACKENDS = ("serial", "threads", "processes")
+
+EXEC_BACKEND = os.getenv("EXEC_BACKEND", "processes").lower()
+EXEC_WORKERS = int(os.getenv("EXEC_WORKERS", os.cpu_count() or 1))
+
+
+class SerialExecutor(Executor):
+    """Executor that runs each task immediately in the submitting thread."""
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def make_pool(backend: str = None, workers: int = None) -> Executor:
+    """
+    Create an executor for CPU-bound tasks.
+
+    Args:
+        backend: "serial", "threads" or "processes" (defaults to EXEC_BACKEND).
+        workers: Pool size (defaults to EXEC_WORKERS); ignored for "serial".
+
+    Raises:
+        ValueError: for an unknown backend.
+    """
+    backend = (backend or EXEC_BACKEND).lower()
+    workers = max(1, workers or EXEC_WORKERS)
+    if backend == "serial":
+        return SerialExecutor()
+    if backend == "threads":
+        return ThreadPoolExecutor(max_workers=workers)
+    if backend == "processes":
+        # spawn, since pools are started from a process that already runs
+        # scraper/TTS threads, which fork would copy in an arbitrary state
+        return ProcessPoolExecutor(max_workers=workers,
+                                   mp_context=multiprocessing.get_context("spawn"))
+    raise ValueError(f"Unknown execution backend '{backend}' (use {', '.join(BACKENDS)})")
+
+
+def _with_metrics(fn, args):
+    """Run fn in a worker process and hand back what it recorded."""
+    result = fn(*args)
+    return result, metrics.drain()
+
+
+def submit(pool: Executor, fn, *args) -> Future:
+    """
+    pool.submit(fn, *args), merging metrics recorded in a worker process
+    into this process when the task finishes.
+
+    fn and args must be picklable when pool is a process pool.
+    """
+    if not isinstance(pool, ProcessPoolExecutor):
+        return pool.submit(fn, *args)
+
+    outer = Future()
+
+    def done(inner):
+        try:
+            result, recorded = inner.result()
+        except BaseException as e:
+            outer.set_exception(e)
+            return
+        metrics.merge(recorded)
+        outer.set_result(result)
+
+    pool.submit(_with_metrics, fn, args).add_done_callback(done)
+    return outer
@@ -0,0 +1,157 @@
+# echopage/http_client.py
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from echopage import config, metrics, ratelimit
+from echopage.logger import setup_logger
+from echopage.utils import timed
+
+config.load()
+logger = setup_logger()
+
+# Connection pool and retry policy for chapter fetches
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 10))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 10))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 5))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", 0.5))          # seconds, doubled per retry
+HTTP_BACKOFF_JITTER = float(os.getenv("HTTP_BACKOFF_JITTER", 0.5))
+HTTP_USER_AGENT = os.getenv("HTTP_USER_AGENT", "EchoPage/0.1 (+https://github.com/vjovkovs/EchoPage)")
+
+# Local store of validators + bodies for conditional GETs
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE", "1").lower() in ("1", "true", "yes")
+HTTP_CACHE_DIR = Path(os.getenv("HTTP_CACHE_DIR", "cache/http"))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+def _build_session() -> requests.Session:
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        backoff_jitter=HTTP_BACKOFF_JITTER,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                          pool_maxsize=HTTP_POOL_SIZE,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # requests already negotiates gzip/deflate via Accept-Encoding
+    session.headers["User-Agent"] = HTTP_USER_AGENT
+    return session
+
+def get_session() -> requests.Session:
+    """Return the process-wide pooled session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+def _cache_paths(url: str) -> tuple:
+    digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    base = HTTP_CACHE_DIR / digest[:2] / digest
+    return base.with_suffix(".json"), base.with_suffix(".body")
+
+def _load_cached(url: str):
+    meta_path, body_path = _cache_paths(url)
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        return meta, body_path
+    except (OSError, ValueError):
+        return None, body_path
+
+def _store_cached(url: str, response: requests.Response) -> None:
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if not etag and not last_modified:
+        return
+    meta_path, body_path = _cache_paths(url)
+    meta_path.parent.mkdir(parents=True, exist_ok=True)
+    meta = {
+        "url": url,
+        "etag": etag,
+        "last_modified": last_modified,
+        "encoding": response.encoding,
+    }
+    # Body first, so a crash never leaves metadata pointing at a missing body
+    tmp = body_path.with_suffix(".body.tmp")
+    tmp.write_bytes(response.content)
+    os.replace(tmp, body_path)
+    tmp = meta_path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(meta), encoding="utf-8")
+    os.replace(tmp, meta_path)
+
+@timed(name="fetch")
+def fetch_text(url: str, timeout: float = None, use_cache: bool = None) -> str:
+    """
+    GET a page through the shared session and return its decoded body.
+
+    Transient failures (429/5xx, connection errors) are retried with
+    exponential backoff plus jitter, honoring Retry-After. When a previous
+    response carried an ETag or Last-Modified, the request is made
+    conditional and a 304 is answered from the local HTTP cache.
+
+    Raises:
+        requests.RequestException: if the page could not be fetched.
+    """
+    if timeout is None:
+        timeout = HTTP_TIMEOUT
+    if use_cache is None:
+        use_cache = HTTP_CACHE_ENABLED
+
+    headers = {}
+    meta, body_path = _load_cached(url) if use_cache else (None, None)
+    if meta and body_path.exists():
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    # One bucket per host, shared by every thread (see ratelimit.py)
+    limiter = ratelimit.limiter_for(urlsplit(url).netloc)
+    limiter.acquire()
+    response = get_session().get(url, headers=headers, timeout=timeout)
+    metrics.incr("http_requests")
+
+    retries = response.raw.retries if response.raw is not None else None
+    if retries and retries.history:
+        metrics.incr("http_retries", len(retries.history))
+        logger.debug(f"{url} needed {len(retries.history)} retries")
+        # Throttled attempts that urllib3 retried still count against the host
+        for attempt in retries.history:
+            if attempt.status in ratelimit.THROTTLE_STATUSES:
+                limiter.on_throttle()
+    if response.status_code in ratelimit.THROTTLE_STATUSES:
+        limiter.on_throttle(ratelimit.retry_after_seconds(response.headers.get("Retry-After")))
+    elif response.status_code < 400:
+        limiter.on_success()
+
+    if response.status_code == 304 and headers:
+        metrics.incr("http_not_modified")
+        logger.debug(f"Not modified, using cached copy: {url}")
+        return body_path.read_bytes().decode(meta.get("encoding") or "utf-8", errors="replace")
+
+    response.raise_for_status()
+    metrics.incr("http_bytes", len(response.content))
+    if use_cache:
+        try:
+            _store_cached(url, response)
+        except OSError as e:
+            logger.warning(f"Could not cache {url}: {e}")
+    return response.text
@@ -1,22 +1,75 @@
+import atexit
 import logging
+import multiprocessing
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 
+from echopage import config
+
+config.load()
+
+# Rotate the log file once it reaches LOG_MAX_MB (0 = never), keeping
+# LOG_BACKUPS old files
+LOG_MAX_MB = float(os.getenv("LOG_MAX_MB", 0))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", 5))
+
+_lock = threading.Lock()
+_listener = None
+
+def _file_handler(log_file):
+    # Only the main process rotates; worker processes append to whatever
+    # file is current, so two processes never rename the same file
+    if LOG_MAX_MB > 0 and multiprocessing.parent_process() is None:
+        return RotatingFileHandler(log_file, maxBytes=int(LOG_MAX_MB * 1024 * 1024),
+                                   backupCount=LOG_BACKUPS, encoding="utf-8")
+    return logging.FileHandler(log_file, encoding="utf-8")
+
 def setup_logger(log_file='logs/echopage.log'):
-    Path("logs").mkdir(exist_ok=True)
+    """
+    Return the "echopage" logger, configuring it on the first call only, so
+    every module can call this at import time without duplicating log lines.
+
+    The logger itself only puts records on a queue; a background
+    QueueListener thread formats them and writes them to the log file
+    (rotated per LOG_MAX_MB/LOG_BACKUPS) and the console, so scraper, TTS
+    and upload threads never wait on disk I/O to log.
+    """
+    global _listener
     logger = logging.getLogger("echopage")
-    logger.setLevel(logging.DEBUG)
+    with _lock:
+        if _listener is not None:
+            return logger
+        Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+        logger.setLevel(logging.DEBUG)
 
-    fh = logging.FileHandler(log_file)
-    fh.setLevel(logging.DEBUG)
+        fh = _file_handler(log_file)
+        fh.setLevel(logging.DEBUG)
 
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.INFO)
+        ch = logging.StreamHandler()
+        ch.setLevel(logging.INFO)
 
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        fh.setFormatter(formatter)
+        ch.setFormatter(formatter)
 
-    logger.addHandler(fh)
-    logger.addHandler(ch)
+        records = queue.SimpleQueue()
+        logger.addHandler(QueueHandler(records))
+        _listener = QueueListener(records, fh, ch, respect_handler_level=True)
+        _listener.start()
+        # Registered after logging's own exit hook, so it runs first and the
+        # queue is drained before the handlers are closed
+        atexit.register(_listener.stop)
 
     return logger
+
+def flush_logs():
+    """Block until every record logged so far has been written out."""
+    with _lock:
+        if _listener is None:
+            return
+        # stop() processes everything already queued before returning
+        _listener.stop()
+        _listener.start()
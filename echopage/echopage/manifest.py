@@ -0,0 +1,147 @@
+# echopage/manifest.py
+import json
+import os
+import threading
+from pathlib import Path
+
+from echopage import chapter_store
+from echopage.logger import setup_logger
+
+logger = setup_logger()
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# Per-chapter stage status, in pipeline order
+SCRAPED = "scraped"
+SYNTHESIZED = "synthesized"
+STAGES = (SCRAPED, SYNTHESIZED)
+
+
+class Manifest:
+    """
+    Job state for one title, kept in output/<title>/manifest.jsonl.
+
+    The file is an append-only journal: every update is one JSON line, so
+    recording a chapter costs a single small write no matter how long the
+    book is, and a crash mid-write loses at most the final partial line.
+    Loading folds the journal into the current state and compacts it.
+
+    State:
+        start_url: URL the run started from.
+        next_url: where scraping continues after the last scraped chapter
+            (None once a chapter had no next link).
+        chapters: {number: {"url", "title", "text_hash", "filepath" (or
+                            "store"), "mp3_path", "status"}}
+    """
+
+    def __init__(self, novel_title: str, path: Path = None):
+        self.novel_title = novel_title
+        self.path = Path(path) if path else (
+            Path("output") / novel_title.replace(" ", "_") / MANIFEST_NAME)
+        self.start_url = None
+        self.next_url = None
+        self.chapters = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, novel_title: str, path: Path = None) -> "Manifest":
+        """Read and compact an existing manifest (empty if there is none)."""
+        manifest = cls(novel_title, path)
+        if not manifest.path.exists():
+            return manifest
+        with open(manifest.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    manifest._apply(json.loads(line))
+                except ValueError:
+                    logger.warning(f"Ignoring corrupt manifest line in {manifest.path}")
+        manifest._compact()
+        return manifest
+
+    def reset(self, start_url: str) -> None:
+        """Start a fresh journal for a new run."""
+        with self._lock:
+            self.start_url = start_url
+            self.next_url = start_url
+            self.chapters = {}
+            self._compact_locked()
+
+    def _apply(self, record: dict) -> None:
+        if "start_url" in record:
+            self.start_url = record["start_url"]
+        if "next_url" in record:
+            self.next_url = record["next_url"]
+        if "number" in record:
+            number = int(record["number"])
+            fields = {k: v for k, v in record.items() if k not in ("number", "next_url")}
+            self.chapters.setdefault(number, {}).update(fields)
+
+    def _append(self, record: dict) -> None:
+        with self._lock:
+            self._apply(record)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def _compact(self) -> None:
+        with self._lock:
+            self._compact_locked()
+
+    def _compact_locked(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"start_url": self.start_url, "next_url": self.next_url}) + "\n")
+            for number in sorted(self.chapters):
+                f.write(json.dumps({"number": number, **self.chapters[number]}) + "\n")
+        os.replace(tmp, self.path)
+
+    def record_scraped(self, chap: dict) -> None:
+        """Record a saved chapter and where scraping continues from."""
+        record = {
+            "number": chap["number"],
+            "url": chap.get("url"),
+            "title": chap["title"],
+            "text_hash": chap.get("text_hash"),
+            "status": SCRAPED,
+            "next_url": chap.get("next_url"),
+        }
+        # Exactly one of the two, so a re-scrape under the other backend
+        # doesn't leave a stale location behind
+        if chap.get("store"):
+            record.update(store=str(chap["store"]), filepath=None)
+        else:
+            record.update(filepath=str(chap["filepath"]), store=None)
+        self._append(record)
+
+    def record_synthesized(self, number: int, mp3_path: str) -> None:
+        self._append({"number": number, "mp3_path": str(mp3_path), "status": SYNTHESIZED})
+        store = self.chapters[number].get("store")
+        if store:
+            chapter_store.open_store(store).set_stage(number, SYNTHESIZED, mp3_path)
+
+    def last_number(self) -> int:
+        return max(self.chapters, default=0)
+
+    def is_done(self, number: int, stage: str) -> bool:
+        """True if the chapter reached `stage` and its output file still exists."""
+        entry = self.chapters.get(number)
+        if not entry or STAGES.index(entry.get("status", SCRAPED)) < STAGES.index(stage):
+            return False
+        if stage == SYNTHESIZED:
+            location = entry.get("mp3_path")
+        else:
+            location = entry.get("filepath") or entry.get("store")
+        return bool(location) and Path(location).exists()
+
+    def chapter_dict(self, number: int) -> dict:
+        """Rebuild the chapter dict the pipeline stages pass around."""
+        entry = self.chapters[number]
+        return {
+            "number": number,
+            "title": entry["title"],
+            "filepath": Path(entry["filepath"]) if entry.get("filepath") else None,
+            "store": entry.get("store"),
+            "url": entry.get("url"),
+            "text_hash": entry.get("text_hash"),
+        }
@@ -0,0 +1,197 @@
+# echopage/metrics.py
+"""
+In-process timers and counters for one run.
+
+Stages record wall time with `timer("fetch")` (or utils.timed) and volume
+with `incr("http_bytes", n)`. At the end of a command the run is written
+as JSON to METRICS_DIR (logs/metrics), and optionally as a Prometheus
+textfile for node_exporter's textfile collector (METRICS_PROM_FILE).
+
+All timings use time.perf_counter, and the registry is safe to update
+from the scraper thread, upload threads and the event loop at once.
+Metrics recorded in worker processes are drained there and merged into
+the parent with each result (see executor.submit).
+"""
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from echopage import config
+
+config.load()
+
+METRICS_ENABLED = os.getenv("METRICS", "1").lower() in ("1", "true", "yes")
+METRICS_DIR = Path(os.getenv("METRICS_DIR", "logs/metrics"))
+METRICS_PROM_FILE = os.getenv("METRICS_PROM_FILE")  # e.g. /var/lib/node_exporter/echopage.prom
+
+_lock = threading.Lock()
+_timers = {}    # name -> list of durations in seconds
+_counters = {}  # name -> number
+_run = {"started_at": time.time(), "start": time.perf_counter()}
+
+
+def start_run() -> None:
+    """Forget everything recorded so far and restart the run clock."""
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+        _run["started_at"] = time.time()
+        _run["start"] = time.perf_counter()
+
+
+def observe(name: str, seconds: float) -> None:
+    """Record one duration for the named timer."""
+    with _lock:
+        _timers.setdefault(name, []).append(seconds)
+
+
+def incr(name: str, value: float = 1) -> None:
+    """Add value to the named counter."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def drain() -> dict:
+    """Take and clear everything recorded so far, to ship it out of a worker process."""
+    with _lock:
+        recorded = {"timers": dict(_timers), "counters": dict(_counters)}
+        _timers.clear()
+        _counters.clear()
+    return recorded
+
+
+def merge(recorded: dict) -> None:
+    """Add timers and counters returned by drain() in another process."""
+    with _lock:
+        for name, samples in recorded["timers"].items():
+            _timers.setdefault(name, []).extend(samples)
+        for name, value in recorded["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+@contextmanager
+def timer(name: str):
+    """Time the body of a with-block into the named timer, even if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def _quantile(ordered: list, q: float) -> float:
+    k = (len(ordered) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def snapshot() -> dict:
+    """
+    Summarize the run so far.
+
+    Returns:
+        {'elapsed_seconds', 'timers': {name: {count, total, mean, min, max,
+        p50, p95}}, 'counters': {name: value}}. Timer totals are summed
+        over calls, so concurrent stages can add up to more than elapsed.
+    """
+    with _lock:
+        timers = {name: sorted(samples) for name, samples in _timers.items()}
+        counters = dict(_counters)
+        elapsed = time.perf_counter() - _run["start"]
+    summary = {}
+    for name, samples in sorted(timers.items()):
+        total = sum(samples)
+        summary[name] = {
+            "count": len(samples),
+            "total": round(total, 6),
+            "mean": round(total / len(samples), 6),
+            "min": round(samples[0], 6),
+            "max": round(samples[-1], 6),
+            "p50": round(_quantile(samples, 0.50), 6),
+            "p95": round(_quantile(samples, 0.95), 6),
+        }
+    return {"elapsed_seconds": round(elapsed, 6), "timers": summary,
+            "counters": dict(sorted(counters.items()))}
+
+
+def _prom_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _prom_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _prometheus_text(report: dict) -> str:
+    labels = f'title="{_prom_label(report["title"])}",command="{_prom_label(report["command"])}"'
+    lines = [
+        "# HELP echopage_last_run_timestamp_seconds Unix time the last run finished.",
+        "# TYPE echopage_last_run_timestamp_seconds gauge",
+        f"echopage_last_run_timestamp_seconds{{{labels}}} {report['finished_at_unix']:.0f}",
+        "# HELP echopage_last_run_duration_seconds Wall time of the last run.",
+        "# TYPE echopage_last_run_duration_seconds gauge",
+        f"echopage_last_run_duration_seconds{{{labels}}} {report['elapsed_seconds']}",
+        "# HELP echopage_last_run_success 1 if the last run succeeded.",
+        "# TYPE echopage_last_run_success gauge",
+        f"echopage_last_run_success{{{labels}}} {int(report['status'] == 'success')}",
+        "# HELP echopage_last_run_stage_seconds Time spent per stage, summed over calls.",
+        "# TYPE echopage_last_run_stage_seconds gauge",
+    ]
+    for name, stats in report["timers"].items():
+        lines.append(f'echopage_last_run_stage_seconds{{{labels},stage="{_prom_name(name)}"}} {stats["total"]}')
+    lines += [
+        "# HELP echopage_last_run_stage_calls Calls per stage.",
+        "# TYPE echopage_last_run_stage_calls gauge",
+    ]
+    for name, stats in report["timers"].items():
+        lines.append(f'echopage_last_run_stage_calls{{{labels},stage="{_prom_name(name)}"}} {stats["count"]}')
+    for name, value in report["counters"].items():
+        metric = f"echopage_last_run_{_prom_name(name)}"
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric}{{{labels}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def export_run(novel_title: str, command: str, status: str = "success") -> Path:
+    """
+    Write this run's metrics as JSON, plus the Prometheus textfile if
+    METRICS_PROM_FILE is set.
+
+    Args:
+        novel_title: Book the run worked on.
+        command: CLI command name, e.g. "run" or "update".
+        status: "success" or "failure".
+
+    Returns:
+        Path of the JSON report, or None when metrics are disabled.
+    """
+    if not METRICS_ENABLED:
+        return None
+    report = {
+        "title": novel_title,
+        "command": command,
+        "status": status,
+        "started_at": datetime.fromtimestamp(_run["started_at"], timezone.utc).isoformat(),
+        "finished_at_unix": time.time(),
+        **snapshot(),
+    }
+    stamp = datetime.fromtimestamp(_run["started_at"], timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    safe_title = re.sub(r"[^\w.-]+", "_", novel_title)
+    json_path = METRICS_DIR / f"{safe_title}-{command}-{stamp}.json"
+    _write_atomic(json_path, json.dumps(report, indent=2))
+    if METRICS_PROM_FILE:
+        _write_atomic(Path(METRICS_PROM_FILE), _prometheus_text(report))
+    return json_path
@@ -0,0 +1,217 @@
+# echopage/parsing.py
+"""
+HTML parser backends for chapter pages.
+
+Each backend turns page HTML into a document and extracts the chapter title,
+content text and next-chapter href with the configured CSS selectors.
+C-based backends (selectolax/lexbor, lxml) are preferred when installed;
+BeautifulSoup is the always-available fallback.
+"""
+import os
+from typing import Optional
+
+from echopage import config
+from echopage.logger import setup_logger
+
+config.load()
+logger = setup_logger()
+
+# "auto" picks the fastest installed backend
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "auto").lower()
+
+# Tags whose text is never chapter prose
+_NON_TEXT_TAGS = ("script", "style", "noscript")
+
+
+class ParserBackend:
+    """Base class: parse HTML once, then answer title/content/next queries."""
+
+    name = "base"
+
+    def __init__(self, title_selector: str, content_selector: str, next_selector: str):
+        self.title_selector = title_selector
+        self.content_selector = content_selector
+        self.next_selector = next_selector
+
+    def parse(self, html: str):
+        raise NotImplementedError
+
+    def title(self, doc) -> Optional[str]:
+        raise NotImplementedError
+
+    def content(self, doc) -> Optional[str]:
+        raise NotImplementedError
+
+    def next_href(self, doc) -> Optional[str]:
+        raise NotImplementedError
+
+    def hrefs(self, doc, selector: str) -> list:
+        """hrefs of every element matching selector, in document order (e.g. a TOC)."""
+        raise NotImplementedError
+
+
+class SelectolaxBackend(ParserBackend):
+    """Lexbor engine via selectolax; the fastest option when installed."""
+
+    name = "selectolax"
+
+    def __init__(self, *selectors):
+        from selectolax.lexbor import LexborHTMLParser
+        super().__init__(*selectors)
+        self._parser = LexborHTMLParser
+
+    def parse(self, html):
+        return self._parser(html)
+
+    def title(self, doc):
+        node = doc.css_first(self.title_selector)
+        return node.text(deep=True).strip() if node is not None else None
+
+    def content(self, doc):
+        node = doc.css_first(self.content_selector)
+        if node is None:
+            return None
+        node.strip_tags(list(_NON_TEXT_TAGS), recursive=False)
+        return node.text(deep=True, separator="\n").strip()
+
+    def next_href(self, doc):
+        node = doc.css_first(self.next_selector)
+        return node.attributes.get("href") if node is not None else None
+
+    def hrefs(self, doc, selector):
+        return [node.attributes["href"] for node in doc.css(selector)
+                if node.attributes.get("href")]
+
+
+class LxmlBackend(ParserBackend):
+    """libxml2 via lxml, with selectors compiled to XPath once."""
+
+    name = "lxml"
+
+    def __init__(self, *selectors):
+        import lxml.html
+        from lxml.cssselect import CSSSelector
+        super().__init__(*selectors)
+        self._fromstring = lxml.html.fromstring
+        self._title = CSSSelector(self.title_selector)
+        self._content = CSSSelector(self.content_selector)
+        self._next = CSSSelector(self.next_selector)
+        self._non_text = CSSSelector(", ".join(_NON_TEXT_TAGS))
+        self._compiled = {}  # other selectors (hrefs), compiled on first use
+
+    def parse(self, html):
+        return self._fromstring(html)
+
+    def title(self, doc):
+        found = self._title(doc)
+        return found[0].text_content().strip() if found else None
+
+    def content(self, doc):
+        found = self._content(doc)
+        if not found:
+            return None
+        node = found[0]
+        for junk in self._non_text(node):
+            junk.drop_tree()
+        return "\n".join(node.itertext()).strip()
+
+    def next_href(self, doc):
+        found = self._next(doc)
+        return found[0].get("href") if found else None
+
+    def hrefs(self, doc, selector):
+        compiled = self._compiled.get(selector)
+        if compiled is None:
+            from lxml.cssselect import CSSSelector
+            compiled = self._compiled[selector] = CSSSelector(selector)
+        return [node.get("href") for node in compiled(doc) if node.get("href")]
+
+
+class SoupBackend(ParserBackend):
+    """BeautifulSoup with html.parser; pure-Python fallback."""
+
+    name = "bs4"
+
+    def __init__(self, *selectors):
+        import soupsieve
+        from bs4 import BeautifulSoup
+        super().__init__(*selectors)
+        self._soup = BeautifulSoup
+        self._title = soupsieve.compile(self.title_selector)
+        self._content = soupsieve.compile(self.content_selector)
+        self._next = soupsieve.compile(self.next_selector)
+        self._non_text = soupsieve.compile(", ".join(_NON_TEXT_TAGS))
+        self._compile = soupsieve.compile
+        self._compiled = {}  # other selectors (hrefs), compiled on first use
+
+    def parse(self, html):
+        return self._soup(html, "html.parser")
+
+    def title(self, doc):
+        node = self._title.select_one(doc)
+        return node.text.strip() if node is not None else None
+
+    def content(self, doc):
+        node = self._content.select_one(doc)
+        if node is None:
+            return None
+        # Same text as the other backends, whichever parser is installed
+        for junk in self._non_text.select(node):
+            junk.decompose()
+        return node.get_text(separator="\n").strip()
+
+    def next_href(self, doc):
+        node = self._next.select_one(doc)
+        return node.get("href") if node is not None else None
+
+    def hrefs(self, doc, selector):
+        compiled = self._compiled.get(selector)
+        if compiled is None:
+            compiled = self._compiled[selector] = self._compile(selector)
+        return [node.get("href") for node in compiled.select(doc) if node.get("href")]
+
+
+BACKENDS = {
+    SelectolaxBackend.name: SelectolaxBackend,
+    LxmlBackend.name: LxmlBackend,
+    SoupBackend.name: SoupBackend,
+}
+
+def available_backends() -> list:
+    """Names of the backends whose libraries import in this environment."""
+    names = []
+    for name, cls in BACKENDS.items():
+        try:
+            cls("h1", "div", "a")
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+def get_backend(title_selector: str, content_selector: str, next_selector: str,
+                name: str = None) -> ParserBackend:
+    """
+    Build a parser backend for the given selectors.
+
+    Args:
+        name: "selectolax", "lxml", "bs4" or "auto" (defaults to PARSER_BACKEND).
+            "auto" tries them in that order. An explicitly named backend that
+            is not installed falls back to bs4 with a warning.
+    """
+    name = (name or PARSER_BACKEND).lower()
+    selectors = (title_selector, content_selector, next_selector)
+    order = list(BACKENDS) if name == "auto" else [name, SoupBackend.name]
+    for candidate in order:
+        cls = BACKENDS.get(candidate)
+        if cls is None:
+            logger.warning(f"Unknown parser backend '{candidate}'")
+            continue
+        try:
+            backend = cls(*selectors)
+        except ImportError:
+            if name != "auto":
+                logger.warning(f"Parser backend '{candidate}' is not installed; falling back to bs4")
+            continue
+        logger.debug(f"Using '{backend.name}' HTML parser backend")
+        return backend
+    raise ImportError("No HTML parser backend available (install beautifulsoup4)")
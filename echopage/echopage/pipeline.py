@@ -0,0 +1,563 @@
+# echopage/pipeline.py
+import asyncio
+import concurrent.futures
+import os
+import threading
+from pathlib import Path
+
+from echopage import cache, config, tts
+from echopage import audio, executor, metrics, tts_engines
+from echopage.audio import append_audio, compile_audio
+from echopage.logger import setup_logger
+from echopage.manifest import SCRAPED, SYNTHESIZED, Manifest
+from echopage.ratelimit import TokenBucket
+from echopage.scraper import find_next_url, iter_chapters
+
+config.load()
+logger = setup_logger()
+
+# Max items waiting between two stages before the upstream stage blocks
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 8))
+
+# End-of-stream marker passed down the queues
+_DONE = object()
+
+# How often the scraper thread, while blocked on a full queue, checks
+# whether the run has been stopped
+_PUT_POLL_SECONDS = 0.5
+
+
+class _Stopped(Exception):
+    """The stage that started the scraper thread has been cancelled."""
+
+def _resume_plan(manifest: Manifest, count: int) -> tuple:
+    """
+    Work out what a resumed run still has to do.
+
+    Returns:
+        (done, pending, scrape_url, start_number) where done maps chapter
+        number to existing MP3 path, pending lists chapter dicts that were
+        scraped but not synthesized, and scraping restarts at scrape_url
+        (None if the book had already ended) numbered from start_number.
+    """
+    done, pending = {}, []
+    for number in sorted(n for n in manifest.chapters if n <= count):
+        if manifest.is_done(number, SYNTHESIZED):
+            done[number] = manifest.chapters[number]["mp3_path"]
+        elif manifest.is_done(number, SCRAPED):
+            pending.append(manifest.chapter_dict(number))
+        else:
+            # Text went missing: re-scrape from this chapter onwards
+            later = [n for n in done if n > number]
+            for n in later:
+                del done[n]
+            pending = [c for c in pending if c["number"] < number]
+            return done, pending, manifest.chapters[number].get("url"), number
+    return done, pending, manifest.next_url, manifest.last_number() + 1
+
+async def _scrape_stage(start_url: str, count: int, novel_title: str,
+                        out_queue: asyncio.Queue, manifest: Manifest,
+                        pending: list = (), start_number: int = 1,
+                        scrape: dict = None, pool=None):
+    """
+    Run the blocking scraper in a thread, handing chapters to the TTS stage.
+    scrape holds iter_chapters' prefetch and execution backend options;
+    prefetched pages are parsed on pool, the encode pool.
+
+    If the stage is cancelled (e.g. because the TTS stage failed), the
+    thread is told to stop, so it never stays parked on a full queue that
+    nobody drains.
+    """
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+
+    def put(item):
+        # Blocks the scraper thread while the queue is full (backpressure)
+        future = asyncio.run_coroutine_threadsafe(out_queue.put(item), loop)
+        while True:
+            try:
+                return future.result(timeout=_PUT_POLL_SECONDS)
+            except concurrent.futures.TimeoutError:
+                if stop.is_set():
+                    future.cancel()
+                    raise _Stopped()
+
+    def produce():
+        try:
+            for chap in pending:
+                put(chap)
+            if not start_url or count <= 0:
+                return
+            for chap in iter_chapters(start_url, count, novel_title, start_number,
+                                      pool=pool, **(scrape or {})):
+                if stop.is_set():
+                    raise _Stopped()
+                manifest.record_scraped(chap)
+                put(chap)
+        except _Stopped:
+            logger.info(f"Scraping '{novel_title}' stopped.")
+            return
+        put(_DONE)
+
+    try:
+        await asyncio.to_thread(produce)
+    except BaseException:
+        stop.set()
+        raise
+
+async def _tts_worker(in_queue: asyncio.Queue, out_queue: asyncio.Queue,
+                      audio_dir: Path, semaphore: asyncio.Semaphore,
+                      limiter: TokenBucket, options: dict,
+                      manifest: Manifest):
+    """Synthesize chapters from in_queue until the end marker arrives."""
+    while True:
+        chap = await in_queue.get()
+        if chap is _DONE:
+            # Put the marker back so sibling workers stop too
+            await in_queue.put(_DONE)
+            return
+        path = await tts.synthesize_chapter(chap, audio_dir, semaphore, limiter, **options)
+        if path:
+            manifest.record_synthesized(chap["number"], path)
+            await out_queue.put((chap["number"], path))
+
+async def _encode_stage(in_queue: asyncio.Queue, results: dict, pool, workers: int,
+                        profiles: tuple, archive: audio.ChapterZip = None):
+    """
+    Encode each finished chapter to the segments of every output format on
+    the process pool as soon as it arrives (and store its MP3 in the
+    streamed ZIP), and gather chapter audio for the final compile.
+    """
+    loop = asyncio.get_running_loop()
+    # Bound in-flight encodes so the pool's own queue can't grow without limit
+    slots = asyncio.Semaphore(max(1, workers) * 2)
+    pending = set()
+    books = tuple(p for p in profiles if p in audio.SEGMENT_SUFFIXES)
+
+    async def encode(number, path):
+        try:
+            if books:
+                await asyncio.wrap_future(executor.submit(pool, audio.encode_chapter, path, books))
+        except Exception as e:
+            # compile_audio retries any chapter still missing its segment
+            logger.warning(f"Early encode failed for chapter {number}: {e}")
+        finally:
+            slots.release()
+        if archive:
+            try:
+                await loop.run_in_executor(None, archive.add, path)
+            except Exception as e:
+                # finish_zip adds any chapter the stream missed
+                logger.warning(f"Could not add chapter {number} to the ZIP: {e}")
+
+    while True:
+        item = await in_queue.get()
+        if item is _DONE:
+            break
+        number, path = item
+        results[number] = path
+        await slots.acquire()
+        task = asyncio.create_task(encode(number, path))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.gather(*pending)
+
+async def run_stages(novel_title: str, manifest: Manifest, plan: tuple, count: int,
+                     concurrency: int, semaphore: asyncio.Semaphore,
+                     limiter: TokenBucket, pool, workers: int,
+                     options: dict, queue_size: int, scrape: dict = None,
+                     profiles: tuple = None) -> dict:
+    """
+    Drive the stages for one title on the given TTS limits and encode pool.
+
+    The semaphore, limiter and pool may be shared with other titles running
+    on the same event loop (see batch.py), which is how a global TTS cap
+    and a single pool are applied across books. The pool also parses the
+    title's prefetched pages.
+
+    plan is (done, pending, scrape_url, start_number) as returned by
+    _resume_plan; chapters up to number `count` are processed. profiles
+    (defaults to OUTPUT_PROFILES) picks the segments encoded per chapter;
+    with "zip" among them the chapter MP3s are streamed into the title's
+    ZIP as they finish, for compile_audio/append_audio to complete.
+
+    Returns:
+        {chapter number: mp3 path} for every chapter with audio.
+    """
+    results, pending, scrape_url, start_number = plan
+    results = dict(results)
+    audio_dir = Path("output") / novel_title.replace(" ", "_") / "audio"
+    audio_dir.mkdir(parents=True, exist_ok=True)
+
+    chapter_queue = asyncio.Queue(maxsize=queue_size)
+    audio_queue = asyncio.Queue(maxsize=queue_size)
+
+    profiles = audio.output_profiles(profiles)
+    archive = (audio.ChapterZip(audio.output_path_for(novel_title, "zip"))
+               if "zip" in profiles else None)
+    encoder = asyncio.create_task(_encode_stage(audio_queue, results, pool, workers,
+                                                profiles, archive))
+    tts_workers = [
+        asyncio.create_task(_tts_worker(chapter_queue, audio_queue, audio_dir,
+                                        semaphore, limiter, options, manifest))
+        for _ in range(max(1, concurrency))
+    ]
+    scraper = asyncio.create_task(_scrape_stage(
+        scrape_url, count - start_number + 1, novel_title,
+        chapter_queue, manifest, pending, start_number, scrape, pool))
+    try:
+        # A failing TTS worker surfaces here at once, cancelling the scraper
+        await asyncio.gather(scraper, *tts_workers)
+        await audio_queue.put(_DONE)
+        await encoder
+    finally:
+        for task in [scraper] + tts_workers + [encoder]:
+            task.cancel()
+        if archive:
+            archive.close()
+    return results
+
+async def _run(novel_title: str, manifest: Manifest, plan: tuple, count: int,
+               concurrency: int, requests_per_sec: float, options: dict,
+               queue_size: int, scrape: dict, profiles: tuple) -> dict:
+    """Drive the stages for a single title with its own limits and encode pool."""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    limiter = tts.tts_limiter(requests_per_sec)
+    workers = scrape["workers"] or audio.ENCODE_WORKERS
+    with audio.encode_pool(workers, scrape["backend"]) as pool:
+        return await run_stages(novel_title, manifest, plan, count, concurrency,
+                                semaphore, limiter, pool, workers,
+                                options, queue_size, scrape, profiles)
+
+def resolve_options(concurrency=None, requests_per_sec=None, chunked=None,
+                    use_cache=None, queue_size=None, prefetch=None, toc_url=None,
+                    backend=None, workers=None, engine=None, formats=None) -> dict:
+    """
+    Fill unset pipeline settings from the .env defaults.
+
+    backend and workers pick the execution backend for parsing and
+    encoding; None leaves them to EXEC_BACKEND and EXEC_WORKERS/ENCODE_WORKERS.
+    engine picks the TTS engine; None leaves it to TTS_ENGINE. formats
+    lists the output formats (see audio.output_profiles).
+    """
+    if backend and backend not in executor.BACKENDS:
+        raise ValueError(f"Unknown execution backend '{backend}' "
+                         f"(use {', '.join(executor.BACKENDS)})")
+    if engine and engine not in tts_engines.ENGINES:
+        raise ValueError(f"Unknown TTS engine '{engine}' "
+                         f"(use {', '.join(tts_engines.ENGINES)})")
+    if chunked is None:
+        chunked = tts.TTS_CHUNKED
+    if use_cache is None:
+        use_cache = cache.TTS_CACHE_ENABLED
+    return {
+        "concurrency": tts.TTS_CONCURRENCY if concurrency is None else concurrency,
+        "requests_per_sec": tts.TTS_REQUESTS_PER_SEC if requests_per_sec is None else requests_per_sec,
+        "options": {
+            "chunked": chunked,
+            "max_chars": tts.TTS_CHUNK_CHARS,
+            "use_cache": use_cache,
+            "engine": engine,
+        },
+        "queue_size": max(1, PIPELINE_QUEUE_SIZE if queue_size is None else queue_size),
+        "profiles": audio.output_profiles(formats),
+        # None leaves SCRAPE_PREFETCH / TOC_URL and the backend to the scraper
+        "scrape": {"prefetch": prefetch, "toc_url": toc_url,
+                   "backend": backend, "workers": workers},
+    }
+
+def plan_run(novel_title: str, start_url: str, count: int, resume: bool = False) -> tuple:
+    """
+    Open the title's manifest and work out what a run has to do.
+
+    Returns:
+        (manifest, plan), plan as for run_stages. Without resume (or with
+        no journal yet) the manifest is reset and scraping starts at
+        start_url.
+    """
+    manifest = Manifest.load(novel_title) if resume else Manifest(novel_title)
+    if resume and manifest.chapters:
+        plan = _resume_plan(manifest, count)
+        logger.info(f"Resuming '{novel_title}': {len(plan[0])} chapters done, "
+                    f"{len(plan[1])} awaiting TTS, scraping from "
+                    f"{plan[2] or '(end of book)'}")
+    else:
+        manifest.reset(start_url)
+        plan = ({}, [], start_url, 1)
+    return manifest, plan
+
+def plan_update(novel_title: str) -> tuple:
+    """
+    Work out where an update of a finished title starts scraping.
+
+    The manifest tells us the last chapter we have. Scraping starts from its
+    recorded next-chapter URL, or, if that chapter had no next link at the
+    time, from the next link found by re-fetching it. Chapters scraped
+    earlier but never synthesized (a failed or interrupted TTS request) are
+    synthesized again along with the new ones.
+
+    Returns:
+        (manifest, plan), with plan None when there is nothing to do.
+
+    Raises:
+        RuntimeError: if the title has never been run.
+    """
+    manifest = Manifest.load(novel_title)
+    last = manifest.last_number()
+    if not last:
+        raise RuntimeError(f"No manifest for '{novel_title}'; run it once before updating.")
+
+    pending = [manifest.chapter_dict(number) for number in sorted(manifest.chapters)
+               if manifest.is_done(number, SCRAPED) and not manifest.is_done(number, SYNTHESIZED)]
+    if pending:
+        logger.info(f"Retrying {len(pending)} chapters of '{novel_title}' that have no audio.")
+
+    next_url = manifest.next_url
+    if not next_url:
+        next_url = find_next_url(manifest.chapters[last]["url"])
+    if not next_url:
+        logger.info(f"No new chapters for '{novel_title}' after chapter {last}.")
+        if not pending:
+            return manifest, None
+    else:
+        logger.info(f"Updating '{novel_title}' from chapter {last + 1}: {next_url}")
+    return manifest, ({}, pending, next_url, last + 1)
+
+def collect_audio(results: dict, manifest: Manifest) -> tuple:
+    """Chapter MP3s and their titles from run_stages results, in chapter order."""
+    numbers = sorted(results)
+    audio_files = [results[number] for number in numbers]
+    titles = [manifest.chapters[number]["title"] for number in numbers]
+    return audio_files, titles
+
+def synthesized_chapters(manifest: Manifest) -> dict:
+    """{chapter number: mp3 path} for every chapter the manifest has audio for."""
+    return {number: manifest.chapters[number]["mp3_path"] for number in manifest.chapters
+            if manifest.is_done(number, SYNTHESIZED)}
+
+def finish_update(novel_title: str, manifest: Manifest, results: dict,
+                  first_new: int, profiles: tuple = None) -> str:
+    """
+    Add an update's chapters to the books.
+
+    New chapters are appended. If the update also filled in earlier
+    chapters that had no audio, appending would put them out of order, so
+    the books are rebuilt from every synthesized chapter instead (a stream
+    copy; only the new chapters are encoded).
+
+    Args:
+        results: {chapter number: mp3 path} produced by the update.
+        first_new: Number of the first chapter after the existing book.
+        profiles: Output formats (defaults to OUTPUT_PROFILES).
+
+    Returns:
+        Path to the updated book in the first format.
+    """
+    book = collect_audio(synthesized_chapters(manifest), manifest)
+    if any(number < first_new for number in results):
+        logger.info(f"Rebuilding '{novel_title}' to place chapters that were missing.")
+        book_files, book_titles = book
+        return audio.rebuild_audio(book_files, novel_title, book_titles, profiles)
+    new_files, titles = collect_audio(results, manifest)
+    logger.info(f"Fetched {len(new_files)} new chapters.")
+    return append_audio(new_files, novel_title, titles=titles, profiles=profiles, book=book)
+
+def run_pipeline(start_url: str, count: int, novel_title: str,
+                 concurrency: int = None, requests_per_sec: float = None,
+                 chunked: bool = None, use_cache: bool = None,
+                 queue_size: int = None, resume: bool = False,
+                 author: str = None, cover: str = None,
+                 prefetch: str = None, toc_url: str = None,
+                 backend: str = None, workers: int = None,
+                 engine: str = None, formats=None) -> str:
+    """
+    Scrape, synthesize and compile a novel as overlapping stages.
+
+    Each chapter is handed to TTS as soon as it has been scraped, and to an
+    encode process as soon as it has been synthesized; bounded queues
+    between the stages keep a fast stage from running far ahead of a slow
+    one. The final books are stream-copied together once every chapter is
+    ready.
+
+    Progress is journaled to output/<title>/manifest.jsonl. With resume=True
+    chapters already synthesized are skipped, scraped-but-unsynthesized
+    chapters go straight to TTS, and scraping continues from the last
+    recorded next-chapter URL.
+
+    Args:
+        start_url: URL of the first chapter.
+        count: Maximum number of chapters to process.
+        novel_title: Used for folder and output naming.
+        concurrency, requests_per_sec, chunked, use_cache: As for
+            tts.generate_audio; None picks the .env defaults.
+        queue_size: Capacity of each inter-stage queue (defaults to
+            PIPELINE_QUEUE_SIZE).
+        resume: Continue from the title's manifest instead of start_url.
+        author, cover: Book tags for the M4B, as for audio.compile_audio.
+        prefetch, toc_url: Speculative chapter prefetch, as for
+            scraper.iter_chapters.
+        backend, workers: Execution backend ("serial", "threads" or
+            "processes") and pool size for parsing and encoding.
+        engine: TTS engine, "edge" or "piper" (defaults to TTS_ENGINE).
+        formats: Output formats, e.g. "m4b,opus,zip" (defaults to
+            OUTPUT_PROFILES), see audio.output_profiles.
+
+    Returns:
+        Path to the book in the first format (or the fallback .zip).
+    """
+    settings = resolve_options(concurrency, requests_per_sec, chunked, use_cache,
+                               queue_size, prefetch, toc_url, backend, workers, engine,
+                               formats)
+    manifest, plan = plan_run(novel_title, start_url, count, resume)
+
+    results = asyncio.run(_run(novel_title, manifest, plan, count, **settings))
+    if settings["options"]["use_cache"]:
+        cache.prune()
+
+    audio_files, titles = collect_audio(results, manifest)
+    logger.info(f"Pipeline produced audio for {len(audio_files)} chapters.")
+    if not audio_files:
+        raise RuntimeError("No chapter audio was produced.")
+    return compile_audio(audio_files, novel_title, titles=titles,
+                         author=author, cover=cover, profiles=settings["profiles"])
+
+def update_pipeline(novel_title: str, max_new: int = 1000,
+                    concurrency: int = None, requests_per_sec: float = None,
+                    chunked: bool = None, use_cache: bool = None,
+                    queue_size: int = None, prefetch: str = None,
+                    backend: str = None, workers: int = None,
+                    engine: str = None, formats=None) -> str:
+    """
+    Fetch and synthesize only the chapters published since the last run,
+    then append them to the existing books. Where scraping picks up is
+    decided by plan_update, and finish_update adds the chapters to the books.
+
+    Args:
+        novel_title: Title of a book previously produced by run_pipeline.
+        max_new: Upper bound on new chapters fetched in this update.
+        concurrency, requests_per_sec, chunked, use_cache, queue_size,
+        prefetch, backend, workers, engine, formats: As for run_pipeline.
+
+    Returns:
+        Path to the updated book in the first format.
+    """
+    settings = resolve_options(concurrency, requests_per_sec, chunked, use_cache,
+                               queue_size, prefetch, backend=backend, workers=workers,
+                               engine=engine, formats=formats)
+    manifest, plan = plan_update(novel_title)
+    if plan is None:
+        return append_audio([], novel_title, profiles=settings["profiles"])
+
+    results = asyncio.run(_run(novel_title, manifest, plan, plan[3] - 1 + max_new, **settings))
+    if settings["options"]["use_cache"]:
+        cache.prune()
+
+    return finish_update(novel_title, manifest, results, plan[3], settings["profiles"])
+
+def scrape_only(start_url: str, count: int, novel_title: str, resume: bool = False,
+                prefetch: str = None, toc_url: str = None,
+                backend: str = None, workers: int = None) -> int:
+    """
+    Scrape chapters into output/<title>/ and the manifest without
+    synthesizing them; synthesize_only and compile_only take it from there.
+
+    Args:
+        start_url, count, novel_title, resume, prefetch, toc_url, backend,
+        workers: As for run_pipeline.
+
+    Returns:
+        Number of chapters scraped.
+    """
+    manifest, plan = plan_run(novel_title, start_url, count, resume)
+    _, _, scrape_url, start_number = plan
+    scraped = 0
+    if scrape_url and count >= start_number:
+        for chap in iter_chapters(scrape_url, count - start_number + 1, novel_title,
+                                  start_number, prefetch, toc_url, backend, workers):
+            manifest.record_scraped(chap)
+            scraped += 1
+    return scraped
+
+async def _synthesize_pending(novel_title: str, manifest: Manifest, chapters: list,
+                              concurrency: int, requests_per_sec: float,
+                              options: dict) -> list:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    limiter = tts.tts_limiter(requests_per_sec)
+    audio_dir = Path("output") / novel_title.replace(" ", "_") / "audio"
+    audio_dir.mkdir(parents=True, exist_ok=True)
+
+    async def synthesize(chap):
+        path = await tts.synthesize_chapter(chap, audio_dir, semaphore, limiter, **options)
+        if path:
+            manifest.record_synthesized(chap["number"], path)
+        return path
+
+    return await asyncio.gather(*(synthesize(chap) for chap in chapters))
+
+def synthesize_only(novel_title: str, concurrency: int = None,
+                    requests_per_sec: float = None, chunked: bool = None,
+                    use_cache: bool = None, engine: str = None) -> int:
+    """
+    Synthesize every chapter the manifest has scraped but not yet voiced.
+
+    Args:
+        novel_title: Title of a book scraped by scrape_only or run_pipeline.
+        concurrency, requests_per_sec, chunked, use_cache, engine: As for
+            run_pipeline.
+
+    Returns:
+        Number of chapters synthesized.
+
+    Raises:
+        RuntimeError: if the title has never been scraped.
+    """
+    settings = resolve_options(concurrency, requests_per_sec, chunked, use_cache,
+                               engine=engine)
+    manifest = Manifest.load(novel_title)
+    if not manifest.chapters:
+        raise RuntimeError(f"No manifest for '{novel_title}'; scrape it first.")
+    chapters = [manifest.chapter_dict(number) for number in sorted(manifest.chapters)
+                if manifest.is_done(number, SCRAPED)
+                and not manifest.is_done(number, SYNTHESIZED)]
+    if not chapters:
+        logger.info(f"Every scraped chapter of '{novel_title}' already has audio.")
+        return 0
+
+    logger.info(f"Synthesizing {len(chapters)} chapters of '{novel_title}'")
+    paths = asyncio.run(_synthesize_pending(
+        novel_title, manifest, chapters, settings["concurrency"],
+        settings["requests_per_sec"], settings["options"]))
+    if settings["options"]["use_cache"]:
+        cache.prune()
+    return sum(1 for path in paths if path)
+
+def compile_only(novel_title: str, author: str = None, cover: str = None,
+                 workers: int = None, formats=None) -> str:
+    """
+    Compile the book from every chapter the manifest has audio for.
+
+    Args:
+        novel_title: Title of a book synthesized by synthesize_only or
+            run_pipeline.
+        author, cover: Book tags, as for audio.compile_audio.
+        workers: Encode workers (defaults to ENCODE_WORKERS).
+        formats: Output formats, as for run_pipeline.
+
+    Returns:
+        Path to the book in the first format (or the fallback .zip).
+
+    Raises:
+        RuntimeError: if no chapter has audio yet.
+    """
+    manifest = Manifest.load(novel_title)
+    results = synthesized_chapters(manifest)
+    if not results:
+        raise RuntimeError(f"No synthesized chapters for '{novel_title}'.")
+    missing = len(manifest.chapters) - len(results)
+    if missing:
+        logger.warning(f"{missing} scraped chapters of '{novel_title}' have no audio "
+                       f"and are left out.")
+    audio_files, titles = collect_audio(results, manifest)
+    return compile_audio(audio_files, novel_title, workers, titles=titles,
+                         author=author, cover=cover, profiles=formats)
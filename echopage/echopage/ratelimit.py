@@ -0,0 +1,169 @@
+# echopage/ratelimit.py
+"""
+Adaptive per-host request rate limits.
+
+Each host (and the TTS endpoint) gets one TokenBucket for the whole
+process, shared by scraper threads and asyncio tasks alike. Buckets
+follow AIMD: every throttled response (429/503) halves the rate and a
+Retry-After pauses the host entirely, while each success creeps the rate
+back up towards the configured ceiling.
+
+Rates are requests per second, configured with SCRAPE_RATE (any host),
+RATE_LIMITS for individual sites, e.g. "royalroad.com=0.5,example.org=4"
+(a site also covers its subdomains), and TTS_REQUESTS_PER_SEC for TTS.
+A rate of 0 means unlimited.
+"""
+import asyncio
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from echopage import config, metrics
+from echopage.logger import setup_logger
+
+config.load()
+logger = setup_logger()
+
+SCRAPE_RATE = float(os.getenv("SCRAPE_RATE", 1))
+SCRAPE_BURST = int(os.getenv("SCRAPE_BURST", 1))
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+
+# AIMD tuning: throttling multiplies the rate by RATE_DECREASE; each success
+# adds RATE_INCREASE x the ceiling; the rate never drops below the ceiling / RATE_FLOOR_DIVISOR
+RATE_DECREASE = float(os.getenv("RATE_DECREASE", 0.5))
+RATE_INCREASE = float(os.getenv("RATE_INCREASE", 0.1))
+RATE_FLOOR_DIVISOR = float(os.getenv("RATE_FLOOR_DIVISOR", 16))
+
+THROTTLE_STATUSES = (429, 503)
+
+def _parse_site_rates(spec: str) -> dict:
+    rates = {}
+    for item in spec.split(","):
+        if "=" in item:
+            site, rate = item.split("=", 1)
+            rates[site.strip().lower()] = float(rate)
+    return rates
+
+_SITE_RATES = _parse_site_rates(RATE_LIMITS)
+
+def configured_rate(host: str) -> float:
+    """Rate ceiling for a host: the most specific RATE_LIMITS match, else SCRAPE_RATE."""
+    host = host.lower().split(":")[0]
+    parts = host.split(".")
+    for i in range(len(parts)):
+        site = ".".join(parts[i:])
+        if site in _SITE_RATES:
+            return _SITE_RATES[site]
+    return SCRAPE_RATE
+
+def retry_after_seconds(value) -> float:
+    """Parse a Retry-After header (seconds or HTTP date); None if absent or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket with AIMD rate adaptation.
+
+    acquire() (threads) and acquire_async() (asyncio) reserve a token under
+    a lock and then wait outside it, so waiters are served in arrival order
+    and a sleeping caller never blocks the others.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, name: str = ""):
+        self.name = name
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self.configure(rate, burst)
+
+    def configure(self, rate: float, burst: int = None) -> None:
+        """Set a new ceiling (and burst); the current rate restarts there."""
+        with self._lock:
+            self.max_rate = max(0.0, rate)
+            self.min_rate = self.max_rate / RATE_FLOOR_DIVISOR
+            self.rate = self.max_rate
+            if burst is not None:
+                self.burst = max(1, burst)
+            self._tokens = float(self.burst)
+            self._updated = time.monotonic()
+
+    def _reserve(self) -> float:
+        """Take one token, possibly on credit; return how long to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            if self.rate <= 0:
+                return max(0.0, self._paused_until - now)
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(delay, self._paused_until - now)
+
+    def acquire(self) -> None:
+        """Block the calling thread until a request may start."""
+        delay = self._reserve()
+        if delay > 0:
+            metrics.observe("rate_limit_wait", delay)
+            time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        """Wait, without blocking the event loop, until a request may start."""
+        delay = self._reserve()
+        if delay > 0:
+            metrics.observe("rate_limit_wait", delay)
+            await asyncio.sleep(delay)
+
+    def on_success(self) -> None:
+        """Additive increase towards the configured ceiling."""
+        with self._lock:
+            if self.max_rate and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_INCREASE)
+
+    def on_throttle(self, retry_after: float = None) -> None:
+        """Multiplicative decrease, plus a pause of retry_after seconds if given."""
+        with self._lock:
+            if self.max_rate:
+                self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            rate = self.rate
+        metrics.incr("rate_limit_throttled")
+        pause = f", pausing {retry_after:.1f}s" if retry_after else ""
+        logger.warning(f"Throttled by {self.name or 'server'}: "
+                       f"rate now {rate:.2f}/s{pause}")
+
+
+_registry_lock = threading.Lock()
+_registry = {}
+
+def limiter_for(key: str, rate: float = None, burst: int = None) -> TokenBucket:
+    """
+    The process-wide bucket for a host or endpoint, created on first use.
+
+    Args:
+        key: Host name (port allowed), or any name for a non-HTTP endpoint.
+        rate: Ceiling in requests/sec; defaults to configured_rate(key).
+            Passing a rate to an existing bucket reconfigures it.
+        burst: Requests allowed back to back after an idle spell
+            (defaults to SCRAPE_BURST).
+    """
+    with _registry_lock:
+        bucket = _registry.get(key)
+        if bucket is None:
+            bucket = TokenBucket(configured_rate(key) if rate is None else rate,
+                                 SCRAPE_BURST if burst is None else burst, name=key)
+            _registry[key] = bucket
+            return bucket
+    if rate is not None and (rate != bucket.max_rate or (burst and burst != bucket.burst)):
+        bucket.configure(rate, burst)
+    return bucket
@@ -1,14 +1,18 @@
+import hashlib
 import os
-import requests
-from bs4 import BeautifulSoup
-from dotenv import load_dotenv
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from time import sleep
+from urllib.parse import urldefrag, urljoin
 
-from echopage.echopage.utils import sanitize_filename
+from echopage import chapter_store, cleaner, config, executor, metrics
+from echopage.http_client import fetch_text
+from echopage.parsing import get_backend
+from echopage.utils import chapter_filename, timed
 from echopage.logger import setup_logger
 
-load_dotenv()
+config.load()
 logger = setup_logger()
 
 # Load selectors from .env
@@ -16,76 +20,355 @@ TITLE_SELECTOR = os.getenv("CHAPTER_TITLE_SELECTOR", "h1")
 CONTENT_SELECTOR = os.getenv("CHAPTER_CONTENT_SELECTOR", "div.chapter-content")
 NEXT_SELECTOR = os.getenv("NEXT_CHAPTER_SELECTOR", "a.next")
 
-def fetch_page(url):
+# Speculative prefetch: "off", "toc" (chapter links matched by TOC_SELECTOR
+# on the TOC_URL page) or "pattern" (numbering inferred from chapter 1 -> 2)
+SCRAPE_PREFETCH = os.getenv("SCRAPE_PREFETCH", "off")
+TOC_URL = os.getenv("TOC_URL")
+TOC_SELECTOR = os.getenv("TOC_SELECTOR", "ul.chapter-list a")
+SCRAPE_PREFETCH_WORKERS = int(os.getenv("SCRAPE_PREFETCH_WORKERS", 4))
+
+PREFETCH_MODES = ("off", "toc", "pattern")
+
+# Selectors are compiled once by the chosen backend (see PARSER_BACKEND)
+PARSER = get_backend(TITLE_SELECTOR, CONTENT_SELECTOR, NEXT_SELECTOR)
+
+def fetch_html(url):
+    """Download a page's HTML; None (logged) if the request fails."""
     try:
         logger.info(f"Fetching: {url}")
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return BeautifulSoup(response.text, "html.parser")
+        return fetch_text(url)
     except Exception as e:
         logger.error(f"Failed to fetch page: {e}")
         return None
 
-def parse_chapter(soup):
+def fetch_page(url):
+    html = fetch_html(url)
+    if html is None:
+        return None
+    try:
+        with metrics.timer("parse"):
+            return PARSER.parse(html)
+    except Exception as e:
+        logger.error(f"Failed to parse page: {e}")
+        return None
+
+def parse_chapter(doc):
     try:
-        title = soup.select_one(TITLE_SELECTOR).text.strip()
-        content_div = soup.select_one(CONTENT_SELECTOR)
-        content = content_div.get_text(separator="\n").strip()
+        with metrics.timer("extract"):
+            title = PARSER.title(doc)
+            content = PARSER.content(doc)
         return title, content
     except Exception as e:
         logger.error(f"Error parsing chapter: {e}")
         return None, None
 
-def get_next_chapter_url(soup):
+def get_next_chapter_url(doc):
     try:
-        next_link = soup.select_one(NEXT_SELECTOR)
-        return next_link['href'] if next_link and 'href' in next_link.attrs else None
+        return PARSER.next_href(doc)
     except Exception as e:
         logger.warning(f"No next chapter link found: {e}")
         return None
 
+def find_next_url(url):
+    """Re-fetch a chapter page and return its absolute next-chapter URL, if any."""
+    doc = fetch_page(url)
+    if doc is None:
+        return None
+    next_url = get_next_chapter_url(doc)
+    return urljoin(url, next_url) if next_url else None
+
+def chapter_text(title, content):
+    """The text stored for (and synthesized from) a chapter."""
+    return f"{title}\n\n{content}"
+
+@timed(name="save")
 def save_chapter(title, content, chapter_num, novel_dir):
-    safe_title = sanitize_filename(f"{chapter_num:03d}_{title.replace(' ', '_').replace('/', '-')}")+".txt"
-    filepath = Path(novel_dir) / safe_title
+    filepath = Path(novel_dir) / chapter_filename(title, chapter_num)
     with open(filepath, "w", encoding="utf-8") as f:
-        f.write(f"{title}\n\n{content}")
+        f.write(chapter_text(title, content))
     return filepath
 
-def scrape_chapters(start_url, count, novel_title):
-    current_url = start_url
-    novel_dir = Path("output") / novel_title.replace(" ", "_")
-    novel_dir.mkdir(parents=True, exist_ok=True)
+def _same_page(a, b):
+    """Compare URLs ignoring fragments and a trailing slash."""
+    return urldefrag(a)[0].rstrip("/") == urldefrag(b)[0].rstrip("/")
+
+def infer_url_pattern(url, next_url):
+    """
+    Guess how chapter URLs are numbered from two consecutive ones.
+
+    Returns:
+        A function step -> URL of the chapter `step` places after url, or
+        None unless exactly one number differs and it goes up by one
+        (e.g. /chapter-9 -> /chapter-10, or /c/009 -> /c/010).
+    """
+    a = re.split(r"(\d+)", url)
+    b = re.split(r"(\d+)", next_url)
+    if len(a) != len(b):
+        return None
+    diffs = [i for i, (x, y) in enumerate(zip(a, b)) if x != y]
+    # re.split puts the captured digit runs at odd indices
+    if len(diffs) != 1 or diffs[0] % 2 == 0:
+        return None
+    i = diffs[0]
+    first = int(a[i])
+    if int(b[i]) != first + 1:
+        return None
+    width = len(a[i]) if a[i].startswith("0") else 0
+
+    def url_for(step):
+        parts = list(a)
+        parts[i] = str(first + step).zfill(width)
+        return "".join(parts)
+    return url_for
+
+def toc_chapter_urls(toc_url, selector, start_url):
+    """
+    Chapter URLs listed on a table-of-contents page, from start_url onwards.
+
+    Returns:
+        Absolute URLs in TOC order, or [] if the page can't be fetched or
+        doesn't list start_url.
+    """
+    doc = fetch_page(toc_url)
+    if doc is None:
+        return []
+    urls, seen = [], set()
+    for href in PARSER.hrefs(doc, selector):
+        url = urldefrag(urljoin(toc_url, href))[0]
+        if url not in seen:
+            seen.add(url)
+            urls.append(url)
+    for i, url in enumerate(urls):
+        if _same_page(url, start_url):
+            return urls[i:]
+    logger.warning(f"Start URL not found among {len(urls)} TOC links on {toc_url}")
+    return []
+
+def parse_page(html, url):
+    """
+    Parse and clean a chapter page.
 
-    chapters = []
+    Runs on the execution backend (see executor.py), possibly in another
+    process, so it takes the HTML string and returns plain data only.
 
-    for i in range(count):
-        soup = fetch_page(current_url)
-        if not soup:
-            logger.error(f"Skipping chapter {i + 1} due to fetch error.")
-            break
+    Returns:
+        {'title', 'content', 'next_url' (absolute or None), 'chars_removed'},
+        or None if the page has no title or content.
+    """
+    try:
+        with metrics.timer("parse"):
+            doc = PARSER.parse(html)
+    except Exception as e:
+        logger.error(f"Failed to parse page {url}: {e}")
+        return None
+    title, content = parse_chapter(doc)
+    if not title or not content:
+        return None
 
-        title, content = parse_chapter(soup)
-        if not title or not content:
-            logger.error(f"Skipping chapter {i + 1} due to parse error.")
-            break
+    with metrics.timer("clean"):
+        title, content, removed = cleaner.clean_chapter(title, content, url)
+    next_url = get_next_chapter_url(doc)
+    return {
+        "title": title,
+        "content": content,
+        "next_url": urljoin(url, next_url) if next_url else None,
+        "chars_removed": removed,
+    }
 
-        filepath = save_chapter(title, content, i + 1, novel_dir)
-        chapters.append({
-            "title": title,
-            "filepath": filepath,
-            "number": i + 1
-        })
+def _chapter_from_page(page, html, url, number, novel_dir):
+    """
+    Save a parsed page as chapter `number` and describe it; None if it
+    didn't parse. With CHAPTER_STORE=sqlite the text and raw HTML go into
+    the title's chapter store instead of a .txt file.
+    """
+    if page is None:
+        logger.error(f"Skipping chapter {number} due to parse error.")
+        return None
+    if page["chars_removed"]:
+        logger.debug(f"Chapter {number}: cleaning removed {page['chars_removed']} characters")
+    title, content = page["title"], page["content"]
+    chap = {
+        "title": title,
+        "number": number,
+        "url": url,
+        "next_url": page["next_url"],
+    }
+    if chapter_store.CHAPTER_STORE == "sqlite":
+        store = Path(novel_dir) / chapter_store.STORE_NAME
+        with metrics.timer("save"):
+            chap["text_hash"] = chapter_store.open_store(store).put(
+                number, title, chapter_text(title, content), html, url, page["next_url"])
+        chap["store"] = store
+    else:
+        chap["filepath"] = save_chapter(title, content, number, novel_dir)
+        chap["text_hash"] = hashlib.sha256(chapter_text(title, content).encode("utf-8")).hexdigest()
+    return chap
 
-        next_url = get_next_chapter_url(soup)
-        if not next_url:
+def _serial_chapters(url, number, count, novel_dir):
+    """
+    Follow next links one page at a time. Each page is parsed inline: the
+    next fetch needs its next link, so nothing could overlap with a
+    pool task and handing the page to another process would only add IPC.
+    """
+    for number in range(number, number + count):
+        html = fetch_html(url)
+        if html is None:
+            logger.error(f"Skipping chapter {number} due to fetch error.")
+            return
+        page = parse_page(html, url)
+        chap = _chapter_from_page(page, html, url, number, novel_dir)
+        if chap is None:
+            return
+        yield chap
+        if not chap["next_url"]:
             logger.warning("No next chapter found. Ending early.")
-            break
+            return
+        url = chap["next_url"]
+
+def _speculative_page(url, pool):
+    """
+    Fetch a guessed URL and parse it on pool, returning (html, page).
+    Several of these run at once, so parses overlap on the pool. A
+    miss past the last chapter is expected, so failures are logged at
+    debug level only and give (None, None).
+    """
+    try:
+        logger.debug(f"Prefetching: {url}")
+        html = fetch_text(url)
+    except Exception as e:
+        logger.debug(f"Prefetch of {url} failed: {e}")
+        return None, None
+    return html, executor.submit(pool, parse_page, html, url).result()
+
+def _prefetched_chapters(urls, number, novel_dir, parse_pool):
+    """
+    Fetch planned chapter URLs concurrently and yield the chapters in order.
+
+    Up to SCRAPE_PREFETCH_WORKERS pages are in flight (still subject to the
+    host's rate limit), and each is parsed on parse_pool as soon as it
+    arrives. A page is only used once the chapter before it has
+    been parsed and its real next link matches the planned URL; at the
+    first mismatch or failed fetch the rest of the plan is dropped and the
+    caller carries on from the last chapter's next link.
+    """
+    workers = max(1, SCRAPE_PREFETCH_WORKERS)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    upcoming = iter(enumerate(urls))
+    pending = deque()
+
+    def top_up():
+        while len(pending) < workers * 2:
+            item = next(upcoming, None)
+            if item is None:
+                return
+            i, url = item
+            pending.append((i, url, pool.submit(_speculative_page, url, parse_pool)))
+
+    try:
+        top_up()
+        while pending:
+            i, url, future = pending.popleft()
+            html, page = future.result()
+            if page is None:
+                # Retried serially, which logs the real error if it persists
+                logger.info(f"Prefetch of {url} failed; continuing serially.")
+                return
+            chap = _chapter_from_page(page, html, url, number + i, novel_dir)
+            yield chap
+            if not chap["next_url"]:
+                logger.warning("No next chapter found. Ending early.")
+                return
+            if i + 1 < len(urls) and not _same_page(chap["next_url"], urls[i + 1]):
+                logger.info(f"Chapter {number + i} links to {chap['next_url']}, not the "
+                            f"predicted {urls[i + 1]}; continuing serially.")
+                metrics.incr("prefetch_mispredicted")
+                return
+            top_up()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def _scrape(start_url, count, start_number, mode, toc_url, novel_dir, pool):
+    """iter_chapters' body, parsing prefetched pages on pool."""
+    scraped = 0
+    last = None
+    planned = []
+    if mode == "pattern" and count > 0:
+        for chap in _serial_chapters(start_url, start_number, 1, novel_dir):
+            scraped, last = scraped + 1, chap
+            metrics.incr("chapters_scraped")
+            yield chap
+        if last is None:
+            return
+        if last["next_url"]:
+            pattern = infer_url_pattern(start_url, last["next_url"])
+            if pattern:
+                planned = [pattern(step) for step in range(1, count)]
+            else:
+                logger.info("Chapter URLs have no sequential number; fetching serially.")
+    elif mode == "toc" and count > 0:
+        if toc_url:
+            planned = toc_chapter_urls(toc_url, TOC_SELECTOR, start_url)[:count]
+        else:
+            logger.warning("TOC prefetch needs a TOC URL (TOC_URL); fetching serially.")
+
+    if planned:
+        for chap in _prefetched_chapters(planned, start_number + scraped, novel_dir, pool):
+            scraped, last = scraped + 1, chap
+            metrics.incr("chapters_scraped")
+            yield chap
+
+    if last is not None and not last["next_url"]:
+        logger.info(f"Scraped {scraped} chapters.")
+        return
+    url = last["next_url"] if last is not None else start_url
+    for chap in _serial_chapters(url, start_number + scraped, count - scraped, novel_dir):
+        scraped += 1
+        metrics.incr("chapters_scraped")
+        yield chap
+
+    logger.info(f"Scraped {scraped} chapters.")
+
+def iter_chapters(start_url, count, novel_title, start_number=1,
+                  prefetch=None, toc_url=None, backend=None, workers=None, pool=None):
+    """
+    Scrape up to `count` chapters, yielding each chapter dict as soon as it
+    has been saved so downstream stages can start on it immediately.
+
+    Chapter dicts carry 'number', 'title', 'filepath' (or 'store' with
+    CHAPTER_STORE=sqlite), plus 'url', 'next_url' (absolute, or None at
+    the end) and 'text_hash' (SHA-256 of the saved text). start_number numbers the first chapter when resuming.
+    Text is run through cleaner.clean_chapter before it is saved.
+
+    With prefetch "toc" (chapter links matched by TOC_SELECTOR on the page
+    at toc_url) or "pattern" (the URL numbering inferred from the first
+    chapter and its next link), upcoming chapters are fetched concurrently;
+    every page is still checked against the previous page's real next link
+    before it is used. prefetch defaults to SCRAPE_PREFETCH, toc_url to TOC_URL.
+
+    Pages followed one at a time are parsed inline. Prefetched pages are
+    fetched on threads and parsed on `pool` if given (e.g. the run's encode
+    pool, so parsing and encoding share one set of workers), otherwise on
+    a pool of the execution backend (`backend`, `workers`; defaults
+    EXEC_BACKEND, EXEC_WORKERS) created only when prefetching. Chapters
+    are still yielded in order.
+    """
+    mode = (prefetch or SCRAPE_PREFETCH).lower()
+    if mode not in PREFETCH_MODES:
+        raise ValueError(f"Unknown prefetch mode '{mode}' (use {', '.join(PREFETCH_MODES)})")
+    toc_url = toc_url or TOC_URL
+    novel_dir = Path("output") / novel_title.replace(" ", "_")
+    novel_dir.mkdir(parents=True, exist_ok=True)
 
-        current_url = next_url
-        sleep(1)  # be kind to the server
+    if pool is not None or mode == "off":
+        yield from _scrape(start_url, count, start_number, mode, toc_url, novel_dir, pool)
+        return
+    with executor.make_pool(backend, workers) as own_pool:
+        yield from _scrape(start_url, count, start_number, mode, toc_url, novel_dir, own_pool)
 
-    logger.info(f"Scraped {len(chapters)} chapters.")
-    return chapters
+def scrape_chapters(start_url, count, novel_title, start_number=1,
+                    prefetch=None, toc_url=None, backend=None, workers=None, pool=None):
+    return list(iter_chapters(start_url, count, novel_title, start_number,
+                              prefetch, toc_url, backend, workers, pool))
 
 
 
@@ -1,68 +1,253 @@
 import os
 import asyncio
-from time import sleep
+import shutil
 from pathlib import Path
-from dotenv import load_dotenv
-from edge_tts import Communicate
+from typing import Callable, Optional
 
+from echopage import cache, chapter_store, config, metrics
 from echopage.logger import setup_logger
+from echopage.ratelimit import THROTTLE_STATUSES, TokenBucket, limiter_for, retry_after_seconds
+from echopage.tts_engines import TTSEngine, get_engine, part_path
+from echopage.utils import chunk_text, timed
 
 # Load .env variables
-load_dotenv()
+config.load()
 logger = setup_logger()
 
-# TTS settings (override in .env if desired)
-VOICE = os.getenv("TTS_VOICE", "en-GB-SoniaNeural")
-RATE  = os.getenv("TTS_RATE", "1.0")
-VOLUME = os.getenv("TTS_VOLUME", "0%")
+# Throughput settings: chapters synthesized at once, and request starts per second
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", 4))
+TTS_REQUESTS_PER_SEC = float(os.getenv("TTS_REQUESTS_PER_SEC", 2))
 
-async def _synthesize(text: str, output_path: str):
-    """Asynchronous helper to run edge-tts synthesis."""
-    communicate = Communicate(text, voice=VOICE, rate=RATE, volume=VOLUME)
-    await communicate.save(output_path)
+# Chunked mode: chapters longer than TTS_CHUNK_CHARS are split at sentence
+# boundaries and the pieces synthesized concurrently
+TTS_CHUNKED = os.getenv("TTS_CHUNKED", "0").lower() in ("1", "true", "yes")
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", 4500))
 
-def generate_audio(chapters: list, novel_title: str) -> list:
+# Log a chapter's synthesis progress each time this many more bytes arrive
+TTS_PROGRESS_BYTES = int(os.getenv("TTS_PROGRESS_BYTES", 1 << 20))
+
+# Key of the TTS endpoint's bucket in ratelimit's per-host registry
+TTS_ENDPOINT = "speech.platform.bing.com"
+
+
+def tts_limiter(requests_per_sec: float = None) -> TokenBucket:
+    """The process-wide TTS request bucket, at requests_per_sec (default TTS_REQUESTS_PER_SEC)."""
+    if requests_per_sec is None:
+        requests_per_sec = TTS_REQUESTS_PER_SEC
+    return limiter_for(TTS_ENDPOINT, rate=requests_per_sec, burst=1)
+
+
+async def _synthesize(text: str, output_path: str, engine: TTSEngine,
+                      on_chunk: Callable[[int], None] = None):
+    """Stream engine's audio for text to output_path (see TTSEngine.synthesize)."""
+    await engine.synthesize(text, output_path, on_chunk)
+
+def audio_path_for(chap: dict, audio_dir: Path) -> Path:
+    """Deterministic MP3 path for a chapter dict inside audio_dir."""
+    num = chap["number"]
+    title = chap["title"]
+    return audio_dir / f"{num:03d}_{title.replace(' ', '_').replace('/', '-')}.mp3"
+
+async def _limited_synthesize(text: str, output_path: str,
+                              semaphore: asyncio.Semaphore,
+                              limiter: TokenBucket, engine: TTSEngine,
+                              on_chunk: Callable[[int], None] = None):
+    """
+    Run one synthesis under the shared concurrency limit, and, for remote
+    engines, the shared request rate limit.
+    """
+    async with semaphore:
+        if not engine.remote:
+            metrics.incr("tts_local_requests")
+            await _synthesize(text, output_path, engine, on_chunk)
+            return
+        await limiter.acquire_async()
+        metrics.incr("tts_requests")
+        try:
+            await _synthesize(text, output_path, engine, on_chunk)
+        except Exception as e:
+            # aiohttp handshake errors carry the HTTP status and headers
+            if getattr(e, "status", None) in THROTTLE_STATUSES:
+                headers = getattr(e, "headers", None) or {}
+                limiter.on_throttle(retry_after_seconds(headers.get("Retry-After")))
+            raise
+        limiter.on_success()
+
+def _stitch_mp3(parts: list, output_path: Path):
+    """
+    Join MP3 chunk files into one file by appending their frames.
+
+    Every engine emits bare MPEG frames (no ID3/Xing headers) at a fixed
+    bitrate, so byte concatenation yields a gapless, playable stream with no
+    re-encode. Like synthesis, it writes to a .part file and renames it when done.
+    """
+    tmp = part_path(output_path)
+    try:
+        with open(tmp, "wb") as out:
+            for part in parts:
+                with open(part, "rb") as src:
+                    shutil.copyfileobj(src, out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp, output_path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+async def _synthesize_chunked(text: str, out_path: Path,
+                              semaphore: asyncio.Semaphore,
+                              limiter: TokenBucket, max_chars: int,
+                              engine: TTSEngine,
+                              on_chunk: Callable[[int], None] = None):
+    """
+    Synthesize sentence-bounded chunks concurrently, then stitch them in order.
+
+    If any chunk fails the others are cancelled, and awaited, before their
+    part files are removed, so no request keeps writing (or spending quota)
+    for a chapter that has already failed.
+    """
+    chunks = chunk_text(text, max_chars)
+    if len(chunks) <= 1:
+        await _limited_synthesize(text, str(out_path), semaphore, limiter, engine, on_chunk)
+        return
+
+    parts = [out_path.with_name(f"{out_path.stem}.part{i:03d}.mp3")
+             for i in range(len(chunks))]
+    tasks = [asyncio.ensure_future(_limited_synthesize(chunk, str(part), semaphore,
+                                                       limiter, engine, on_chunk))
+             for chunk, part in zip(chunks, parts)]
+    try:
+        await asyncio.gather(*tasks)
+        _stitch_mp3(parts, out_path)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for part in parts:
+            part.unlink(missing_ok=True)
+
+@timed(name="synthesize")
+async def synthesize_chapter(chap: dict, audio_dir: Path,
+                              semaphore: asyncio.Semaphore,
+                              limiter: TokenBucket,
+                              chunked: bool = False,
+                              max_chars: int = TTS_CHUNK_CHARS,
+                              use_cache: bool = False,
+                              progress: Callable[[int, int], None] = None,
+                              engine: str = None) -> Optional[str]:
     """
-    Convert each chapter text file into an MP3 using edge-tts.
+    Synthesize one chapter, optionally as concurrent sentence chunks.
+
+    engine names the TTS engine to use (defaults to TTS_ENGINE).
+
+    progress, if given, is called as progress(chapter number, bytes so far)
+    after every audio chunk; by default progress is logged at debug level
+    every TTS_PROGRESS_BYTES.
+    """
+    num = chap["number"]
+    title = chap["title"]
+    out_path = audio_path_for(chap, audio_dir)
+    received = {"bytes": 0, "logged": 0}
+
+    def on_chunk(size: int):
+        received["bytes"] += size
+        if progress:
+            progress(num, received["bytes"])
+        elif received["bytes"] - received["logged"] >= TTS_PROGRESS_BYTES:
+            received["logged"] = received["bytes"]
+            logger.debug(f"Chapter {num}: {received['bytes'] / 2**20:.1f} MiB of audio received")
+
+    try:
+        tts_engine = get_engine(engine)
+        text = chapter_store.load_text(chap)
+        key = cache.cache_key(text, *tts_engine.cache_params()) if use_cache else None
+        if key and cache.fetch(key, out_path):
+            metrics.incr("tts_cache_hits")
+            logger.info(f"Chapter {num}: {title} served from TTS cache")
+            return str(out_path)
+
+        logger.info(f"Synthesizing Chapter {num}: {title}")
+        # Never write through an old hardlink into the cache
+        out_path.unlink(missing_ok=True)
+        if chunked and len(text) > max_chars:
+            await _synthesize_chunked(text, out_path, semaphore, limiter, max_chars,
+                                      tts_engine, on_chunk)
+        else:
+            await _limited_synthesize(text, str(out_path), semaphore, limiter, tts_engine, on_chunk)
+        metrics.incr("tts_bytes", out_path.stat().st_size)
+        if key:
+            cache.store(key, out_path)
+    except Exception as e:
+        logger.error(f"Failed to generate audio for chapter {num}: {e}")
+        # No retries; skip to next chapter
+        return None
+
+    logger.debug(f"Saved audio to {out_path}")
+    return str(out_path)
+
+async def _generate_all(chapters: list, audio_dir: Path,
+                        concurrency: int, requests_per_sec: float,
+                        chunked: bool, max_chars: int, use_cache: bool,
+                        engine: str) -> list:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    limiter = tts_limiter(requests_per_sec)
+    results = await asyncio.gather(*(
+        synthesize_chapter(chap, audio_dir, semaphore, limiter,
+                            chunked, max_chars, use_cache, engine=engine)
+        for chap in chapters
+    ))
+    # gather preserves input order, so output stays in chapter order
+    return [path for path in results if path]
+
+def generate_audio(chapters: list, novel_title: str,
+                   concurrency: int = None, requests_per_sec: float = None,
+                   chunked: bool = None, max_chars: int = None,
+                   use_cache: bool = None, engine: str = None) -> list:
+    """
+    Convert each chapter text file into an MP3 using a TTS engine.
+
+    All chapters are driven from a single event loop; up to `concurrency`
+    syntheses run at once and new requests start at most `requests_per_sec`
+    times per second. The limits apply per engine request, so in chunked
+    mode the pieces of one long chapter share them with every other chapter;
+    local engines are not rate limited.
     
     Args:
-        chapters: List of dicts with keys 'number', 'title', 'filepath'.
+        chapters: List of dicts with keys 'number', 'title' and 'filepath'
+            (or 'store', see chapter_store).
         novel_title: Used to name the audio output directory.
+        concurrency: Max chapters in flight (defaults to TTS_CONCURRENCY).
+        requests_per_sec: Max request starts per second (defaults to
+            TTS_REQUESTS_PER_SEC; 0 disables the limit).
+        chunked: Split long chapters at sentence boundaries and synthesize the
+            pieces concurrently (defaults to TTS_CHUNKED).
+        max_chars: Chunk size limit in characters (defaults to TTS_CHUNK_CHARS).
+        use_cache: Reuse MP3s from the content-addressed TTS cache when the
+            text, voice, rate and volume match (defaults to TTS_CACHE). The
+            cache is not pruned here; commands call cache.prune once at the end.
+        engine: "edge" or "piper" (defaults to TTS_ENGINE), see tts_engines.
     
     Returns:
-        List of file paths to the generated .mp3 files.
+        List of file paths to the generated .mp3 files, in chapter order.
     """
     audio_dir = Path("output") / novel_title.replace(" ", "_") / "audio"
     audio_dir.mkdir(parents=True, exist_ok=True)
-    
-    audio_files = []
-    
-    for chap in chapters:
-        num   = chap["number"]
-        title = chap["title"]
-        txt_path = chap["filepath"]
-        safe_name = f"{num:03d}_{title.replace(' ', '_').replace('/', '-')}.mp3"
-        out_path = audio_dir / safe_name
-        
-        logger.info(f"Synthesizing Chapter {num}: {title}")
-        
-        try:
-            # Read the chapter text
-            text = Path(txt_path).read_text(encoding="utf-8")
-            
-            # Run the async TTS and save to MP3
-            asyncio.run(_synthesize(text, str(out_path)))
-            
-            audio_files.append(str(out_path))
-            logger.debug(f"Saved audio to {out_path}")
-            
-            # be polite to the TTS service
-            sleep(1)
-            
-        except Exception as e:
-            logger.error(f"Failed to generate audio for chapter {num}: {e}")
-            # No retries; skip to next chapter
-        
+
+    if concurrency is None:
+        concurrency = TTS_CONCURRENCY
+    if requests_per_sec is None:
+        requests_per_sec = TTS_REQUESTS_PER_SEC
+    if chunked is None:
+        chunked = TTS_CHUNKED
+    if max_chars is None:
+        max_chars = TTS_CHUNK_CHARS
+    if use_cache is None:
+        use_cache = cache.TTS_CACHE_ENABLED
+
+    audio_files = asyncio.run(_generate_all(
+        chapters, audio_dir, concurrency, requests_per_sec,
+        chunked, max_chars, use_cache, engine
+    ))
+
     logger.info(f"Generated audio for {len(audio_files)}/{len(chapters)} chapters.")
     return audio_files
 
@@ -0,0 +1,296 @@
+# echopage/tts_engines.py
+"""
+Text-to-speech engines.
+
+An engine turns text into MP3 audio. tts.py drives every engine the same
+way: it asks for the text's batches (the units one model invocation or
+request covers), streams the audio to disk through synthesize(), and
+applies the shared TTS rate limit only to remote engines.
+
+- "edge" (EdgeEngine): Microsoft Edge's online voices via edge-tts.
+- "piper" (PiperEngine): local, offline Piper voice models. Sentences are
+  grouped into PIPER_BATCH_CHARS batches, each synthesized in one model
+  call on a process pool (PIPER_WORKERS wide) while earlier batches are
+  already being encoded, so long chapters use every core and no network.
+
+Both produce bare-frame 24 kHz mono MP3, so chunked synthesis can stitch
+pieces by concatenation and books can mix engines.
+
+Select one with TTS_ENGINE (default "edge"), or --engine on the CLI.
+"""
+import asyncio
+import atexit
+import json
+import os
+from pathlib import Path
+from typing import AsyncIterator, Callable
+
+from echopage import config, executor
+from echopage.logger import setup_logger
+from echopage.utils import chunk_text
+
+config.load()
+logger = setup_logger()
+
+TTS_ENGINE = os.getenv("TTS_ENGINE", "edge").lower()
+
+# edge-tts voice settings
+VOICE = os.getenv("TTS_VOICE", "en-GB-SoniaNeural")
+RATE = os.getenv("TTS_RATE", "1.0")
+VOLUME = os.getenv("TTS_VOLUME", "0%")
+
+# Piper: voice model (.onnx, with its .onnx.json beside it), worker
+# processes, and characters of whole sentences per model call
+PIPER_MODEL = os.getenv("PIPER_MODEL")
+PIPER_WORKERS = int(os.getenv("PIPER_WORKERS", executor.EXEC_WORKERS))
+PIPER_BATCH_CHARS = int(os.getenv("PIPER_BATCH_CHARS", 1000))
+PIPER_LENGTH_SCALE = float(os.getenv("PIPER_LENGTH_SCALE", 1.0))
+
+# The MP3 format edge-tts emits, which local engines match
+MP3_SAMPLE_RATE = 24000
+MP3_BITRATE = "48k"
+
+# edge_tts.Communicate, imported on first use: edge_tts pulls in aiohttp,
+# which is slow to import and not needed by commands that never synthesize
+Communicate = None
+
+
+def part_path(output_path) -> Path:
+    """Temporary name audio is streamed to before it is renamed into place."""
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.name + ".part")
+
+
+class TTSEngine:
+    """
+    Base class for engines.
+
+    Subclasses implement stream() and voices(), and may override batches().
+    """
+
+    name = ""
+    # Requests leave the machine, so they go through the TTS rate limiter
+    remote = True
+
+    def cache_params(self) -> tuple:
+        """(voice, rate, volume) for cache.cache_key; must change whenever the audio would."""
+        raise NotImplementedError
+
+    async def voices(self) -> list:
+        """Names of the voices this engine can speak with."""
+        raise NotImplementedError
+
+    def batches(self, text: str) -> list:
+        """Split text into the pieces one model call (or request) synthesizes."""
+        return [text]
+
+    def stream(self, text: str) -> AsyncIterator[bytes]:
+        """Yield the MP3 audio for text as it is produced."""
+        raise NotImplementedError
+
+    async def synthesize(self, text: str, output_path,
+                         on_chunk: Callable[[int], None] = None) -> None:
+        """
+        Stream the audio for text straight to disk.
+
+        Chunks are written to `<output_path>.part` as they arrive, so memory
+        use does not grow with the chapter. The file is fsynced and renamed
+        over output_path only once the stream has ended; an interrupted run
+        leaves at most a stray .part file, never a truncated MP3 under the
+        final name.
+
+        Args:
+            text: Text to speak.
+            output_path: Where the finished MP3 goes.
+            on_chunk: Called with the size in bytes of each audio chunk written.
+        """
+        part = part_path(output_path)
+        try:
+            with open(part, "wb") as f:
+                async for data in self.stream(text):
+                    f.write(data)
+                    if on_chunk:
+                        on_chunk(len(data))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(part, output_path)
+        finally:
+            part.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        """Release worker processes or connections, if any."""
+
+
+class EdgeEngine(TTSEngine):
+    """Microsoft Edge online voices through edge-tts."""
+
+    name = "edge"
+
+    def __init__(self, voice: str = None, rate: str = None, volume: str = None):
+        self.voice = voice or VOICE
+        self.rate = rate or RATE
+        self.volume = volume or VOLUME
+
+    def cache_params(self) -> tuple:
+        # Same key as before engines existed, so cached audio stays valid
+        return self.voice, self.rate, self.volume
+
+    async def voices(self) -> list:
+        from edge_tts import list_voices
+        return sorted(voice["ShortName"] for voice in await list_voices())
+
+    async def stream(self, text: str):
+        global Communicate
+        if Communicate is None:
+            from edge_tts import Communicate
+        communicate = Communicate(text, voice=self.voice, rate=self.rate, volume=self.volume)
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                yield chunk["data"]
+
+
+_piper_voices = {}  # model path -> loaded PiperVoice, per worker process
+
+def _piper_pcm(model: str, text: str, length_scale: float) -> bytes:
+    """Synthesize one batch to 16-bit mono PCM. Runs in a pool worker."""
+    voice = _piper_voices.get(model)
+    if voice is None:
+        from piper import PiperVoice
+        voice = _piper_voices[model] = PiperVoice.load(model)
+    if hasattr(voice, "synthesize_stream_raw"):
+        # piper-tts 1.2
+        return b"".join(voice.synthesize_stream_raw(text, length_scale=length_scale))
+    from piper import SynthesisConfig
+    syn_config = SynthesisConfig(length_scale=length_scale)
+    return b"".join(chunk.audio_int16_bytes
+                    for chunk in voice.synthesize(text, syn_config=syn_config))
+
+
+class PiperEngine(TTSEngine):
+    """
+    Local Piper voices on a pool of CPU worker processes.
+
+    Each worker loads the voice model once. A chapter's sentence batches
+    are submitted to the pool a few at a time, and their PCM is piped, in
+    order, through one ffmpeg process that encodes it to MP3 as it arrives.
+    """
+
+    name = "piper"
+    remote = False
+
+    def __init__(self, model: str = None, workers: int = None,
+                 batch_chars: int = None, length_scale: float = None):
+        self.model = model or PIPER_MODEL
+        if not self.model:
+            raise ValueError("The piper engine needs a voice model (set PIPER_MODEL)")
+        self.workers = max(1, workers or PIPER_WORKERS)
+        self.batch_chars = batch_chars or PIPER_BATCH_CHARS
+        self.length_scale = PIPER_LENGTH_SCALE if length_scale is None else length_scale
+        self._sample_rate = None
+        self._pool = None
+
+    @property
+    def sample_rate(self) -> int:
+        if self._sample_rate is None:
+            model_config = Path(self.model + ".json")
+            self._sample_rate = json.loads(model_config.read_text(encoding="utf-8"))["audio"]["sample_rate"]
+        return self._sample_rate
+
+    def cache_params(self) -> tuple:
+        return f"piper:{Path(self.model).name}", str(self.length_scale), ""
+
+    async def voices(self) -> list:
+        """Models next to PIPER_MODEL whose .onnx.json config is readable."""
+        names = []
+        for path in Path(self.model).parent.glob("*.onnx"):
+            model_config = path.with_name(path.name + ".json")
+            try:
+                json.loads(model_config.read_text(encoding="utf-8"))["audio"]["sample_rate"]
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Skipping Piper voice {path.name}: bad or missing "
+                               f"{model_config.name} ({e})")
+                continue
+            names.append(path.stem)
+        return sorted(names)
+
+    def batches(self, text: str) -> list:
+        return chunk_text(text, self.batch_chars)
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = executor.make_pool("processes", self.workers)
+        return self._pool
+
+    async def stream(self, text: str):
+        pool = self._get_pool()
+        ffmpeg = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-loglevel", "error",
+            "-f", "s16le", "-ar", str(self.sample_rate), "-ac", "1", "-i", "pipe:0",
+            "-ar", str(MP3_SAMPLE_RATE), "-ac", "1", "-b:a", MP3_BITRATE,
+            # Bare frames, like edge-tts, so chunks can be stitched by concatenation
+            "-write_xing", "0", "-id3v2_version", "0", "-f", "mp3", "pipe:1",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+
+        async def feed():
+            batches = iter(self.batches(text))
+            in_flight = []
+            try:
+                while True:
+                    # Keep every worker busy without queuing the whole chapter's PCM
+                    while len(in_flight) < self.workers:
+                        batch = next(batches, None)
+                        if batch is None:
+                            break
+                        in_flight.append(asyncio.wrap_future(executor.submit(
+                            pool, _piper_pcm, self.model, batch, self.length_scale)))
+                    if not in_flight:
+                        break
+                    ffmpeg.stdin.write(await in_flight.pop(0))
+                    await ffmpeg.stdin.drain()
+            finally:
+                for future in in_flight:
+                    future.cancel()
+                ffmpeg.stdin.close()
+
+        feeder = asyncio.create_task(feed())
+        try:
+            while True:
+                data = await ffmpeg.stdout.read(1 << 16)
+                if not data:
+                    break
+                yield data
+            await feeder
+            if await ffmpeg.wait():
+                raise RuntimeError(f"ffmpeg exited with status {ffmpeg.returncode}")
+        finally:
+            if not feeder.done():
+                feeder.cancel()
+            if ffmpeg.returncode is None:
+                ffmpeg.kill()
+                await ffmpeg.wait()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+ENGINES = {"edge": EdgeEngine, "piper": PiperEngine}
+
+_engines = {}
+
+def get_engine(name: str = None) -> TTSEngine:
+    """
+    The process-wide engine of that name (default TTS_ENGINE), created on first use.
+
+    Raises:
+        ValueError: for an unknown engine or one that isn't configured.
+    """
+    name = (name or TTS_ENGINE).lower()
+    engine = _engines.get(name)
+    if engine is None:
+        if name not in ENGINES:
+            raise ValueError(f"Unknown TTS engine '{name}' (use {', '.join(ENGINES)})")
+        engine = _engines[name] = ENGINES[name]()
+        atexit.register(engine.close)
+    return engine
@@ -1,13 +1,18 @@
 # echopage/utils.py
 
+import functools
+import inspect
+import logging
 import os
 import re
 import time
+from bisect import bisect_right
 from pathlib import Path
 from typing import List, Callable, Any, Dict
-from dotenv import load_dotenv
 
-load_dotenv()
+from echopage import config, metrics
+
+config.load()
 
 def ensure_dir(path: Path) -> None:
     """
@@ -29,25 +34,55 @@ def sanitize_filename(name: str, max_length: int = 100) -> str:
     return name[:max_length]
 
 
+def chapter_filename(title: str, number: int, suffix: str = ".txt") -> str:
+    """File name for a chapter's text, e.g. 007_The_Storm.txt."""
+    return sanitize_filename(f"{number:03d}_{title.replace(' ', '_').replace('/', '-')}") + suffix
+
+
+# A sentence ends at . ? ! or … plus any closing quotes or brackets (as in
+# dialogue: `."`, `?'`, `!)`), followed by whitespace; a line break ends one too
+_SENTENCE_BREAK = re.compile(r'[.?!\u2026]+["\'\u201d\u2019\u00bb)\]]*(?P<gap>\s+)|(?P<line>[ \t]*\n\s*)')
+
+
 def chunk_text(text: str, max_chars: int = 4500) -> List[str]:
     """
-    Split a long text into chunks no longer than max_chars, breaking on sentence boundaries.
-    Helps avoid TTS service limits on input size.
+    Split a long text into chunks no longer than max_chars, breaking on sentence boundaries
+    (after closing quotes or brackets, and at line breaks). Helps avoid TTS service limits
+    on input size.
+
+    Chunks are sliced straight out of the input (no per-sentence lists or
+    re-joining), so this stays linear on very large texts. A single sentence
+    longer than max_chars is split at the last space that fits, or hard-cut
+    if there is none.
     """
-    sentences = re.split(r'(?<=[.?!])\s+', text)
+    text = text.strip()
+    if not text:
+        return []
+
+    # Each sentence break is the whitespace after a sentence's end, or a line break
+    cuts: List[int] = []     # where the previous chunk would end
+    resumes: List[int] = []  # where the next chunk would start
+    for match in _SENTENCE_BREAK.finditer(text):
+        cuts.append(match.start("gap") if match.group("gap") else match.start("line"))
+        resumes.append(match.end())
+
     chunks: List[str] = []
-    current: List[str] = []
-    length = 0
-
-    for sent in sentences:
-        if length + len(sent) + 1 > max_chars:
-            chunks.append(" ".join(current))
-            current, length = [], 0
-        current.append(sent)
-        length += len(sent) + 1
-
-    if current:
-        chunks.append(" ".join(current))
+    start = 0
+    while len(text) - start > max_chars:
+        limit = start + max_chars
+        i = bisect_right(cuts, limit) - 1
+        if i >= 0 and cuts[i] > start:
+            end, next_start = cuts[i], resumes[i]
+        else:
+            space = text.rfind(" ", start + 1, limit + 1)
+            end = space if space > start else limit
+            next_start = end
+            while next_start < len(text) and text[next_start].isspace():
+                next_start += 1
+        chunks.append(text[start:end])
+        start = next_start
+
+    chunks.append(text[start:])
     return chunks
 
 
@@ -62,18 +97,47 @@ def load_env_vars(required: List[str]) -> Dict[str, str]:
     return {var: os.getenv(var) for var in required}
 
 
-def timed(fn: Callable) -> Callable:
+def timed(fn: Callable = None, *, name: str = None) -> Callable:
     """
     Decorator to measure and log execution time of functions.
+
+    Durations come from time.perf_counter, are logged at debug level and
+    recorded in the run's metrics under `name` (default: the function's
+    name). Works on plain and async functions.
     Usage:
         @timed
         def my_func(...):
             ...
+
+        @timed(name="synthesize")
+        async def my_coro(...):
+            ...
     """
+    if fn is None:
+        return lambda f: timed(f, name=name)
+
+    label = name or fn.__name__
+
+    def record(start: float) -> None:
+        elapsed = time.perf_counter() - start
+        metrics.observe(label, elapsed)
+        logging.getLogger("echopage").debug(f"[TIMING] {label} took {elapsed:.3f}s")
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                record(start)
+        return async_wrapper
+
+    @functools.wraps(fn)
     def wrapper(*args: Any, **kwargs: Any) -> Any:
-        start = time.time()
-        result = fn(*args, **kwargs)
-        end = time.time()
-        print(f"[TIMING] {fn.__name__} took {end - start:.2f}s")
-        return result
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            record(start)
     return wrapper
@@ -0,0 +1,332 @@
+# echopage/work_queue.py
+"""
+Durable work queue for spreading books over several machines.
+
+A title is enqueued as one "scrape" task. Scraping publishes a "tts" task
+per chapter, each finished TTS task publishes that chapter's "encode"
+task, and once none of a title's tasks is pending or leased any more a
+single "compile" task is published for it. Any number of worker
+processes (see worker.py), on any number of hosts, claim tasks from the
+queue:
+
+- A claim is a lease of LEASE_SECONDS that the worker renews with
+  heartbeats while the task runs. A task whose lease runs out (its worker
+  died or lost the shared disk) goes back to any worker that asks.
+- A failed task is retried after a short backoff, up to MAX_ATTEMPTS
+  claims in all; after that it is marked failed and its chapter is left
+  out of the book.
+- Completing a task and publishing its follow-ups is one transaction, and
+  only the current lease holder can complete it, so a worker that lost its
+  lease can't overwrite the result of the worker that took over.
+
+The "sqlite" backend keeps the queue in one SQLite file (WORK_QUEUE_PATH)
+that every worker opens, e.g. on an NFS or SMB share mounted at the same
+path on each node, next to the shared output/ folder. It uses SQLite's
+rollback journal and file locks, not WAL, since WAL needs shared memory
+that network filesystems don't provide. Leases are compared against
+wall-clock time, so nodes need synchronized clocks (NTP).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from echopage import config
+from echopage.logger import setup_logger
+
+config.load()
+logger = setup_logger()
+
+QUEUE_BACKENDS = ("sqlite",)
+WORK_QUEUE = os.getenv("WORK_QUEUE", "sqlite").lower()
+WORK_QUEUE_PATH = os.getenv("WORK_QUEUE_PATH", "output/work_queue.sqlite")
+
+LEASE_SECONDS = float(os.getenv("LEASE_SECONDS", 120))
+MAX_ATTEMPTS = int(os.getenv("MAX_ATTEMPTS", 3))
+# Longest a worker waits for another node's write lock before giving up
+QUEUE_BUSY_TIMEOUT = float(os.getenv("QUEUE_BUSY_TIMEOUT", 60))
+
+# Task kinds, in pipeline order. Claims prefer later stages, so chapters
+# already under way are finished before new ones are started.
+SCRAPE = "scrape"
+TTS = "tts"
+ENCODE = "encode"
+COMPILE = "compile"
+KINDS = (SCRAPE, TTS, ENCODE, COMPILE)
+
+# Task states
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id            INTEGER PRIMARY KEY,
+    title         TEXT NOT NULL,
+    kind          TEXT NOT NULL,
+    number        INTEGER NOT NULL,
+    priority      INTEGER NOT NULL,
+    payload       TEXT NOT NULL,
+    status        TEXT NOT NULL,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    owner         TEXT,
+    lease_expires REAL,
+    available_at  REAL NOT NULL,
+    result        TEXT,
+    error         TEXT,
+    updated_at    REAL NOT NULL,
+    UNIQUE (title, kind, number)
+);
+CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (status, priority, number);
+"""
+
+
+def _retry_delay(attempts: int) -> float:
+    """Seconds before a failed task may be claimed again."""
+    return min(60.0, 2.0 ** attempts)
+
+
+class WorkQueue:
+    """
+    Interface of a queue backend.
+
+    Tasks are dicts with 'id', 'title', 'kind', 'number' (chapter number,
+    0 for per-title tasks), 'payload' and 'attempts'. Follow-up tasks are
+    given as (kind, number, payload) tuples.
+    """
+
+    lease_seconds = LEASE_SECONDS
+
+    def enqueue_title(self, title: str, payload: dict) -> None:
+        """Publish a title's scrape task, forgetting any earlier finished run of it."""
+        raise NotImplementedError
+
+    def publish(self, title: str, tasks: list) -> None:
+        """Publish tasks for a title; ones that already exist are left as they are."""
+        raise NotImplementedError
+
+    def claim(self, owner: str, kinds: tuple = None) -> dict:
+        """Lease the next available task to owner, or return None if there is none."""
+        raise NotImplementedError
+
+    def heartbeat(self, task_id: int, owner: str) -> bool:
+        """Extend owner's lease on a task; False if the lease was lost."""
+        raise NotImplementedError
+
+    def complete(self, task_id: int, owner: str, result: dict = None,
+                 follow_ups: list = ()) -> bool:
+        """Mark a leased task done and publish its follow-ups; False if the lease was lost."""
+        raise NotImplementedError
+
+    def fail(self, task_id: int, owner: str, error: str) -> None:
+        """Give a leased task back for a retry, or fail it after MAX_ATTEMPTS."""
+        raise NotImplementedError
+
+    def results(self, title: str, kind: str) -> list:
+        """(number, result) of a title's finished tasks of one kind, in chapter order."""
+        raise NotImplementedError
+
+    def counts(self, title: str = None) -> dict:
+        """{title: {kind: {status: n}}} for one title or every title."""
+        raise NotImplementedError
+
+    def active(self) -> int:
+        """Number of tasks still pending or leased."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release the backend's connection."""
+
+
+class SQLiteQueue(WorkQueue):
+    """
+    Work queue in a SQLite file on shared storage.
+
+    Every state change runs in a BEGIN IMMEDIATE transaction, so claims
+    from different nodes are serialized by SQLite's file lock and no task
+    is ever leased twice. Within a process, the connection is shared by
+    worker threads and heartbeats under a lock.
+    """
+
+    def __init__(self, path=None, lease_seconds: float = None, max_attempts: int = None):
+        self.path = Path(path or WORK_QUEUE_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease_seconds = lease_seconds or LEASE_SECONDS
+        self.max_attempts = max_attempts or MAX_ATTEMPTS
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=QUEUE_BUSY_TIMEOUT,
+                                   isolation_level=None, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+    def _write(self, fn, *args):
+        """Run fn(*args) inside one write transaction."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(*args)
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            return result
+
+    def _insert(self, title: str, tasks: list, now: float) -> None:
+        self._db.executemany(
+            "INSERT OR IGNORE INTO tasks (title, kind, number, priority, payload, status,"
+            " available_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(title, kind, number, KINDS.index(kind), json.dumps(payload), PENDING, now, now)
+             for kind, number, payload in tasks])
+
+    def _finish_title(self, title: str, now: float) -> None:
+        """Publish the title's compile task once nothing else of it is left to run."""
+        unfinished = self._db.execute(
+            "SELECT COUNT(*) FROM tasks WHERE title = ? AND kind != ? AND status IN (?, ?)",
+            (title, COMPILE, PENDING, LEASED)).fetchone()[0]
+        if unfinished:
+            return
+        row = self._db.execute("SELECT payload FROM tasks WHERE title = ? AND kind = ?",
+                               (title, SCRAPE)).fetchone()
+        self._insert(title, [(COMPILE, 0, json.loads(row[0]) if row else {})], now)
+
+    def enqueue_title(self, title: str, payload: dict) -> None:
+        def enqueue():
+            active = self._db.execute(
+                "SELECT COUNT(*) FROM tasks WHERE title = ? AND status IN (?, ?)",
+                (title, PENDING, LEASED)).fetchone()[0]
+            if active:
+                raise ValueError(f"'{title}' is already queued ({active} tasks unfinished)")
+            self._db.execute("DELETE FROM tasks WHERE title = ?", (title,))
+            self._insert(title, [(SCRAPE, 0, payload)], time.time())
+        self._write(enqueue)
+
+    def publish(self, title: str, tasks: list) -> None:
+        if tasks:
+            self._write(self._insert, title, tasks, time.time())
+
+    def claim(self, owner: str, kinds: tuple = None) -> dict:
+        def claim():
+            now = time.time()
+            # Leases that ran out on their last attempt end the task
+            expired = self._db.execute(
+                "SELECT id, title FROM tasks WHERE status = ? AND lease_expires < ?"
+                " AND attempts >= ?", (LEASED, now, self.max_attempts)).fetchall()
+            for task_id, title in expired:
+                self._db.execute(
+                    "UPDATE tasks SET status = ?, owner = NULL, error = ?, updated_at = ?"
+                    " WHERE id = ?", (FAILED, "lease expired", now, task_id))
+                logger.warning(f"Task {task_id} of '{title}' failed: lease expired "
+                               f"{self.max_attempts} times")
+            for title in {title for _, title in expired}:
+                self._finish_title(title, now)
+
+            query = ("SELECT id, title, kind, number, payload, attempts FROM tasks"
+                     " WHERE ((status = ? AND available_at <= ?)"
+                     " OR (status = ? AND lease_expires < ?))")
+            params = [PENDING, now, LEASED, now]
+            if kinds:
+                query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+                params += list(kinds)
+            query += " ORDER BY priority DESC, number, id LIMIT 1"
+            row = self._db.execute(query, params).fetchone()
+            if row is None:
+                return None
+            task_id, title, kind, number, payload, attempts = row
+            self._db.execute(
+                "UPDATE tasks SET status = ?, owner = ?, lease_expires = ?,"
+                " attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (LEASED, owner, now + self.lease_seconds, now, task_id))
+            return {"id": task_id, "title": title, "kind": kind, "number": number,
+                    "payload": json.loads(payload), "attempts": attempts + 1}
+        return self._write(claim)
+
+    def heartbeat(self, task_id: int, owner: str) -> bool:
+        def heartbeat():
+            now = time.time()
+            return self._db.execute(
+                "UPDATE tasks SET lease_expires = ?, updated_at = ?"
+                " WHERE id = ? AND owner = ? AND status = ?",
+                (now + self.lease_seconds, now, task_id, owner, LEASED)).rowcount == 1
+        return self._write(heartbeat)
+
+    def complete(self, task_id: int, owner: str, result: dict = None,
+                 follow_ups: list = ()) -> bool:
+        def complete():
+            now = time.time()
+            row = self._db.execute("SELECT title FROM tasks WHERE id = ? AND owner = ?"
+                                   " AND status = ?", (task_id, owner, LEASED)).fetchone()
+            if row is None:
+                return False
+            self._db.execute(
+                "UPDATE tasks SET status = ?, owner = NULL, lease_expires = NULL,"
+                " result = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (DONE, json.dumps(result), now, task_id))
+            self._insert(row[0], list(follow_ups), now)
+            self._finish_title(row[0], now)
+            return True
+        return self._write(complete)
+
+    def fail(self, task_id: int, owner: str, error: str) -> None:
+        def fail():
+            now = time.time()
+            row = self._db.execute("SELECT title, attempts FROM tasks WHERE id = ? AND owner = ?"
+                                   " AND status = ?", (task_id, owner, LEASED)).fetchone()
+            if row is None:
+                return
+            title, attempts = row
+            status = FAILED if attempts >= self.max_attempts else PENDING
+            self._db.execute(
+                "UPDATE tasks SET status = ?, owner = NULL, lease_expires = NULL,"
+                " available_at = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, now + _retry_delay(attempts), error, now, task_id))
+            if status == FAILED:
+                self._finish_title(title, now)
+        self._write(fail)
+
+    def results(self, title: str, kind: str) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT number, result FROM tasks WHERE title = ? AND kind = ? AND status = ?"
+                " ORDER BY number", (title, kind, DONE)).fetchall()
+        return [(number, json.loads(result) if result else None) for number, result in rows]
+
+    def counts(self, title: str = None) -> dict:
+        query = "SELECT title, kind, status, COUNT(*) FROM tasks"
+        params = ()
+        if title:
+            query += " WHERE title = ?"
+            params = (title,)
+        with self._lock:
+            rows = self._db.execute(query + " GROUP BY title, kind, status", params).fetchall()
+        summary = {}
+        for row_title, kind, status, n in rows:
+            summary.setdefault(row_title, {}).setdefault(kind, {})[status] = n
+        return summary
+
+    def active(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tasks WHERE status IN (?, ?)",
+                                    (PENDING, LEASED)).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def open_queue(backend: str = None, path=None) -> WorkQueue:
+    """
+    Open the work queue.
+
+    Args:
+        backend: Queue backend (defaults to WORK_QUEUE; only "sqlite" so far).
+        path: Queue file (defaults to WORK_QUEUE_PATH).
+
+    Raises:
+        ValueError: for an unknown backend.
+    """
+    backend = (backend or WORK_QUEUE).lower()
+    if backend == "sqlite":
+        return SQLiteQueue(path)
+    raise ValueError(f"Unknown work queue backend '{backend}' (use {', '.join(QUEUE_BACKENDS)})")
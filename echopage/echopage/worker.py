@@ -0,0 +1,296 @@
+# echopage/worker.py
+"""
+Queue workers: run scrape, TTS, encode and compile tasks from the shared
+work queue (see work_queue.py), on as many processes and hosts as needed.
+
+Every worker runs from the same shared directory, so output/<title>/ and
+the queue file are seen by all of them. Scrape and compile tasks are the
+only ones that write a title's manifest, and the queue never runs two of
+them for one title at a time, so the journal keeps a single writer; TTS
+and encode tasks report their results through the queue instead.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+
+from echopage import config, metrics
+from echopage import work_queue
+from echopage.logger import setup_logger
+from echopage.work_queue import COMPILE, ENCODE, SCRAPE, TTS, WorkQueue
+
+config.load()
+logger = setup_logger()
+
+# Tasks one worker process runs at once (one thread each), and how long
+# an idle worker waits before asking the queue again
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 1))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", 5))
+
+
+class LeaseLost(Exception):
+    """The task's lease expired and another worker may have taken it over."""
+
+
+class _Heartbeat:
+    """Renew a task's lease in the background while the task runs."""
+
+    def __init__(self, queue: WorkQueue, task: dict, owner: str, interval: float):
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, args=(queue, task, owner, interval),
+                                        name=f"heartbeat-{task['id']}", daemon=True)
+
+    def _beat(self, queue, task, owner, interval):
+        while not self._stop.wait(interval):
+            try:
+                alive = queue.heartbeat(task["id"], owner)
+            except Exception as e:
+                # A busy or briefly unreachable share; the lease outlives a few misses
+                logger.warning(f"Heartbeat for task {task['id']} failed: {e}")
+                continue
+            if not alive:
+                logger.warning(f"Lost the lease on {task['kind']} task {task['id']} "
+                               f"of '{task['title']}'")
+                self.lost.set()
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _chapter_task(chap: dict, options: dict) -> tuple:
+    """A chapter's TTS task, as a (kind, number, payload) follow-up."""
+    payload = {
+        "chapter": {
+            "number": chap["number"],
+            "title": chap["title"],
+            "filepath": str(chap["filepath"]) if chap.get("filepath") else None,
+            "store": str(chap["store"]) if chap.get("store") else None,
+        },
+        **options,
+    }
+    return TTS, chap["number"], payload
+
+
+def _run_scrape(task: dict, queue: WorkQueue, lease: _Heartbeat) -> tuple:
+    """
+    Scrape a title, publishing each chapter's TTS task as soon as the
+    chapter is saved so other workers can start on it.
+
+    A retried scrape (after a crash or a lost lease) resumes from the manifest.
+    """
+    from echopage import pipeline
+    from echopage.manifest import SCRAPED, SYNTHESIZED
+    from echopage.scraper import iter_chapters
+
+    title = task["title"]
+    payload = task["payload"]
+    options = {key: payload.get(key) for key in ("engine", "chunked", "use_cache", "formats")}
+    count = int(payload["count"])
+    resume = payload.get("resume", False) or task["attempts"] > 1
+    manifest, plan = pipeline.plan_run(title, payload["url"], count, resume)
+    _, _, scrape_url, start_number = plan
+
+    if scrape_url and count >= start_number:
+        for chap in iter_chapters(scrape_url, count - start_number + 1, title, start_number,
+                                  payload.get("prefetch"), payload.get("toc_url")):
+            if lease.lost.is_set():
+                # Another worker owns this scrape now; stop writing the manifest
+                raise LeaseLost(f"Lease on scraping '{title}' expired")
+            manifest.record_scraped(chap)
+            queue.publish(title, [_chapter_task(chap, options)])
+
+    # Chapters scraped by an earlier attempt or run; publishing is idempotent
+    follow_ups = [_chapter_task(manifest.chapter_dict(number), options)
+                  for number in sorted(manifest.chapters)
+                  if number <= count and manifest.is_done(number, SCRAPED)
+                  and not manifest.is_done(number, SYNTHESIZED)]
+    return {"chapters": manifest.last_number()}, follow_ups
+
+
+def _run_tts(task: dict, queue: WorkQueue, lease: _Heartbeat) -> tuple:
+    """Synthesize one chapter and publish its encode task."""
+    from echopage import tts
+
+    payload = task["payload"]
+    paths = tts.generate_audio([payload["chapter"]], task["title"], concurrency=1,
+                               chunked=payload.get("chunked"),
+                               use_cache=payload.get("use_cache"),
+                               engine=payload.get("engine"))
+    if not paths:
+        raise RuntimeError(f"No audio for chapter {task['number']}")
+    encode = {"mp3_path": paths[0], "formats": payload.get("formats")}
+    return {"mp3_path": paths[0]}, [(ENCODE, task["number"], encode)]
+
+
+def _run_encode(task: dict, queue: WorkQueue, lease: _Heartbeat) -> tuple:
+    """Encode one chapter's segments for the final compile."""
+    from echopage import audio
+
+    payload = task["payload"]
+    segment = audio.encode_chapter(payload["mp3_path"], payload.get("formats"))
+    return {"segment": segment}, []
+
+
+def _run_compile(task: dict, queue: WorkQueue, lease: _Heartbeat) -> tuple:
+    """
+    Record every synthesized chapter in the manifest, compile the book from
+    the segments the encode tasks made, and upload it. The TTS cache is
+    pruned here, once per title, rather than after each chapter's TTS task.
+    """
+    from echopage import cache, pipeline
+    from echopage.manifest import Manifest
+
+    title = task["title"]
+    payload = task["payload"]
+    manifest = Manifest.load(title)
+    for number, result in queue.results(title, TTS):
+        if number in manifest.chapters:
+            manifest.record_synthesized(number, result["mp3_path"])
+    output = pipeline.compile_only(title, payload.get("author"), payload.get("cover"),
+                                   formats=payload.get("formats"))
+    use_cache = payload.get("use_cache")
+    if cache.TTS_CACHE_ENABLED if use_cache is None else use_cache:
+        cache.prune()
+    if payload.get("upload", True):
+        from echopage.drive_upload import upload_outputs
+        upload_outputs(title)
+    return {"output": output}, []
+
+
+HANDLERS = {SCRAPE: _run_scrape, TTS: _run_tts, ENCODE: _run_encode, COMPILE: _run_compile}
+
+
+def run_task(queue: WorkQueue, task: dict, owner: str) -> bool:
+    """
+    Run one claimed task under a heartbeat and report the outcome.
+
+    Returns:
+        True if the task completed and its result was accepted.
+    """
+    label = f"{task['kind']} task {task['id']} of '{task['title']}'"
+    if task["number"]:
+        label += f" (chapter {task['number']})"
+    logger.info(f"Running {label}, attempt {task['attempts']}")
+    with _Heartbeat(queue, task, owner, queue.lease_seconds / 3) as lease:
+        try:
+            with metrics.timer(f"task_{task['kind']}"):
+                result, follow_ups = HANDLERS[task["kind"]](task, queue, lease)
+        except Exception as e:
+            logger.error(f"{label} failed: {e}")
+            metrics.incr("tasks_failed")
+            queue.fail(task["id"], owner, str(e))
+            return False
+    if not queue.complete(task["id"], owner, result, follow_ups):
+        logger.warning(f"{label} finished after its lease expired; result discarded")
+        return False
+    metrics.incr("tasks_done")
+    return True
+
+
+def _work(queue: WorkQueue, owner: str, kinds: tuple, exit_when_idle: bool,
+          poll: float, stop: threading.Event) -> int:
+    done = 0
+    while not stop.is_set():
+        try:
+            task = queue.claim(owner, kinds)
+        except Exception as e:
+            # e.g. another node held the write lock past QUEUE_BUSY_TIMEOUT
+            logger.warning(f"Could not claim a task: {e}")
+            stop.wait(poll)
+            continue
+        if task is None:
+            if exit_when_idle and not queue.active():
+                return done
+            stop.wait(poll)
+            continue
+        done += run_task(queue, task, owner)
+    return done
+
+
+def run_worker(kinds: tuple = None, concurrency: int = None, exit_when_idle: bool = False,
+               queue: WorkQueue = None, poll: float = None) -> int:
+    """
+    Claim and run tasks until interrupted.
+
+    Args:
+        kinds: Task kinds this worker takes, e.g. ("tts",) on a node that
+            only synthesizes (defaults to all of them).
+        concurrency: Tasks run at once, one thread each (defaults to
+            WORKER_CONCURRENCY).
+        exit_when_idle: Return once no task is pending or leased anywhere.
+        queue: Queue to work from (defaults to work_queue.open_queue()).
+        poll: Seconds between claims while idle (defaults to WORKER_POLL_SECONDS).
+
+    Returns:
+        Number of tasks completed.
+    """
+    queue = queue or work_queue.open_queue()
+    concurrency = max(1, concurrency or WORKER_CONCURRENCY)
+    poll = WORKER_POLL_SECONDS if poll is None else poll
+    node = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    stop = threading.Event()
+    logger.info(f"Worker {node} started with {concurrency} slots "
+                f"for {', '.join(kinds or work_queue.KINDS)} tasks")
+
+    totals = [0] * concurrency
+
+    def slot(i):
+        totals[i] = _work(queue, f"{node}/{i}", kinds, exit_when_idle, poll, stop)
+
+    threads = [threading.Thread(target=slot, args=(i,), name=f"worker-{i}", daemon=True)
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            # Poll instead of join() so Ctrl-C reaches this thread
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        logger.info("Worker interrupted; unfinished tasks return to the queue "
+                    "when their leases expire.")
+        stop.set()
+    return sum(totals)
+
+
+def enqueue(url: str, count: int, title: str, resume: bool = False,
+            author: str = None, cover: str = None, prefetch: str = None,
+            toc_url: str = None, engine: str = None, formats=None,
+            chunked: bool = None, use_cache: bool = None, upload: bool = True,
+            queue: WorkQueue = None) -> None:
+    """
+    Publish a title for the workers.
+
+    Settings left as None are filled in by each worker from its own .env.
+
+    Args:
+        url, count, title, resume, author, cover, prefetch, toc_url, engine,
+            formats: As for pipeline.run_pipeline.
+        chunked, use_cache: As for tts.generate_audio.
+        upload: Upload the title's output folder once it is compiled.
+        queue: Queue to publish to (defaults to work_queue.open_queue()).
+
+    Raises:
+        ValueError: if the title is already queued, or for an unknown engine
+            or output format.
+    """
+    from echopage import audio, tts_engines
+
+    if engine and engine not in tts_engines.ENGINES:
+        raise ValueError(f"Unknown TTS engine '{engine}' (use {', '.join(tts_engines.ENGINES)})")
+    if formats is not None:
+        formats = ",".join(audio.output_profiles(formats))
+    queue = queue or work_queue.open_queue()
+    queue.enqueue_title(title, {
+        "url": url, "count": count, "resume": resume, "author": author, "cover": cover,
+        "prefetch": prefetch, "toc_url": toc_url, "engine": engine, "formats": formats,
+        "chunked": chunked, "use_cache": use_cache, "upload": upload,
+    })
+    logger.info(f"Queued '{title}' from {url}, {count} chapters")
@@ -0,0 +1,13 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The offline stand-ins (fake Drive, TTS and ffmpeg) live with the benchmarks
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+
+@pytest.fixture(autouse=True)
+def _in_tmp_dir(tmp_path, monkeypatch):
+    """Run each test in its own directory: echopage writes output/ and cache/ relative to the cwd."""
+    monkeypatch.chdir(tmp_path)
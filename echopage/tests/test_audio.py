@@ -0,0 +1,74 @@
+import shutil
+import subprocess
+from pathlib import Path
+from zipfile import ZipFile
+
+import pytest
+
+from echopage import audio
+
+
+def _mp3s(*numbers) -> list:
+    paths = []
+    for n in numbers:
+        path = Path(f"{n:03d}_Chapter_{n}.mp3")
+        path.write_bytes(bytes([n % 256]) * 100)
+        paths.append(path)
+    return paths
+
+
+def test_zip_lists_chapters_in_order_whatever_order_they_finish():
+    mp3s = _mp3s(1, 2, 3, 4, 5, 6)
+    archive = audio.ChapterZip("Book.zip")
+    for i in (2, 0, 1, 3):
+        archive.add(mp3s[i])
+    archive.close()
+
+    audio.finish_zip(mp3s, "Book.zip")
+    with ZipFile("Book.zip") as z:
+        assert z.namelist() == [p.name for p in mp3s]
+        assert z.read(mp3s[2].name) == bytes([3]) * 100
+
+
+def test_appended_zip_keeps_chapter_order():
+    mp3s = _mp3s(1, 2, 3, 4, 1000)
+    audio.finish_zip(mp3s[:2], "Book.zip")
+    archive = audio.ChapterZip("Book.zip")
+    archive.add(mp3s[4])
+    archive.add(mp3s[3])
+    archive.close()
+
+    audio.finish_zip(mp3s[2:], "Book.zip", append=True)
+    with ZipFile("Book.zip") as z:
+        assert z.namelist() == [p.name for p in mp3s]
+
+
+def test_opus_chapter_starts_are_exact():
+    metadata = (";FFMETADATA1\ntitle=Book\n"
+                + audio._chapter_block("One", 0, 1993)
+                + audio._chapter_block("Two = 2", 1993, 3_725_500)
+                + audio._chapter_block("Three", 3_725_500, 3_800_000))
+    assert audio._opus_chapter_tags(metadata) == (
+        ";FFMETADATA1\ntitle=Book\n"
+        "CHAPTER000=00:00:00.000\nCHAPTER000NAME=One\n"
+        "CHAPTER001=00:00:01.993\nCHAPTER001NAME=Two \\= 2\n"
+        "CHAPTER002=01:02:05.500\nCHAPTER002NAME=Three\n")
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+def test_opus_book_round_trips_its_chapter_table(monkeypatch):
+    for name, seconds in (("a", 1.993), ("b", 2.7)):
+        subprocess.run(["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i",
+                        f"anullsrc=r=48000:cl=mono:d={seconds}", "-c:a", "libopus",
+                        "-f", "opus", f"{name}.opus"], check=True)
+    durations = {"a.opus": 1.993, "b.opus": 2.7, "Book.opus": 4.693}
+    monkeypatch.setattr(audio, "media_duration", lambda path: durations[Path(path).name])
+
+    metadata = audio.build_ffmetadata(["a.opus", "b.opus"], ["One", "Two"], "Book",
+                                      author="Ann")
+    audio._mux([Path("a.opus").resolve(), Path("b.opus").resolve()], Path("Book.opus"),
+               metadata, muxer="opus")
+
+    assert "CHAPTER001=00:00:01.993" in audio._opus_comments("Book.opus")
+    assert audio._existing_metadata(Path("Book.opus")) == metadata.replace(
+        "album_artist=", "albumartist=")
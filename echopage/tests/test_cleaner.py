@@ -0,0 +1,54 @@
+import importlib
+import json
+
+from echopage import cleaner
+
+CHAPTER = """Next Chapter
+"I will always come back to you," she said.
+*****
+He smiled.  T/N: a pun in the original
+"I will always come back to you," she said.
+"""
+
+
+def test_strips_boilerplate_and_keeps_repeated_dialogue(monkeypatch):
+    monkeypatch.setattr(cleaner, "CLEAN_DEDUP_MIN_CHARS", 0)
+    text, removed = cleaner.clean_text(CHAPTER)
+    assert text.splitlines() == [
+        '"I will always come back to you," she said.',
+        "He smiled. T/N: a pun in the original",
+        '"I will always come back to you," she said.',
+    ]
+    assert removed > 0
+
+
+def test_dedup_drops_repeated_lines_when_enabled(monkeypatch):
+    monkeypatch.setattr(cleaner, "CLEAN_DEDUP_MIN_CHARS", 30)
+    text, _ = cleaner.clean_text(CHAPTER)
+    assert text.count("come back to you") == 1
+
+
+def test_cleaning_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("TEXT_CLEANING", raising=False)
+    monkeypatch.delenv("CLEAN_DEDUP_MIN_CHARS", raising=False)
+    importlib.reload(cleaner)
+    assert not cleaner.TEXT_CLEANING
+    assert cleaner.CLEAN_DEDUP_MIN_CHARS == 0
+    assert cleaner.clean_chapter("Ch 1", CHAPTER) == ("Ch 1", CHAPTER, 0)
+
+
+def test_invalid_rules_are_skipped(tmp_path):
+    rules = tmp_path / "rules.json"
+    rules.write_text(json.dumps({
+        "strip": ["^Support us.*$", "([unclosed"],
+        "sites": {"Example.com": ["(?P<x>a)(?P<x>b)", "^Read at example\\.com$"]},
+    }))
+    loaded = cleaner._load_rules(rules)
+    assert loaded == {"strip": ["^Support us.*$"],
+                      "sites": {"example.com": ["^Read at example\\.com$"]}}
+
+
+def test_unreadable_rules_file_is_ignored(tmp_path):
+    rules = tmp_path / "rules.json"
+    rules.write_text("{not json")
+    assert cleaner._load_rules(rules) == {"strip": [], "sites": {}}
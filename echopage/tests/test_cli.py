@@ -0,0 +1,38 @@
+from click.testing import CliRunner
+
+from echopage import cli, drive_upload, pipeline
+
+
+def _fail(*args, **kwargs):
+    raise RuntimeError("boom")
+
+
+def test_run_is_the_default_command(monkeypatch):
+    calls = []
+    monkeypatch.setattr(pipeline, "run_pipeline", lambda *args, **kwargs: calls.append(args))
+    monkeypatch.setattr(drive_upload, "upload_outputs", lambda title: None)
+
+    result = CliRunner().invoke(cli.cli, ["--url", "https://example.com/1",
+                                          "--count", "3", "--title", "Book"])
+
+    assert result.exit_code == 0, result.output
+    assert calls == [("https://example.com/1", 3, "Book")]
+
+
+def test_help_lists_commands():
+    result = CliRunner().invoke(cli.cli, ["--help"])
+    assert result.exit_code == 0
+    assert "prune-cache" in result.output and "run" in result.output
+
+
+def test_failed_run_exits_non_zero(monkeypatch):
+    monkeypatch.setattr(pipeline, "run_pipeline", _fail)
+    result = CliRunner().invoke(cli.cli, ["run", "--url", "https://example.com/1",
+                                          "--count", "3", "--title", "Book"])
+    assert result.exit_code == 1
+
+
+def test_failed_stage_exits_non_zero(monkeypatch):
+    monkeypatch.setattr(pipeline, "compile_only", _fail)
+    result = CliRunner().invoke(cli.cli, ["compile", "--title", "Book"])
+    assert result.exit_code == 1
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import pytest
+from drive_fake import install_fake_drive
+
+from echopage import drive_upload
+
+CHUNK = 256 * 1024
+
+
+@pytest.fixture
+def drive(tmp_path, monkeypatch):
+    """A fake Drive under tmp_path/drive, with small chunks and no retry sleeps."""
+    for name in ("get_credentials", "build_service", "_media_upload"):
+        monkeypatch.setattr(drive_upload, name, getattr(drive_upload, name))
+    monkeypatch.setattr(drive_upload, "DRIVE_CHUNK_SIZE", CHUNK)
+    monkeypatch.setattr(drive_upload.time, "sleep", lambda seconds: None)
+    root = tmp_path / "drive"
+
+    def install(interrupt_after=None):
+        install_fake_drive(root, interrupt_after)
+        return root
+
+    install()
+    return install
+
+
+def _book(size: int) -> Path:
+    path = Path("output/Book/Book.m4b")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(os.urandom(size))
+    return path
+
+
+def _remote_md5s(root: Path) -> dict:
+    index = json.loads((root / "index.json").read_text())
+    return {f["name"]: f.get("md5Checksum") for f in index.values()}
+
+
+def _upload_state() -> dict:
+    return json.loads(drive_upload.DRIVE_UPLOAD_STATE.read_text())
+
+
+def test_rerun_skips_unchanged_files(drive, monkeypatch):
+    book = _book(3 * CHUNK + 10)
+    drive_upload.upload_outputs("Book")
+    assert _remote_md5s(drive())["Book.m4b"] == hashlib.md5(book.read_bytes()).hexdigest()
+
+    sent = []
+    upload_file = drive_upload.upload_file
+    monkeypatch.setattr(drive_upload, "upload_file",
+                        lambda *a, **k: sent.append(upload_file(*a, **k)) or sent[-1])
+    drive_upload.upload_outputs("Book")
+    assert sent == ["skipped"]
+
+
+def test_interrupted_upload_resumes_in_the_next_run(drive, monkeypatch):
+    book = _book(4 * CHUNK + 10)
+    root = drive(interrupt_after=2)
+    monkeypatch.setattr(drive_upload, "DRIVE_RETRIES", 0)
+    with pytest.raises(RuntimeError):
+        drive_upload.upload_outputs("Book")
+    [session] = _upload_state().values()
+    assert (root / "sessions" / session.rsplit("/", 1)[-1]).stat().st_size == 2 * CHUNK
+
+    drive()
+    drive_upload.upload_outputs("Book")
+    assert _upload_state() == {}
+    assert _remote_md5s(root)["Book.m4b"] == hashlib.md5(book.read_bytes()).hexdigest()
+
+
+def test_transient_failure_resumes_in_the_same_run(drive):
+    book = _book(4 * CHUNK + 10)
+    root = drive(interrupt_after=1)
+    drive_upload.upload_outputs("Book")
+    assert _upload_state() == {}
+    assert _remote_md5s(root)["Book.m4b"] == hashlib.md5(book.read_bytes()).hexdigest()
+
+
+def test_expired_session_starts_a_new_upload(drive):
+    book = _book(3 * CHUNK + 10)
+    key = f"{book.resolve()}:{drive_upload.file_md5(book)}"
+    drive_upload._update_json(drive_upload.DRIVE_UPLOAD_STATE, key, "fake://upload/expired")
+
+    drive_upload.upload_outputs("Book")
+    assert _upload_state() == {}
+    assert _remote_md5s(drive())["Book.m4b"] == hashlib.md5(book.read_bytes()).hexdigest()
+
+
+def test_folder_cache_is_per_account_and_drops_deleted_folders(drive, tmp_path):
+    _book(10)
+    root = drive()
+    drive_upload.upload_outputs("Book")
+    [(key, folder_id)] = json.loads(drive_upload.DRIVE_FOLDER_CACHE.read_text()).items()
+
+    # Another account (a second fake root) must not reuse that folder ID
+    other = tmp_path / "other"
+    install_fake_drive(other)
+    drive_upload.upload_outputs("Book")
+    assert "Book.m4b" in _remote_md5s(other)
+    assert len(json.loads(drive_upload.DRIVE_FOLDER_CACHE.read_text())) == 2
+
+    # A cached folder deleted on Drive is looked up (here: created) again
+    drive()
+    drive_upload.build_service().files().delete(fileId=folder_id).execute()
+    drive_upload.upload_outputs("Book")
+    cache = json.loads(drive_upload.DRIVE_FOLDER_CACHE.read_text())
+    assert cache[key] != folder_id
+    index = json.loads((root / "index.json").read_text())
+    assert any(f["name"] == "Book.m4b" and cache[key] in f["parents"] for f in index.values())
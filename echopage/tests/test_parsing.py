@@ -0,0 +1,47 @@
+import pytest
+
+from echopage import parsing
+
+PAGE = """<html><head><title>x</title><style>body {}</style></head><body>
+<h1> Chapter 7: The Storm </h1>
+<div id="content">
+  <p>First paragraph.</p>
+  <script>var ad = "buy now";</script>
+  <p>Second <b>bold</b> paragraph.</p>
+  <noscript>Enable JavaScript</noscript>
+  <style>.x { color: red }</style>
+</div>
+<ul class="toc"><li><a href="/c/1">1</a></li><li><a>no link</a></li><li><a href="/c/2">2</a></li></ul>
+<a class="next" href="/c/8">Next</a>
+</body></html>"""
+
+SELECTORS = ("h1", "#content", "a.next")
+
+
+@pytest.fixture(params=parsing.available_backends())
+def backend(request):
+    return parsing.get_backend(*SELECTORS, name=request.param)
+
+
+def test_extracts_title_next_link_and_hrefs(backend):
+    doc = backend.parse(PAGE)
+    assert backend.title(doc) == "Chapter 7: The Storm"
+    assert backend.next_href(doc) == "/c/8"
+    assert backend.hrefs(doc, "ul.toc a") == ["/c/1", "/c/2"]
+    assert backend.hrefs(doc, "ul.toc a") == ["/c/1", "/c/2"]
+
+
+def test_content_has_no_script_or_style_text(backend):
+    text = backend.content(backend.parse(PAGE))
+    assert "First paragraph." in text and "bold" in text
+    assert "buy now" not in text
+    assert "JavaScript" not in text
+    assert "color" not in text
+
+
+def test_backends_extract_the_same_words():
+    words = {}
+    for name in parsing.available_backends():
+        backend = parsing.get_backend(*SELECTORS, name=name)
+        words[name] = tuple(backend.content(backend.parse(PAGE)).split())
+    assert len(set(words.values())) == 1, words
@@ -0,0 +1,68 @@
+import asyncio
+import json
+import zipfile
+from pathlib import Path
+
+from drive_fake import install_fake_drive
+from fakes import NovelServer, install_fake_ffmpeg, silent_mp3
+
+from echopage import audio, drive_upload, http_client, pipeline, ratelimit, tts_engines
+from echopage.manifest import SYNTHESIZED, Manifest
+
+
+class StubEngine(tts_engines.TTSEngine):
+    """Local engine whose audio is silence, one frame per few characters."""
+
+    name = "stub"
+    remote = False
+
+    def cache_params(self):
+        return "stub", "", ""
+
+    async def voices(self):
+        return ["stub"]
+
+    async def stream(self, text):
+        yield silent_mp3(len(text) / 200)
+
+
+def test_run_pipeline_end_to_end(tmp_path, monkeypatch):
+    for name in ("encode_chapter", "media_duration", "_mux", "encode_pool"):
+        monkeypatch.setattr(audio, name, getattr(audio, name))
+    install_fake_ffmpeg()
+    for name in ("get_credentials", "build_service", "_media_upload"):
+        monkeypatch.setattr(drive_upload, name, getattr(drive_upload, name))
+    install_fake_drive(tmp_path / "drive")
+    monkeypatch.setitem(tts_engines.ENGINES, "stub", StubEngine)
+    monkeypatch.setitem(tts_engines._engines, "stub", StubEngine())
+    monkeypatch.setattr(ratelimit, "SCRAPE_RATE", 1000.0)
+    monkeypatch.setattr(http_client, "HTTP_CACHE_ENABLED", False)
+
+    with NovelServer(chapters=4, words=60) as server:
+        output = pipeline.run_pipeline(server.start_url, 10, "Book", engine="stub",
+                                       use_cache=False, backend="threads",
+                                       formats="m4b,zip")
+    drive_upload.upload_outputs("Book")
+
+    book = Path("output/Book")
+    assert Path(output) == book / "Book.m4b" and Path(output).stat().st_size > 0
+    manifest = Manifest.load("Book")
+    assert sorted(manifest.chapters) == [1, 2, 3, 4]
+    assert all(manifest.is_done(n, SYNTHESIZED) for n in manifest.chapters)
+    with zipfile.ZipFile(book / "Book.zip") as archive:
+        assert [Path(name).name[:3] for name in archive.namelist()] == ["001", "002", "003", "004"]
+    index = json.loads((tmp_path / "drive" / "index.json").read_text())
+    assert {"Book.m4b", "Book.zip"} <= {f["name"] for f in index.values()}
+
+
+def test_piper_voices_skip_models_without_a_valid_config(tmp_path):
+    for name, config in (("good", {"audio": {"sample_rate": 22050}}),
+                         ("broken", "{not json"), ("incomplete", {"audio": {}}),
+                         ("missing", None)):
+        (tmp_path / f"{name}.onnx").write_bytes(b"")
+        if config is not None:
+            text = config if isinstance(config, str) else json.dumps(config)
+            (tmp_path / f"{name}.onnx.json").write_text(text)
+
+    engine = tts_engines.PiperEngine(model=str(tmp_path / "good.onnx"))
+    assert asyncio.run(engine.voices()) == ["good"]
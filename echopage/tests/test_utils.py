@@ -0,0 +1,31 @@
+from echopage.utils import chunk_text
+
+
+def test_short_text_is_one_chunk():
+    assert chunk_text("  Hello there.  ") == ["Hello there."]
+    assert chunk_text("   ") == []
+
+
+def test_breaks_after_closing_quotes_and_brackets():
+    text = '"Run!" she said. "Where?" he asked. (He ran.) Then silence.'
+    chunks = chunk_text(text, max_chars=20)
+    assert chunks == ['"Run!" she said.', '"Where?" he asked.', "(He ran.)", "Then silence."]
+
+
+def test_breaks_at_line_ends_without_punctuation():
+    text = "Chapter One\n\nA heading without a full stop\nThen the text goes on"
+    assert chunk_text(text, max_chars=30) == [
+        "Chapter One", "A heading without a full stop", "Then the text goes on"]
+
+
+def test_long_sentence_falls_back_to_spaces_and_hard_cuts():
+    assert chunk_text("aaaa bbbb cccc", max_chars=9) == ["aaaa bbbb", "cccc"]
+    assert chunk_text("abcdefghij", max_chars=4) == ["abcd", "efgh", "ij"]
+
+
+def test_chunks_respect_the_limit_and_keep_every_word():
+    text = " ".join(f'"Line {i}," he said. She nodded!' for i in range(200))
+    chunks = chunk_text(text, max_chars=100)
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert " ".join(chunks).split() == text.split()
+    assert all(chunk.endswith("!") for chunk in chunks)
@@ -0,0 +1,91 @@
+import types
+
+import pytest
+
+from echopage import cache, pipeline, work_queue, worker
+from echopage.work_queue import COMPILE, DONE, FAILED, PENDING, SCRAPE, TTS, SQLiteQueue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """The queue's wall clock, moved forward by hand."""
+    now = [1000.0]
+    monkeypatch.setattr(work_queue, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    q = SQLiteQueue(tmp_path / "queue.sqlite", lease_seconds=10, max_attempts=2)
+    yield q
+    q.close()
+
+
+def test_expired_lease_is_reclaimed(queue, clock):
+    queue.enqueue_title("Book", {"url": "u"})
+    first = queue.claim("a")
+    assert queue.claim("b") is None
+
+    clock[0] += 11
+    second = queue.claim("b")
+    assert (second["id"], second["attempts"]) == (first["id"], 2)
+    # The worker that lost its lease can neither renew nor finish the task
+    assert not queue.heartbeat(first["id"], "a")
+    assert not queue.complete(first["id"], "a", {"by": "a"})
+    assert queue.complete(second["id"], "b", {"by": "b"})
+    assert queue.results("Book", SCRAPE) == [(0, {"by": "b"})]
+
+
+def test_task_is_dropped_after_max_attempts(queue, clock):
+    queue.enqueue_title("Book", {})
+    task = queue.claim("a")
+    queue.complete(task["id"], "a", {}, [(TTS, 1, {}), (TTS, 2, {})])
+
+    task = queue.claim("a")
+    queue.fail(task["id"], "a", "boom")
+    clock[0] += 60
+    task = queue.claim("a")
+    assert (task["number"], task["attempts"]) == (1, 2)
+    queue.fail(task["id"], "a", "boom")
+
+    # Chapter 2's lease runs out on its last attempt too
+    task = queue.claim("a")
+    assert task["number"] == 2
+    clock[0] += 11
+    assert queue.claim("b")["number"] == 2
+    clock[0] += 11
+    compile_task = queue.claim("b")
+
+    assert queue.counts("Book")["Book"][TTS] == {FAILED: 2}
+    assert compile_task["kind"] == COMPILE
+
+
+def test_compile_is_published_once_after_the_last_chapter(queue, clock):
+    queue.enqueue_title("Book", {"formats": "m4b"})
+    scrape = queue.claim("a", (SCRAPE,))
+    # The scraper publishes chapters as it goes; its follow-ups repeat them
+    queue.publish("Book", [(TTS, 1, {})])
+    queue.complete(scrape["id"], "a", {}, [(TTS, 1, {}), (TTS, 2, {}), (TTS, 3, {})])
+
+    for number in (1, 2, 3):
+        assert COMPILE not in queue.counts("Book")["Book"]
+        task = queue.claim("a", (TTS,))
+        assert task["number"] == number
+        queue.complete(task["id"], "a", {"mp3_path": f"{number}.mp3"})
+
+    assert queue.counts("Book")["Book"][COMPILE] == {PENDING: 1}
+    task = queue.claim("a")
+    assert (task["kind"], task["payload"]) == (COMPILE, {"formats": "m4b"})
+    queue.complete(task["id"], "a", {})
+    queue.publish("Book", [(TTS, 3, {})])
+    assert queue.counts("Book")["Book"][COMPILE] == {DONE: 1}
+
+
+def test_compile_prunes_the_tts_cache_once(queue, monkeypatch):
+    pruned = []
+    monkeypatch.setattr(pipeline, "compile_only", lambda *args, **kwargs: "Book.m4b")
+    monkeypatch.setattr(cache, "prune", lambda: pruned.append(True))
+    task = {"title": "Book", "payload": {"upload": False, "use_cache": True}}
+
+    assert worker._run_compile(task, queue, None) == ({"output": "Book.m4b"}, [])
+    assert pruned == [True]